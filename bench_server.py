@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Benchmark harness for spa_server.py.
+
+Starts the server on a free loopback port (or targets --url), drives it with
+concurrent keep-alive clients over a weighted mix of routes, and prints a
+JSON report with throughput, latency percentiles and server CPU time per
+request, tagged with the current git commit so runs can be compared.
+
+Example:
+
+  python bench_server.py --concurrency 32 --duration 10 \\
+      --mix fallback:5,css:3,wheel:1 --server-args "--engine asyncio"
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+ROUTES = {
+    'index': '/',
+    'fallback': '/test',
+    'css': '/dist/styles.css',
+    'confetti': '/dist/confetti.module.mjs',
+    'app': '/hello_world.py',
+    'config': '/pyscript.json',
+    'wheel': '/puepy-0.6.5-py3-none-any.whl',
+}
+DEFAULT_MIX = 'fallback:5,css:3,wheel:1'
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def parse_mix(spec):
+    """Parse 'name:weight,...' into [(name, path, weight)]; names may be raw paths."""
+    mix = []
+    for item in spec.split(','):
+        name, _, weight = item.strip().partition(':')
+        path = name if name.startswith('/') else ROUTES.get(name)
+        if path is None:
+            raise argparse.ArgumentTypeError(f"unknown route {name!r}; use a path or one of {', '.join(ROUTES)}")
+        mix.append((name, path, float(weight or 1)))
+    return mix
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def latency_summary(samples):
+    ordered = sorted(samples)
+    def ms(value):
+        return None if value is None else round(value * 1000, 3)
+    return {
+        'p50': ms(percentile(ordered, 0.50)),
+        'p95': ms(percentile(ordered, 0.95)),
+        'p99': ms(percentile(ordered, 0.99)),
+        'max': ms(ordered[-1] if ordered else None),
+        'mean': ms(sum(ordered) / len(ordered) if ordered else None),
+    }
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_for_port(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"server did not start listening on port {port}")
+
+def process_tree_cpu(pid):
+    """Return user+system CPU seconds of `pid` and its descendants, or None.
+
+    Reads /proc, so it is only available on Linux.
+    """
+    ticks = os.sysconf('SC_CLK_TCK')
+    total = 0
+    pending = [pid]
+    try:
+        while pending:
+            current = pending.pop()
+            with open(f'/proc/{current}/stat') as f:
+                # The command name may contain spaces; fields follow the last ')'
+                fields = f.read().rsplit(')', 1)[1].split()
+            total += int(fields[11]) + int(fields[12])
+            for task in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{task}/children') as f:
+                    pending.extend(int(child) for child in f.read().split())
+    except (OSError, ValueError, IndexError):
+        return None
+    return total / ticks
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class Client(threading.Thread):
+    """One keep-alive connection issuing requests from the mix until stopped."""
+
+    def __init__(self, host, port, mix, headers, seed, keepalive, stop):
+        super().__init__(daemon=True)
+        self.host = host
+        self.port = port
+        self.paths = [(name, path) for name, path, _ in mix]
+        self.weights = [weight for _, _, weight in mix]
+        self.headers = headers
+        self.random = random.Random(seed)
+        self.keepalive = keepalive
+        self.stop = stop
+        self.recording = False
+        self.samples = {name: [] for name, _, _ in mix}
+        self.errors = 0
+        self.bytes_received = 0
+
+    def run(self):
+        connection = None
+        while not self.stop.is_set():
+            name, path = self.random.choices(self.paths, self.weights)[0]
+            if connection is None:
+                connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            headers = dict(self.headers)
+            if not self.keepalive:
+                headers['Connection'] = 'close'
+            started = time.perf_counter()
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+                ok = response.status < 400
+                if response.will_close:
+                    connection.close()
+                    connection = None
+            except (OSError, http.client.HTTPException):
+                ok = False
+                body = b''
+                connection.close()
+                connection = None
+            elapsed = time.perf_counter() - started
+            if self.recording:
+                if ok:
+                    self.samples[name].append(elapsed)
+                    self.bytes_received += len(body)
+                else:
+                    self.errors += 1
+        if connection is not None:
+            connection.close()
+
+def run_load(host, port, args, headers):
+    stop = threading.Event()
+    clients = [Client(host, port, args.mix, headers, args.seed + i, not args.no_keepalive, stop)
+               for i in range(args.concurrency)]
+    for client in clients:
+        client.start()
+    time.sleep(args.warmup)
+    for client in clients:
+        client.recording = True
+    return clients, stop
+
+def benchmark(args):
+    headers = dict(header.split(':', 1) for header in args.header)
+    headers = {key.strip(): value.strip() for key, value in headers.items()}
+    server = None
+    if args.url:
+        target = urlparse(args.url)
+        host, port = target.hostname, target.port or 80
+    else:
+        for name, path, _ in args.mix:
+            # A missing file would be answered with index.html and timed as such
+            if name in ROUTES and path != '/' and name != 'fallback' \
+                    and not os.path.isfile(os.path.join(args.root, path.lstrip('/'))):
+                sys.exit(f"{path} not found under {args.root}; run `npm run build` first")
+        host, port = '127.0.0.1', free_port()
+        command = [sys.executable, os.path.join(HERE, 'spa_server.py'), str(port), *shlex.split(args.server_args)]
+        server = subprocess.Popen(command, cwd=args.root, stdout=subprocess.DEVNULL,
+                                  stderr=None if args.server_log else subprocess.DEVNULL)
+    try:
+        if server is not None:
+            wait_for_port(port)
+        clients, stop = run_load(host, port, args, headers)
+        cpu_before = process_tree_cpu(server.pid) if server is not None else None
+        started = time.perf_counter()
+        time.sleep(args.duration)
+        for client in clients:
+            client.recording = False
+        elapsed = time.perf_counter() - started
+        cpu_after = process_tree_cpu(server.pid) if server is not None else None
+        stop.set()
+        for client in clients:
+            client.join(timeout=5)
+    finally:
+        if server is not None:
+            server.send_signal(signal.SIGTERM)
+            try:
+                server.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    samples = {name: [] for name, _, _ in args.mix}
+    for client in clients:
+        for name, values in client.samples.items():
+            samples[name].extend(values)
+    everything = [value for values in samples.values() for value in values]
+    requests = len(everything)
+    server_cpu = None if cpu_before is None or cpu_after is None else cpu_after - cpu_before
+    return {
+        'commit': git_commit(),
+        'config': {
+            'concurrency': args.concurrency,
+            'duration_s': args.duration,
+            'warmup_s': args.warmup,
+            'keepalive': not args.no_keepalive,
+            'mix': {name: {'path': path, 'weight': weight} for name, path, weight in args.mix},
+            'headers': headers,
+            'server_args': None if args.url else args.server_args,
+            'url': args.url,
+        },
+        'requests': requests,
+        'errors': sum(client.errors for client in clients),
+        'elapsed_s': round(elapsed, 3),
+        'rps': round(requests / elapsed, 1),
+        'bytes_received': sum(client.bytes_received for client in clients),
+        'latency_ms': latency_summary(everything),
+        'server_cpu_s': None if server_cpu is None else round(server_cpu, 3),
+        'cpu_per_request_ms': None if server_cpu is None or not requests else round(server_cpu / requests * 1000, 4),
+        'routes': {name: {'requests': len(values), 'latency_ms': latency_summary(values)}
+                   for name, values in samples.items()},
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark spa_server.py over a weighted route mix.')
+    parser.add_argument('--concurrency', '-c', type=int, default=16, help='concurrent client connections (default: 16)')
+    parser.add_argument('--duration', '-d', type=float, default=10.0, help='measured seconds (default: 10)')
+    parser.add_argument('--warmup', type=float, default=1.0, help='unmeasured seconds before recording (default: 1)')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"weighted routes as name:weight, names from {', '.join(ROUTES)} or raw paths "
+                             f"(default: {DEFAULT_MIX})")
+    parser.add_argument('--header', '-H', action='append', default=[],
+                        help="extra request header, e.g. 'Accept-Encoding: gzip' (repeatable)")
+    parser.add_argument('--no-keepalive', action='store_true', help='open a new connection for every request')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for the route mix (default: 1)')
+    parser.add_argument('--server-args', default='', help='extra arguments for spa_server.py, e.g. "--engine asyncio"')
+    parser.add_argument('--server-log', action='store_true', help="show the server's log output")
+    parser.add_argument('--root', default=HERE, help='directory to serve (default: this repository)')
+    parser.add_argument('--url', help='benchmark an already running server instead of starting one')
+    parser.add_argument('--output', '-o', help='also write the JSON report to this file')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = benchmark(args)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+if __name__ == "__main__":
+    main()
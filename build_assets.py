@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+"""
+Build steps for the static assets served by spa_server.py.
+
+  compress     write .gz (and .zst where the stdlib supports it) siblings for
+               compressible assets, so the server can send them precompressed
+  fingerprint  copy the app into an output directory with content-hashed
+               asset names and rewrite the references in index.html and
+               pyscript.json, so the assets can be cached as immutable
+  prerender    render the PuePy pages into index.html so the first paint
+               shows the app instead of a spinner (see prerender.py)
+  bundle       replace the app script and its local wheels with one archive
+               of the modules the app imports, precompiled to MicroPython
+               bytecode when mpy-cross is installed
+  pack         write every servable file of a tree into one asset pack,
+               which `spa_server.py --pack` maps into memory (see AssetPack)
+"""
+
+import argparse
+import ast
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import zipfile
+
+from spa_server import (ENCODING_SUFFIXES, FINGERPRINT_LENGTH, PACK_MAGIC, RouteManifest, asset_etag,
+                        is_compressible, preload_links)
+
+try:
+    from compression import zstd
+except ImportError:  # Python < 3.14
+    zstd = None
+
+try:
+    import mpy_cross
+except ImportError:  # pip install mpy-cross
+    mpy_cross = None
+
+DEFAULT_ASSETS = ['index.html', 'pyscript.json', 'hello_world.py', 'dist']
+DEFAULT_OUT_DIR = 'build'
+DEFAULT_PACK = 'app.pack'
+BUNDLE_NAME = 'app.zip'
+# Fixed member timestamps keep the bundle (and so its hash) reproducible
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+ASSET_MANIFEST = 'asset-manifest.json'
+MIN_SIZE = 256
+# Only keep a variant that saves at least this fraction of the original size.
+MIN_SAVING = 0.05
+
+def iter_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        elif os.path.isfile(path):
+            yield path
+
+def compressors():
+    yield 'gzip', lambda data: gzip.compress(data, compresslevel=9, mtime=0)
+    if zstd is not None:
+        yield 'zstd', lambda data: zstd.compress(data, level=19)
+
+def compress_assets(paths, min_size=MIN_SIZE):
+    """Write compressed siblings for every compressible file under `paths`."""
+    suffixes = tuple(ENCODING_SUFFIXES.values())
+    written = 0
+    for path in iter_files(paths):
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if path.endswith(suffixes) or not is_compressible(content_type):
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < min_size:
+            continue
+        for encoding, compress in compressors():
+            variant_path = path + ENCODING_SUFFIXES[encoding]
+            body = compress(data)
+            if len(body) > len(data) * (1 - MIN_SAVING):
+                if os.path.exists(variant_path):
+                    os.remove(variant_path)
+                continue
+            with open(variant_path, 'wb') as f:
+                f.write(body)
+            written += 1
+            print(f"{variant_path}: {len(data)} -> {len(body)} bytes")
+    return written
+
+def content_hash(data):
+    return hashlib.blake2b(data, digest_size=FINGERPRINT_LENGTH // 2).hexdigest()
+
+def fingerprinted_name(relpath, digest):
+    """Return the content-addressed name for `relpath` (a '/'-separated path).
+
+    Wheels keep their file name, which installers parse, and move into a
+    directory named after the hash instead.
+    """
+    directory, name = posixpath.split(relpath)
+    if name.endswith('.whl'):
+        return posixpath.join(directory, digest, name)
+    stem, ext = posixpath.splitext(name)
+    return posixpath.join(directory, f'{stem}.{digest}{ext}')
+
+def local_ref(ref):
+    """Return the repository-relative path of a './path' reference, or None."""
+    if re.match(r'^[a-z][a-z0-9+.-]*:|^/', ref, re.IGNORECASE):
+        return None
+    return posixpath.normpath(ref)
+
+def rewrite_refs(text, mapping):
+    """Replace quoted references to mapped files (with or without './')."""
+    for original, renamed in mapping.items():
+        pattern = r'(?<=["\'])(\./)?' + re.escape(original) + r'(?=["\'])'
+        text = re.sub(pattern, lambda match: (match.group(1) or '') + renamed, text)
+    return text
+
+class Fingerprinter:
+    """Copies files from `root` to `out_dir` under content-hashed names."""
+
+    def __init__(self, root, out_dir):
+        self.root = root
+        self.out_dir = out_dir
+        self.mapping = {}
+
+    def add(self, relpath, data=None):
+        if data is None:
+            with open(os.path.join(self.root, relpath), 'rb') as f:
+                data = f.read()
+        renamed = fingerprinted_name(relpath, content_hash(data))
+        target = os.path.join(self.out_dir, renamed)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(data)
+        self.mapping[relpath] = renamed
+        return renamed
+
+    def write(self, relpath, data):
+        target = os.path.join(self.out_dir, relpath)
+        os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(data)
+
+def fingerprint_app(root, out_dir, entry='index.html', config='pyscript.json', records_api=None):
+    """Build a fingerprinted copy of the app in `out_dir`; return the rename map.
+
+    Leaf assets (dist/ and local packages) are hashed first, then the files
+    that reference them (pyscript.json, then the scripts and index.html), so
+    every hash covers the final bytes of its file. `records_api`, if given,
+    is written to the config as the app's records API base URL ('' for the
+    serving origin).
+    """
+    root = os.path.abspath(root)
+    out_dir = os.path.abspath(out_dir)
+    if root == out_dir or root.startswith(out_dir + os.sep):
+        raise ValueError(f"output directory {out_dir} must not contain the source tree")
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+    build = Fingerprinter(root, out_dir)
+
+    for path in iter_files([os.path.join(root, 'dist')]):
+        relpath = os.path.relpath(path, root).replace(os.sep, '/')
+        if not relpath.endswith(tuple(ENCODING_SUFFIXES.values())):
+            build.add(relpath)
+
+    with open(os.path.join(root, config)) as f:
+        pyscript_config = json.load(f)
+    packages = []
+    for package in pyscript_config.get('packages', []):
+        relpath = local_ref(package)
+        # Anything else is a package name for PyScript to install
+        local = relpath and relpath.endswith('.whl')
+        packages.append('./' + build.add(relpath) if local else package)
+    pyscript_config['packages'] = packages
+    files = {}
+    for url, destination in pyscript_config.get('files', {}).items():
+        relpath = local_ref(url)
+        files['./' + build.add(relpath) if relpath else url] = destination
+    pyscript_config['files'] = files
+    if records_api is not None:
+        pyscript_config['records_api'] = records_api
+    build.add(config, json.dumps(pyscript_config, indent=4).encode('utf-8'))
+
+    with open(os.path.join(root, entry), encoding='utf-8') as f:
+        html = f.read()
+    for script in re.findall(r'<script[^>]*\bsrc="([^"]+)"', html):
+        relpath = local_ref(script)
+        if relpath and relpath not in build.mapping and os.path.isfile(os.path.join(root, relpath)):
+            build.add(relpath)
+    build.write(entry, rewrite_refs(html, build.mapping).encode('utf-8'))
+    build.write(ASSET_MANIFEST, json.dumps(build.mapping, indent=2, sort_keys=True).encode('utf-8'))
+    return build.mapping
+
+def wheel_modules(path):
+    """Return {dotted module name: (member name, source)} for the modules in a wheel."""
+    modules = {}
+    with zipfile.ZipFile(path) as wheel:
+        for member in wheel.namelist():
+            if not member.endswith('.py') or '.dist-info/' in member or '.data/' in member:
+                continue
+            parts = member[:-len('.py')].split('/')
+            if parts[-1] == '__init__':
+                parts.pop()
+            modules['.'.join(parts)] = (member, wheel.read(member).decode('utf-8'))
+    return modules
+
+def imported_names(source, module='', is_package=False):
+    """Yield every module name `source` may import, anywhere in the file.
+
+    For `from a import b` both `a` and `a.b` are yielded, since `b` may be a
+    submodule; relative imports are resolved against `module`.
+    """
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                yield alias.name
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ''
+            if node.level:
+                package = module.split('.') if is_package else module.split('.')[:-1]
+                package = package[:len(package) - node.level + 1]
+                base = '.'.join(package + ([node.module] if node.module else []))
+            yield base
+            for alias in node.names:
+                yield f'{base}.{alias.name}'
+
+def import_closure(source, modules):
+    """Return the names in `modules` that `source` imports, directly or not."""
+    needed = set()
+    pending = list(imported_names(source))
+    while pending:
+        parts = pending.pop().split('.')
+        # Importing a.b.c runs a/__init__ and a/b/__init__ first
+        for i in range(1, len(parts) + 1):
+            name = '.'.join(parts[:i])
+            if name in modules and name not in needed:
+                needed.add(name)
+                member, module_source = modules[name]
+                pending.extend(imported_names(module_source, name, member.endswith('/__init__.py')))
+    return needed
+
+def compile_mpy(source, filename):
+    """Compile `source` to MicroPython bytecode with mpy-cross; return the .mpy bytes."""
+    with tempfile.TemporaryDirectory() as tmp:
+        source_path = os.path.join(tmp, 'module.py')
+        output_path = os.path.join(tmp, 'module.mpy')
+        with open(source_path, 'w', encoding='utf-8') as f:
+            f.write(source)
+        process = mpy_cross.run('-s', filename, '-o', output_path, source_path,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = process.communicate()[0].decode('utf-8', 'replace')
+        if process.returncode != 0:
+            raise RuntimeError(f"mpy-cross failed on {filename}:\n{output}")
+        with open(output_path, 'rb') as f:
+            return f.read()
+
+def bundle_app(root, module='hello_world', entry='index.html', precompile=True):
+    """Replace the PyScript app script of `root`/`entry` and its local wheels by one archive.
+
+    The archive holds the app as `module` plus the wheel modules it imports,
+    compiled to .mpy for a MicroPython script when `precompile` is set and
+    mpy-cross is installed (sources otherwise). It is listed in a rewritten
+    pyscript config to be unpacked next to the app, and the script tag just
+    imports `module`. Run on a fingerprinted (and prerendered) build; the
+    replaced files are deleted. Returns (bundle name, {member: size}).
+    """
+    entry_path = os.path.join(root, entry)
+    with open(entry_path, encoding='utf-8') as f:
+        html = f.read()
+    tag = re.search(r'<script[^>]*\btype="(m?py)"[^>]*\bsrc="([^"]+)"[^>]*>\s*</script>', html)
+    config_ref = tag and re.search(r'\bconfig="([^"]+)"', tag.group(0))
+    if tag is None or config_ref is None:
+        raise ValueError(f'no <script type="mpy"> or <script type="py"> with a src and config in {entry_path}')
+    script = local_ref(tag.group(2))
+    config = local_ref(config_ref.group(1))
+    with open(os.path.join(root, config)) as f:
+        pyscript_config = json.load(f)
+    with open(os.path.join(root, script), encoding='utf-8') as f:
+        app_source = f.read()
+
+    modules, wheels, packages = {}, [], []
+    for package in pyscript_config.get('packages', []):
+        relpath = local_ref(package)
+        if relpath and relpath.endswith('.whl'):
+            wheels.append(relpath)
+            modules.update(wheel_modules(os.path.join(root, relpath)))
+        else:
+            packages.append(package)
+
+    precompile = precompile and tag.group(1) == 'mpy'
+    if precompile and mpy_cross is None:
+        print("mpy-cross not installed (pip install mpy-cross); bundling sources", file=sys.stderr)
+        precompile = False
+    members = {}
+    sources = [(f'{module}.py', app_source)]
+    sources += [modules[name] for name in sorted(import_closure(app_source, modules))]
+    for member, source in sources:
+        if precompile:
+            members[member[:-len('.py')] + '.mpy'] = compile_mpy(source, member)
+        else:
+            members[member] = source.encode('utf-8')
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED, compresslevel=9) as archive:
+        for member, data in members.items():
+            archive.writestr(zipfile.ZipInfo(member, ZIP_DATE_TIME), data, zipfile.ZIP_DEFLATED)
+    data = buffer.getvalue()
+    bundle = fingerprinted_name(BUNDLE_NAME, content_hash(data))
+    with open(os.path.join(root, bundle), 'wb') as f:
+        f.write(data)
+
+    pyscript_config['packages'] = packages
+    pyscript_config['files'] = {**pyscript_config.get('files', {}), './' + bundle: './*'}
+    config_data = json.dumps(pyscript_config, indent=4).encode('utf-8')
+    new_config = fingerprinted_name(re.sub(r'\.[0-9a-f]{%d}(?=\.json$)' % FINGERPRINT_LENGTH, '', config),
+                                    content_hash(config_data))
+    with open(os.path.join(root, new_config), 'wb') as f:
+        f.write(config_data)
+    bootstrap = re.sub(r'\s+src="[^"]*"', '', tag.group(0))
+    bootstrap = re.sub(r'>\s*</script>$', f'>import {module}</script>', bootstrap)
+    html = rewrite_refs(html.replace(tag.group(0), bootstrap), {config: new_config})
+    with open(entry_path, 'w', encoding='utf-8') as f:
+        f.write(html)
+
+    for relpath in [script, config] + wheels:
+        if relpath != new_config:
+            os.remove(os.path.join(root, relpath))
+            # Wheels sit in a directory named after their hash
+            directory = os.path.dirname(os.path.join(root, relpath))
+            if directory != os.path.normpath(root) and not os.listdir(directory):
+                os.rmdir(directory)
+    manifest_path = os.path.join(root, ASSET_MANIFEST)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            mapping = json.load(f)
+        mapping = {original: (new_config if renamed == config else renamed)
+                   for original, renamed in mapping.items() if renamed not in (script, *wheels)}
+        mapping[BUNDLE_NAME] = bundle
+        with open(manifest_path, 'w') as f:
+            f.write(json.dumps(mapping, indent=2, sort_keys=True))
+    return bundle, {member: len(data) for member, data in members.items()}
+
+def pack_assets(root, out):
+    """Write the files RouteManifest serves from `root` into the pack `out`.
+
+    Returns the number of files packed. The pack is written next to `out`
+    and renamed into place, so servers mapping the old one are unaffected.
+    """
+    manifest = RouteManifest(root)
+    files, index, bodies = [], {}, []
+    offset = 0
+    for url, entry in sorted(manifest.routes.items()):
+        if entry.path in index:
+            continue
+        with open(entry.path, 'rb') as f:
+            body = f.read()
+        index[entry.path] = len(files)
+        files.append({
+            'name': os.path.relpath(entry.path, manifest.root).replace(os.sep, '/'),
+            'offset': offset,
+            'length': len(body),
+            'content_type': entry.content_type,
+            'etag': asset_etag(body),
+            'mtime': entry.mtime_ns / 1e9,
+            'variants': {},
+        })
+        bodies.append(body)
+        offset += len(body)
+    for entry in {entry.path: entry for entry in manifest.routes.values()}.values():
+        files[index[entry.path]]['variants'] = {encoding: index[variant.path]
+                                                for encoding, variant in entry.variants.items()}
+    header = json.dumps({
+        'files': files,
+        'routes': {url: index[entry.path] for url, entry in sorted(manifest.routes.items())},
+        'links': preload_links(manifest.root),
+    }, separators=(',', ':')).encode('utf-8')
+    partial = out + '.tmp'
+    with open(partial, 'wb') as f:
+        f.write(PACK_MAGIC + len(header).to_bytes(8, 'big') + header)
+        for body in bodies:
+            f.write(body)
+    os.replace(partial, out)
+    return len(files)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Build steps for the static assets.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    compress = commands.add_parser('compress', help='write precompressed .gz/.zst siblings')
+    compress.add_argument('paths', nargs='*', default=DEFAULT_ASSETS,
+                          help='files or directories to compress (default: the app assets)')
+    compress.add_argument('--min-size', type=int, default=MIN_SIZE,
+                          help=f'skip files smaller than this many bytes (default: {MIN_SIZE})')
+
+    fingerprint = commands.add_parser('fingerprint', help='write a content-hashed copy of the app')
+    fingerprint.add_argument('--root', default='.', help='app source directory (default: .)')
+    fingerprint.add_argument('--out-dir', default=DEFAULT_OUT_DIR,
+                             help=f'output directory, replaced on every run (default: {DEFAULT_OUT_DIR})')
+    fingerprint.add_argument('--records-api', metavar='URL',
+                             help="records API base URL for the app; '' for the serving origin, when "
+                                  "spa_server.py runs with --records-api or --records-upstream")
+
+    prerender = commands.add_parser('prerender', help='render the app pages into index.html (needs puepy)')
+    prerender.add_argument('root', nargs='?', default=DEFAULT_OUT_DIR,
+                           help=f'app directory whose index.html is rewritten (default: {DEFAULT_OUT_DIR})')
+    prerender.add_argument('--entry', default='index.html', help='HTML shell to prerender into (default: index.html)')
+
+    bundle = commands.add_parser('bundle', help='bundle the app and the wheel modules it imports into one archive')
+    bundle.add_argument('root', nargs='?', default=DEFAULT_OUT_DIR,
+                        help=f'fingerprinted app directory to rewrite (default: {DEFAULT_OUT_DIR})')
+    bundle.add_argument('--module', default='hello_world', help='module name of the app script (default: hello_world)')
+    bundle.add_argument('--entry', default='index.html', help='HTML shell with the app script (default: index.html)')
+    bundle.add_argument('--source', dest='precompile', action='store_false',
+                        help='bundle Python sources instead of compiling them with mpy-cross')
+
+    pack = commands.add_parser('pack', help='pack the servable files into one file for spa_server.py --pack')
+    pack.add_argument('root', nargs='?', default=DEFAULT_OUT_DIR,
+                      help=f'app directory to pack (default: {DEFAULT_OUT_DIR})')
+    pack.add_argument('--out', default=DEFAULT_PACK, help=f'pack file to write (default: {DEFAULT_PACK})')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == 'compress':
+        written = compress_assets(args.paths, args.min_size)
+        if zstd is None:
+            print("zstd not available in this Python; wrote gzip variants only", file=sys.stderr)
+        print(f"Wrote {written} compressed variants")
+    elif args.command == 'fingerprint':
+        mapping = fingerprint_app(args.root, args.out_dir, records_api=args.records_api)
+        for original, renamed in sorted(mapping.items()):
+            print(f"{original} -> {renamed}")
+        print(f"Wrote fingerprinted app to {args.out_dir}")
+    elif args.command == 'prerender':
+        from prerender import prerender_app
+        routes = prerender_app(args.root, args.entry)
+        print(f"Prerendered {', '.join(routes)} into {os.path.join(args.root, args.entry)}")
+    elif args.command == 'bundle':
+        bundle, members = bundle_app(args.root, args.module, args.entry, args.precompile)
+        for member, size in members.items():
+            print(f"{member}: {size} bytes")
+        print(f"Wrote {os.path.join(args.root, bundle)} ({os.path.getsize(os.path.join(args.root, bundle))} bytes)")
+    elif args.command == 'pack':
+        count = pack_assets(args.root, args.out)
+        print(f"Packed {count} files from {args.root} into {args.out} ({os.path.getsize(args.out)} bytes)")
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,706 @@
 from puepy import Application, Page, t
+from puepy.application import DefaultIdGenerator
+from puepy.core import Tag
 from puepy.router import Router
+from puepy.runtime import create_proxy, is_server_side
+from puepy.util import patch_dom_element
 import pyscript
 from js import window
 import asyncio
 import json
 import time
+from collections import OrderedDict, deque
 
-print("[STARTUP] hello_world.py loaded, initializing application...")
+# Base URL of the TrailBase records API. pyscript.json's "records_api" key
+# (written by `build_assets.py fingerprint --records-api`) or a records_api=
+# URL parameter overrides it; an empty base means this origin, for
+# spa_server.py --records-api or --records-upstream (which shares one TrailBase
+# subscription among all tabs).
+RECORDS_API = "https://trailbase.nandi.crabdance.com"
+# Render only the stream records in or near the visible part of the list,
+# with spacers standing in for the rest
+STREAM_VIRTUALIZE = True
+# Number of stream records kept; older ones are evicted
+STREAM_CAPACITY = 1000 if STREAM_VIRTUALIZE else 50
+# Height of the stream list's scroll box and the assumed height of a record
+# that has not been rendered yet, in pixels
+STREAM_VIEWPORT_HEIGHT = 480
+STREAM_ROW_ESTIMATE = 180
+# Records rendered beyond each edge of the scroll box
+STREAM_OVERSCAN = 3
+# Rendered record cards kept for reuse by later renders
+STREAM_CARD_CACHE = 200
+# State keys saved to OPFS; changes are journaled PERSIST_DEBOUNCE ms after
+# the last one, and the journal is folded into a snapshot every
+# PERSIST_COMPACT_EVERY operations
+PERSISTED_KEYS = ("count", "input_text", "todos", "completed")
+PERSIST_DEBOUNCE = 250
+PERSIST_COMPACT_EVERY = 200
+# Log levels and categories; see Log
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LOG_LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+LOG_CATEGORIES = ("INIT", "SSE", "RENDER", "PERSIST", "API")
+# Recent log entries kept for export from the error page
+LOG_HISTORY = 200
+
+
+class Log:
+    """Leveled console logging with a threshold per category.
+
+    Messages at or above their category's level are printed; everything at
+    INFO and above is also kept in a ring of the last `history` entries for
+    `export()`. Messages are %-formatted only when printed or kept, and hot
+    paths check `enabled()` first so a disabled call site builds nothing.
+    """
+
+    def __init__(self, level=WARNING, history=LOG_HISTORY):
+        self.levels = {category: level for category in LOG_CATEGORIES}
+        self.keep = INFO
+        self.entries = [None] * history
+        self.next = 0
+
+    def configure(self, debug=False, spec=""):
+        """Set levels from pyscript.json's `debug` flag and a `log=` URL parameter.
+
+        `spec` is a comma-separated list of `category:level`, `category` (for
+        debug) or `level` (for every category), e.g. `debug` or
+        `sse:debug,render:info`.
+        """
+        if debug:
+            self.levels = {category: DEBUG for category in self.levels}
+        for item in spec.split(","):
+            if not item.strip():
+                continue
+            category, _, level = item.strip().rpartition(":")
+            if level.lower() not in LOG_LEVELS:
+                category, level = level, "debug"
+            if not category:
+                self.levels = {name: LOG_LEVELS[level.lower()] for name in self.levels}
+            elif category.upper() in self.levels:
+                self.levels[category.upper()] = LOG_LEVELS[level.lower()]
+
+    def enabled(self, category, level):
+        return level >= self.keep or level >= self.levels.get(category, WARNING)
+
+    def log(self, category, level, message, *args):
+        printed = level >= self.levels.get(category, WARNING)
+        if not printed and level < self.keep:
+            return
+        if args:
+            try:
+                message = message % args
+            except Exception:
+                message = f"{message} {args}"
+        if level >= self.keep:
+            self.entries[self.next] = (time.time(), level, category, message)
+            self.next = (self.next + 1) % len(self.entries)
+        if printed:
+            print(f"[{category}] {message}")
+
+    def debug(self, category, message, *args):
+        self.log(category, DEBUG, message, *args)
+
+    def info(self, category, message, *args):
+        self.log(category, INFO, message, *args)
+
+    def warning(self, category, message, *args):
+        self.log(category, WARNING, message, *args)
+
+    def error(self, category, message, *args):
+        self.log(category, ERROR, message, *args)
+
+    def recent(self):
+        """Return the kept entries, oldest first."""
+        entries = self.entries[self.next:] + self.entries[:self.next]
+        return [entry for entry in entries if entry is not None]
+
+    def export(self):
+        """Return the kept entries as a JSON array."""
+        names = {level: name.upper() for name, level in LOG_LEVELS.items()}
+        return json.dumps([{"time": when, "level": names.get(level, level), "category": category, "message": message}
+                           for when, level, category, message in self.recent()], indent=1)
+
+
+def url_param(name, default=""):
+    """Return the value of `name` in the page URL's query string or its hash route's."""
+    value = default
+    try:
+        # Hash routes carry their own query string, e.g. #/test?log=sse
+        location = window.location
+        query = str(location.search).lstrip("?") + "&" + str(location.hash).partition("?")[2]
+        for pair in query.split("&"):
+            key, _, found = pair.partition("=")
+            if key == name:
+                try:
+                    value = str(window.decodeURIComponent(found))
+                except Exception:
+                    value = found
+    except Exception:
+        pass
+    return value
+
+
+def _log_settings():
+    """Return (debug flag from pyscript.json, `log=` value from the page URL)."""
+    try:
+        debug = bool(pyscript.config.get("debug", False))
+    except Exception:
+        debug = False
+    return debug, url_param("log")
+
+
+log = Log()
+log.configure(*_log_settings())
+
+
+def records_api():
+    """Return the records API base URL the app talks to (see RECORDS_API)."""
+    try:
+        base = pyscript.config.get("records_api", RECORDS_API)
+    except Exception:
+        base = RECORDS_API
+    return url_param("records_api", base).rstrip("/")
+
+
+def hydrate_enabled():
+    """Whether PrerenderedPage patches a prerendered shell instead of replacing it.
+
+    Off unless pyscript.json sets `"hydrate": true` or the URL has
+    `?hydrate=1`, until patching through morphdom is checked in browsers.
+    """
+    try:
+        default = "1" if pyscript.config.get("hydrate", False) else ""
+    except Exception:
+        default = ""
+    return url_param("hydrate", default) not in ("", "0")
+
+
+HYDRATE = hydrate_enabled()
+PEOPLE_URL = records_api() + "/api/records/v1/people"
+STREAM_URL = PEOPLE_URL + "/subscribe/*"
+
+# Render timings kept by the profiler (enabled with ?profile=1), and the upper
+# bounds in ms of its histogram buckets
+PROFILE_HISTORY = 500
+PROFILE_BUCKETS = (1, 2, 4, 8, 16, 33, 66, 133, 266)
+
+
+def histogram(samples, buckets=PROFILE_BUCKETS):
+    """Count `samples` per bucket; the last count is for samples above every bound."""
+    counts = [0] * (len(buckets) + 1)
+    for sample in samples:
+        index = 0
+        while index < len(buckets) and sample > buckets[index]:
+            index += 1
+        counts[index] += 1
+    return counts
+
+
+class Profiler:
+    """Records render and stream-event timings and shows them in an overlay.
+
+    For every redraw of a page it records the state keys that triggered it,
+    how long populate() took and how long building and patching the DOM took
+    (`patch`). For every stream message it records the time from on_message
+    to the first animation frame after the redraw that showed it. The
+    overlay, toggled with its button, shows a histogram of each and exports
+    the samples as JSON. Nothing is recorded unless `enabled`.
+    """
+
+    def __init__(self, enabled=False, history=PROFILE_HISTORY):
+        self.enabled = enabled
+        self.history = history
+        self.renders = []
+        self.latencies = []
+        self.triggers = set()
+        self.populate_ms = 0
+        # Stream messages by arrival time: queued, in the state, and redrawn
+        self.arrived = []
+        self.flushed = []
+        self.painting = []
+        self.frame_requested = False
+        self.overlay = None
+        self.drawn_at = 0
+        self._frame = create_proxy(self.frame)
+        self._toggle = create_proxy(self.toggle)
+        self._export = create_proxy(self.export)
+
+    def now(self):
+        return window.performance.now()
+
+    def _keep(self, samples, sample):
+        samples.append(sample)
+        if len(samples) > 2 * self.history:
+            del samples[:-self.history]
+
+    def state_changed(self, key):
+        self.triggers.add(key)
+
+    def event_arrived(self):
+        self.arrived.append(self.now())
+
+    def stream_flushed(self):
+        self.flushed.extend(self.arrived)
+        self.arrived = []
+
+    def redraw_started(self):
+        self.populate_ms = 0
+        return self.now()
+
+    def populated(self, ms):
+        self.populate_ms += ms
+
+    def redraw_finished(self, started):
+        elapsed = self.now() - started
+        keys, self.triggers = sorted(self.triggers), set()
+        self._keep(self.renders, {"at": round(started, 1), "trigger": keys, "populate_ms": round(self.populate_ms, 2),
+                                  "patch_ms": round(elapsed - self.populate_ms, 2)})
+        if "stream_data" in keys:
+            self.painting.extend(self.flushed)
+            self.flushed = []
+        if not self.frame_requested:
+            self.frame_requested = True
+            window.requestAnimationFrame(self._frame)
+
+    def frame(self, *args):
+        self.frame_requested = False
+        now = self.now()
+        for arrived in self.painting:
+            self._keep(self.latencies, round(now - arrived, 2))
+        self.painting = []
+        if self.overlay is not None and self.overlay.style.display != "none" and now - self.drawn_at > 500:
+            self.draw()
+
+    def install(self):
+        """Add the overlay and its toggle button to the page."""
+        document = window.document
+        button = document.createElement("button")
+        button.textContent = "Profiler"
+        button.setAttribute("style", "position: fixed; right: 0.5rem; bottom: 0.5rem; z-index: 1000;"
+                                     "padding: 0.25rem 0.5rem; font: 12px monospace;")
+        button.onclick = self._toggle
+        self.overlay = document.createElement("div")
+        self.overlay.setAttribute("style", "position: fixed; right: 0.5rem; bottom: 2.5rem; z-index: 1000;"
+                                           "max-width: 28rem; padding: 0.75rem; font: 12px monospace;"
+                                           "background: rgba(17, 17, 27, 0.92); color: #cdd6f4; display: none;")
+        document.body.appendChild(self.overlay)
+        document.body.appendChild(button)
+
+    def toggle(self, *args):
+        if self.overlay.style.display == "none":
+            self.overlay.style.display = "block"
+            self.draw()
+        else:
+            self.overlay.style.display = "none"
+
+    def _histogram_html(self, title, samples):
+        counts = histogram(samples)
+        most = max(counts) or 1
+        labels = [f"\u2264{bound}" for bound in PROFILE_BUCKETS] + [f">{PROFILE_BUCKETS[-1]}"]
+        ordered = sorted(samples)
+        p50 = ordered[len(ordered) // 2] if ordered else 0
+        p95 = ordered[min(len(ordered) - 1, len(ordered) * 95 // 100)] if ordered else 0
+        rows = "".join(f"<div>{label:>5} ms <span style=\"display: inline-block; height: 0.6rem; "
+                       f"width: {round(count * 12 / most, 2)}rem; background: #89b4fa;\"></span> {count}</div>"
+                       for label, count in zip(labels, counts))
+        return (f"<div style=\"margin-bottom: 0.5rem;\"><b>{title}</b> n={len(samples)} p50={p50} p95={p95} ms"
+                f"<pre style=\"margin: 0;\">{rows}</pre></div>")
+
+    def draw(self):
+        self.drawn_at = self.now()
+        renders = self.renders[-self.history:]
+        triggers = {}
+        for render in renders:
+            for key in render["trigger"] or ["(none)"]:
+                triggers[key] = triggers.get(key, 0) + 1
+        self.overlay.innerHTML = (
+            self._histogram_html("populate()", [render["populate_ms"] for render in renders])
+            + self._histogram_html("DOM build + patch", [render["patch_ms"] for render in renders])
+            + self._histogram_html("stream event \u2192 frame", self.latencies[-self.history:])
+            + "<div>triggers: " + ", ".join(f"{key} {count}" for key, count in sorted(triggers.items())) + "</div>"
+            + "<button id=\"profiler-export\" style=\"margin-top: 0.5rem;\">Export JSON</button>")
+        window.document.getElementById("profiler-export").onclick = self._export
+
+    def samples(self):
+        return json.dumps({"renders": self.renders[-self.history:], "stream_latency_ms": self.latencies[-self.history:]})
+
+    def export(self, *args):
+        """Download the recorded samples as profile.json."""
+        link = window.document.createElement("a")
+        link.href = "data:application/json;charset=utf-8," + window.encodeURIComponent(self.samples())
+        link.download = "profile.json"
+        link.click()
+
+
+profiler = Profiler(enabled=not is_server_side and url_param("profile") not in ("", "0"))
+# Milliseconds between stream flushes into the page state; None flushes once
+# per animation frame
+STREAM_FLUSH_INTERVAL = None
+
+
+class StreamRecord:
+    """One received stream payload, kept as raw text until it is rendered."""
+
+    def __init__(self, seq, text, received):
+        self.seq = seq
+        self.text = text
+        self.received = received
+        self._data = None
+        self._formatted = None
+
+    @property
+    def data(self):
+        """The payload parsed as JSON and stamped with its arrival time, or None."""
+        if self._data is None:
+            try:
+                data = json.loads(self.text)
+            except Exception:
+                data = None
+            if isinstance(data, dict):
+                data["timestamp"] = self.received
+                self._data = data
+            else:
+                self._data = False
+        return self._data or None
+
+    @property
+    def formatted(self):
+        if self._formatted is None:
+            data = self.data
+            self._formatted = self.text if data is None else json.dumps(data, indent=2)
+        return self._formatted
+
+
+class StreamRing:
+    """Fixed-capacity ring buffer of StreamRecords with O(1) append and eviction.
+
+    The ring is stored in the page state once and mutated in place; after each
+    change `delta` holds (appended, evicted) so listeners notified through
+    `state.mutate("stream_data")` can see what moved without diffing a list.
+    """
+
+    def __init__(self, capacity=STREAM_CAPACITY):
+        self.capacity = max(1, capacity)
+        self._slots = [None] * self.capacity
+        self._start = 0
+        self._size = 0
+        self.seq = 0
+        self.delta = (0, 0)
+        self._newest = None
+
+    def __len__(self):
+        return self._size
+
+    def __bool__(self):
+        return self._size > 0
+
+    def __iter__(self):
+        """Iterate from the oldest record to the newest."""
+        for i in range(self._size):
+            yield self._slots[(self._start + i) % self.capacity]
+
+    def first_seq(self):
+        """Sequence number of the oldest record kept (the next one if empty)."""
+        return self._slots[self._start].seq if self._size else self.seq + 1
+
+    def newest(self):
+        """Iterate from the newest record to the oldest."""
+        for i in range(self._size - 1, -1, -1):
+            yield self._slots[(self._start + i) % self.capacity]
+
+    def newest_first(self):
+        """Return the records newest first as a list, rebuilt only after a change.
+
+        The list is shared between callers and must not be modified.
+        """
+        if self._newest is None:
+            self._newest = list(self.newest())
+        return self._newest
+
+    def append(self, text, received=None):
+        """Add a raw payload, evicting the oldest record if full; return the record."""
+        self.seq += 1
+        record = StreamRecord(self.seq, text, received if received is not None else int(time.time() * 1000))
+        evicted = 0
+        if self._size == self.capacity:
+            self._slots[self._start] = record
+            self._start = (self._start + 1) % self.capacity
+            evicted = 1
+        else:
+            self._slots[(self._start + self._size) % self.capacity] = record
+            self._size += 1
+        self.delta = (1, evicted)
+        self._newest = None
+        return record
+
+    def extend(self, items):
+        """Append (text, received) pairs; `delta` covers the whole batch."""
+        appended = evicted = 0
+        for text, received in items:
+            self.append(text, received)
+            appended += 1
+            evicted += self.delta[1]
+        self.delta = (appended, evicted)
+
+    def clear(self):
+        self.delta = (0, self._size)
+        self._slots = [None] * self.capacity
+        self._start = 0
+        self._size = 0
+        self._newest = None
+
+
+class RenderMemo:
+    """Bounded cache of rendered subtrees, reused while their key and content match.
+
+    Entries are kept least recently used first, along with the sequence number
+    of the record they render so `discard_before` can drop evicted records.
+    """
+
+    def __init__(self, limit=STREAM_CARD_CACHE):
+        self.limit = max(1, limit)
+        self.entries = OrderedDict()
+
+    def get(self, key, content):
+        entry = self.entries.pop(key, None)
+        if entry is None or entry[1] != content:
+            return None
+        self.entries[key] = entry
+        return entry[2]
+
+    def put(self, key, content, seq, tag):
+        self.entries.pop(key, None)
+        self.entries[key] = (seq, content, tag)
+        while len(self.entries) > self.limit:
+            del self.entries[next(iter(self.entries))]
+
+    def discard_before(self, seq):
+        for key in [key for key, entry in self.entries.items() if entry[0] < seq]:
+            del self.entries[key]
+
+
+class StreamViewport:
+    """Picks the records of a newest-first list to render for a scroll position.
+
+    Row heights are measured after each render and remembered per record
+    sequence number; rows not rendered yet count as `estimate` pixels.
+    """
+
+    def __init__(self, height=STREAM_VIEWPORT_HEIGHT, estimate=STREAM_ROW_ESTIMATE, overscan=STREAM_OVERSCAN):
+        self.height = height
+        self.estimate = estimate
+        self.overscan = overscan
+        self.scroll_top = 0
+        self.heights = {}
+
+    def window(self, records):
+        """Return the (first, last) indexes of `records` to render, last exclusive."""
+        heights = self.heights
+        bottom = self.scroll_top + self.height
+        first = last = 0
+        offset = 0
+        for index, record in enumerate(records):
+            if offset >= bottom:
+                break
+            offset += heights.get(record.seq, self.estimate)
+            if offset <= self.scroll_top:
+                first = index + 1
+            last = index + 1
+        return max(0, first - self.overscan), min(len(records), last + self.overscan)
+
+    def slice(self, records):
+        """Return (top spacer px, records to render, bottom spacer px)."""
+        if len(self.heights) > 2 * len(records) + 64:
+            self.heights = {record.seq: self.heights[record.seq] for record in records if record.seq in self.heights}
+        first, last = self.window(records)
+        heights = self.heights
+        top = sum(heights.get(record.seq, self.estimate) for record in records[:first])
+        bottom = sum(heights.get(record.seq, self.estimate) for record in records[last:])
+        return top, records[first:last], bottom
+
+    def measure(self, element):
+        """Remember the heights of the rendered rows (elements with data-seq) under `element`.
+
+        A row takes up the distance to the next row's top, which includes the
+        margin between them that offsetHeight leaves out.
+        """
+        rows = element.querySelectorAll("[data-seq]")
+        for i in range(rows.length):
+            row = rows.item(i)
+            if i + 1 < rows.length:
+                height = rows.item(i + 1).offsetTop - row.offsetTop
+            else:
+                # Computed margins are always in px, e.g. "12px"
+                margin = str(window.getComputedStyle(row).marginBottom).replace("px", "")
+                height = row.offsetHeight + round(float(margin or 0))
+            self.heights[int(row.getAttribute("data-seq"))] = height
+
+
+class StreamIngest:
+    """Queues stream payloads and hands them over in one batch per frame.
+
+    `flush(items, skipped)` receives the queued (text, received) pairs at the
+    next animation frame, or `interval` ms after the first one arrived. At most
+    `limit` payloads wait; beyond that the oldest are dropped and counted in
+    `skipped`, so a burst costs one render instead of one per message.
+    """
+
+    def __init__(self, flush, limit=STREAM_CAPACITY, interval=STREAM_FLUSH_INTERVAL):
+        self.flush = flush
+        self.limit = max(1, limit)
+        self.interval = interval
+        # A full deque drops its oldest item on append
+        self.pending = deque((), self.limit)
+        self.skipped = 0
+        self.scheduled = False
+        # One persistent proxy, rather than one per scheduled flush
+        self._run = create_proxy(self.run)
+
+    def push(self, text):
+        if len(self.pending) >= self.limit:
+            self.skipped += 1
+        self.pending.append((text, int(time.time() * 1000)))
+        if not self.scheduled:
+            self.scheduled = True
+            if self.interval is None and hasattr(window, "requestAnimationFrame"):
+                window.requestAnimationFrame(self._run)
+            else:
+                window.setTimeout(self._run, self.interval or 16)
+
+    def run(self, *args):
+        self.scheduled = False
+        items, self.pending = list(self.pending), deque((), self.limit)
+        skipped, self.skipped = self.skipped, 0
+        if items or skipped:
+            self.flush(items, skipped)
+
+
+def state_ops(old, new):
+    """Return the operations that turn the snapshot `old` into `new`.
+
+    Operations are ["set", key, value], ["append", key, item] and
+    ["remove", key, index], so adding or removing a todo journals one item
+    rather than the whole list.
+    """
+    ops = []
+    for key, value in new.items():
+        before = old.get(key)
+        if value == before:
+            continue
+        if isinstance(value, list) and isinstance(before, list):
+            if len(value) == len(before) + 1 and value[:-1] == before:
+                ops.append(["append", key, value[-1]])
+                continue
+            if len(value) == len(before) - 1:
+                index = 0
+                while index < len(value) and value[index] == before[index]:
+                    index += 1
+                if value[index:] == before[index + 1:]:
+                    ops.append(["remove", key, index])
+                    continue
+        ops.append(["set", key, value])
+    return ops
+
+
+def apply_op(state, op):
+    action, key, value = op
+    if action == "set":
+        state[key] = value
+    elif action == "append":
+        state[key] = list(state.get(key, [])) + [value]
+    elif action == "remove":
+        items = list(state.get(key, []))
+        if 0 <= value < len(items):
+            del items[value]
+        state[key] = items
+
+
+def replay_journal(state, text, since=0):
+    """Apply the journal lines in `text` newer than entry `since` to `state`.
+
+    Returns (last entry number, number of entries read). A torn last line,
+    left by a write that never finished, ends the replay.
+    """
+    last, entries = since, 0
+    for line in text.split("\n"):
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+        except Exception:
+            break
+        entries += 1
+        if entry[0] > last:
+            apply_op(state, entry[1:])
+            last = entry[0]
+    return last, entries
+
+
+class StateJournal:
+    """Write-behind persistence of page state as an operation journal in OPFS.
+
+    `record(snapshot)` diffs the snapshot against the last one recorded and
+    queues the difference; PERSIST_DEBOUNCE ms after the last change the
+    queue is written as one journal segment file, with a key's pending
+    operations dropped once it is set again. Every `compact_every` entries a
+    full snapshot (`state.json`, carrying the number of the last entry it
+    includes) replaces the journal instead.
+
+    The queue is also flushed when the page is hidden or unloaded, but OPFS
+    writes are asynchronous and the browser may discard the page before one
+    completes, so the last batch (up to PERSIST_DEBOUNCE ms of changes) can
+    be lost.
+    """
+
+    def __init__(self, snapshot, seq=0, entries=0, debounce=PERSIST_DEBOUNCE, compact_every=PERSIST_COMPACT_EVERY):
+        self.snapshot = snapshot
+        self.seq = seq
+        self.entries = entries
+        self.debounce = debounce
+        self.compact_every = compact_every
+        self.pending = []
+        self.timer = None
+        self._flush = create_proxy(self.flush)
+        self._flush_if_hidden = create_proxy(self.flush_if_hidden)
+
+    def record(self, snapshot):
+        ops = state_ops(self.snapshot, snapshot)
+        self.snapshot = snapshot
+        for op in ops:
+            if op[0] == "set":
+                self.pending = [queued for queued in self.pending if queued[1] != op[1]]
+            self.pending.append(op)
+        if self.pending:
+            if self.timer is not None:
+                window.clearTimeout(self.timer)
+            self.timer = window.setTimeout(self._flush, self.debounce)
+
+    def flush_if_hidden(self, *args):
+        # Hiding the page, unlike pagehide, also happens before a mobile
+        # browser discards a backgrounded tab, and leaves more time to write
+        if str(window.document.visibilityState) == "hidden":
+            self.flush()
+
+    def flush(self, *args):
+        self.timer = None
+        if not self.pending or not hasattr(window, "__opfs__"):
+            return
+        ops, self.pending = self.pending, []
+        if self.entries + len(ops) >= self.compact_every:
+            self.seq += len(ops)
+            self.entries = 0
+            snapshot = dict(self.snapshot)
+            snapshot["journal_seq"] = self.seq
+            window.__opfs__.compactState(json.dumps(snapshot))
+            return
+        lines = []
+        for op in ops:
+            self.seq += 1
+            lines.append(json.dumps([self.seq] + op))
+        self.entries += len(ops)
+        window.__opfs__.appendJournal("\n".join(lines) + "\n")
+
+log.info("INIT", "hello_world.py loaded, initializing application...")
 
 # Custom error page that handles None errors better
 class CustomErrorPage(Page):
@@ -37,21 +731,101 @@ class CustomErrorPage(Page):
             t.p("An unknown error occurred.", class_name="mb-4")
             t.p("Please check the browser console for more details.", class_name="mb-4")
 
-# Simple application setup with hash-based routing
-app = Application()
+        # The recent log entries, to copy into a bug report
+        t.h2("Recent log", class_name="text-xl font-semibold mb-3")
+        t.pre(log.export(), class_name="bg-gray-100 p-4 rounded text-xs overflow-auto")
+
+class PrerenderedPage(Page):
+    """Page that can hydrate the HTML written by `build_assets.py prerender`.
+
+    With HYDRATE set and a prerendered shell in the mount point, the fresh
+    render is patched onto it (morphdom keeps the nodes that already match)
+    and the event listeners are moved onto the surviving nodes, instead of
+    clearing the mount point and inserting a new tree.
+    """
+
+    def mount(self, selector_or_element):
+        if isinstance(selector_or_element, str):
+            element = self.document.querySelector(selector_or_element)
+        else:
+            element = selector_or_element
+        shell = element.firstElementChild if element and HYDRATE else None
+        if not shell or not shell.hasAttribute("data-prerendered"):
+            return super().mount(selector_or_element)
+
+        self.update_title()
+        if not self._children_generated:
+            with self:
+                self.generate_children()
+        patch_dom_element(self.render(), shell)
+        self._adopt_listeners(self)
+        self.recursive_call("on_ready")
+        self.add_python_css_classes()
+
+    def _on_state_change(self, context, key, value):
+        if profiler.enabled:
+            profiler.state_changed(key)
+        super()._on_state_change(context, key, value)
+
+    def redraw(self):
+        if not profiler.enabled:
+            return super().redraw()
+        started = profiler.redraw_started()
+        super().redraw()
+        profiler.redraw_finished(started)
+
+    def generate_children(self):
+        if not profiler.enabled:
+            return super().generate_children()
+        started = profiler.now()
+        super().generate_children()
+        profiler.populated(profiler.now() - started)
+
+    def _adopt_listeners(self, tag):
+        listeners, tag._added_event_listeners = tag._added_event_listeners, []
+        for element, event, listener in listeners:
+            live = self.document.getElementById(element.id)
+            if live and not live.isSameNode(element):
+                tag.add_event_listener(live, event, listener)
+            else:
+                tag._added_event_listeners.append((element, event, listener))
+        for child in tag.children:
+            if hasattr(child, "_added_event_listeners"):
+                self._adopt_listeners(child)
+
+class HelloWorldApplication(Application):
+    def handle_error(self, exception):
+        # Logged once here; the error page itself may redraw many times
+        log.error("RENDER", "Showing error page: %s", exception)
+        super().handle_error(exception)
+
+# Simple application setup with hash-based routing. The fixed id prefix keeps
+# element ids identical between the prerendered shell and the client render.
+app = HelloWorldApplication(element_id_generator=DefaultIdGenerator(prefix="pp-app-"))
 app.error_page = CustomErrorPage
 app.install_router(Router, link_mode=Router.LINK_MODE_HASH)
 
 
 @app.page()
-class HelloWorldPage(Page):
+class HelloWorldPage(PrerenderedPage):
     def initial(self):
-        # Try to hydrate from OPFS-provided initial state
-        print("[INIT] Initializing page state...")
+        # Try to hydrate from the OPFS snapshot and the journal written since
+        log.debug("INIT", "Initializing page state...")
+        state = {
+            "count": 0,
+            "input_text": "",
+            "todos": [],
+            "completed": [],
+            "stream_data": StreamRing(STREAM_CAPACITY),
+            "stream_skipped": 0,
+            "stream_window": (0, 0),
+            "is_connected": False,
+            "connection_status": "Disconnected"
+        }
+        data, seq, entries = {}, 0, 0
         try:
-            import json
             raw = window.__INITIAL_STATE__
-            print(f"[INIT] Raw initial state: {raw}")
+            log.debug("INIT", "Raw initial state: %s", raw)
             if raw is not None:
                 # Handle both JsProxy with to_py() and plain Python str
                 try:
@@ -61,121 +835,135 @@ class HelloWorldPage(Page):
                 if isinstance(raw_str, bytes):
                     raw_str = raw_str.decode("utf-8")
                 if isinstance(raw_str, str) and len(raw_str) > 0:
-                    data = json.loads(raw_str)
-                    if isinstance(data, dict):
-                        defaults = {
-                            "count": 0,
-                            "input_text": "",
-                            "todos": [],
-                            "completed": [],
-                            "stream_data": [],
-                            "is_connected": False,
-                            "connection_status": "Disconnected"
-                        }
-                        defaults.update({k: v for k, v in data.items() if k in defaults})
-                        print(f"[INIT] Loaded state from OPFS: {len(defaults)} properties")
-                        return defaults
+                    loaded = json.loads(raw_str)
+                    if isinstance(loaded, dict):
+                        data = loaded
+            journal = getattr(window, "__INITIAL_JOURNAL__", None)
+            if journal:
+                seq, entries = replay_journal(data, str(journal), data.get("journal_seq", 0))
+                log.info("INIT", "Replayed %s journal entries", entries)
         except Exception as e:
-            print(f"[INIT] Failed to load OPFS state: {e}")
-        print("[INIT] Using default initial state")
-        return {
-            "count": 0,
-            "input_text": "",
-            "todos": [],
-            "completed": [],
-            "stream_data": [],
-            "is_connected": False,
-            "connection_status": "Disconnected"
-        }
+            log.warning("INIT", "Failed to load OPFS state: %s", e)
+        if data:
+            state.update({k: v for k, v in data.items() if k in PERSISTED_KEYS})
+            log.info("INIT", "Loaded state from OPFS: %s properties", len(data))
+        else:
+            log.info("INIT", "Using default initial state")
+        self._journal = StateJournal({key: state[key] for key in PERSISTED_KEYS},
+                                     max(seq, data.get("journal_seq", 0)), entries)
+        return state
     
     def on_mount(self):
         """Called when the page is mounted - auto-connect to stream"""
-        print("[MOUNT] Page mounted (on_mount), initializing stream connection...")
+        log.debug("INIT", "Page mounted (on_mount), initializing stream connection...")
         # Enable auto-reconnect loop and start
         self._stream_should_run = True
-        print("[MOUNT] Stream enabled, calling auto_connect_stream()")
+        log.debug("INIT", "Stream enabled, calling auto_connect_stream()")
         self.auto_connect_stream()
     
     def mounted(self):
         """Alternative lifecycle method name - auto-connect to stream"""
-        print("[MOUNT] Page mounted (mounted), initializing stream connection...")
+        log.debug("INIT", "Page mounted (mounted), initializing stream connection...")
         # Enable auto-reconnect loop and start
         self._stream_should_run = True
-        print("[MOUNT] Stream enabled, calling auto_connect_stream()")
+        log.debug("INIT", "Stream enabled, calling auto_connect_stream()")
         self.auto_connect_stream()
     
     def on_ready(self):
         """Another possible lifecycle method name"""
-        print("[MOUNT] Page ready (on_ready), initializing stream connection...")
+        # Start writing queued state changes before the page goes away (see
+        # StateJournal: the write may still not finish)
+        if not getattr(self, "_journal_flush_on_hide", False):
+            self._journal_flush_on_hide = True
+            window.document.addEventListener("visibilitychange", self._journal._flush_if_hidden)
+            window.addEventListener("pagehide", self._journal._flush)
+        log.debug("INIT", "Page ready (on_ready), initializing stream connection...")
         # Enable auto-reconnect loop and start
         self._stream_should_run = True
-        print("[MOUNT] Stream enabled, calling auto_connect_stream()")
+        log.debug("INIT", "Stream enabled, calling auto_connect_stream()")
         self.auto_connect_stream()
     
+    def on_redraw(self):
+        # Heights of the rows just rendered place the spacers on the next render
+        if STREAM_VIRTUALIZE and "stream_list" in self.refs:
+            try:
+                self._stream_viewport().measure(self.refs["stream_list"].element)
+            except Exception as e:
+                log.warning("RENDER", "Failed to measure stream rows: %s", e)
+
+    def _record_cards(self):
+        if getattr(self, "_card_memo", None) is None:
+            self._card_memo = RenderMemo()
+        return self._card_memo
+
+    def _stream_viewport(self):
+        if getattr(self, "_viewport", None) is None:
+            self._viewport = StreamViewport()
+        return self._viewport
+
     def _ensure_stream_started(self):
         """Idempotently start the stream if not already started"""
-        print("[ENSURE] _ensure_stream_started called")
+        log.debug("SSE", "_ensure_stream_started called")
         if getattr(self, "_auto_started", False):
-            print("[ENSURE] Stream already started, skipping")
+            log.debug("SSE", "Stream already started, skipping")
             return
-        print("[ENSURE] Starting stream for first time...")
+        log.debug("SSE", "Starting stream for first time...")
         self._auto_started = True
         self._stream_should_run = True
         try:
             asyncio.create_task(self.connect_to_stream())
-            print("[ENSURE] Stream connect task created successfully")
+            log.debug("SSE", "Stream connect task created successfully")
         except Exception as e:
-            print(f"[ENSURE] Failed to create stream connect task: {e}")
+            log.warning("SSE", "Failed to create stream connect task: %s", e)
     
     async def connect_to_stream(self):
         """Connect to the streaming API endpoint using EventSource (SSE) if possible."""
         try:
             if hasattr(self, "_stream_should_run") and not self._stream_should_run:
-                print("[SSE] Stream connection cancelled - _stream_should_run is False")
+                log.debug("SSE", "Stream connection cancelled - _stream_should_run is False")
                 return
             # Avoid duplicate EventSource instances
             if getattr(self, "_event_source", None) is not None:
-                print("[SSE] EventSource already exists, skipping duplicate connection")
+                log.debug("SSE", "EventSource already exists, skipping duplicate connection")
                 return
 
-            print("[SSE] Starting stream connection...")
+            log.debug("SSE", "Starting stream connection...")
             # Update state using proper mutation to trigger reactivity
             with self.state.mutate("connection_status"):
                 self.state["connection_status"] = "Connected - waiting for data"
             with self.state.mutate("is_connected"):
                 self.state["is_connected"] = True
 
-            url = "https://trailbase.nandi.crabdance.com/api/records/v1/people/subscribe/*"
-            print(f"[SSE] Attempting to connect to: {url}")
+            url = STREAM_URL
+            log.debug("SSE", "Attempting to connect to: %s", url)
             
             try:
-                print("[SSE] Creating new EventSource...")
+                log.debug("SSE", "Creating new EventSource...")
                 es = window.EventSource.new(url)
                 self._event_source = es
-                print("[SSE] EventSource created successfully")
+                log.debug("SSE", "EventSource created successfully")
+                if getattr(self, "_stream_ingest", None) is None:
+                    self._stream_ingest = StreamIngest(self._flush_stream)
 
                 def on_open(e):
-                    print("[SSE] Connection opened successfully")
-                    print(f"[SSE] Event object: {e}")
+                    log.info("SSE", "Connection opened successfully")
+                    log.debug("SSE", "Event object: %s", e)
                     # Update state using proper mutation
                     with self.state.mutate("connection_status"):
                         self.state["connection_status"] = "Connected - waiting for data"
                     with self.state.mutate("is_connected"):
                         self.state["is_connected"] = True
 
-                async def process_payload_text(payload_text: str):
-                    print(f"[SSE] Processing payload: {payload_text[:200]}{'...' if len(payload_text) > 200 else ''}")
-                    try:
-                        data_obj = json.loads(payload_text)
-                        print(f"[SSE] Successfully parsed JSON with {len(data_obj) if isinstance(data_obj, (dict, list)) else 'unknown'} items")
-                        # Only add JSON data to UI
-                        data_obj["timestamp"] = int(time.time() * 1000)  # Convert to milliseconds like Date.now()
-                        new_list = list(self.state.get("stream_data", [])) + [data_obj]
-                        if len(new_list) > 50:
-                            new_list = new_list[-50:]
-                        self.state["stream_data"] = new_list
-                        print(f"[SSE] Added JSON to stream data, total records: {len(new_list)}")
-                    except Exception as e:
+                def process_payload_text(payload_text: str):
+                    if log.enabled("SSE", DEBUG):
+                        log.debug("SSE", "Processing payload: %s%s", payload_text[:200], '...' if len(payload_text) > 200 else '')
+                    # Only JSON objects go to the UI; they are queued for the next
+                    # frame and parsed when rendered
+                    if payload_text.lstrip().startswith("{"):
+                        if profiler.enabled:
+                            profiler.event_arrived()
+                        self._stream_ingest.push(payload_text)
+                    else:
                         # Try to determine the type of non-JSON data
                         data_type = "unknown"
                         if not payload_text or payload_text.strip() == "":
@@ -205,32 +993,35 @@ class HelloWorldPage(Page):
                         else:
                             data_type = "plain text"
                         
-                        print(f"[SSE] Non-JSON payload [{data_type}] (not adding to UI): {payload_text}")
-                        print(f"[SSE] JSON parse error: {e}")
+                        log.debug("SSE", "Non-JSON payload [%s] (not adding to UI): %s", data_type, payload_text)
 
                 def on_message(e):
-                    print("[SSE] Message received from server")
+                    # Runs per message: skip building log arguments unless SSE debugging is on
+                    tracing = log.enabled("SSE", DEBUG)
+                    if tracing:
+                        log.debug("SSE", "Message received from server")
                     try:
                         payload = e.data
-                        print(f"[SSE] Raw payload type: {type(payload)}")
+                        if tracing:
+                            log.debug("SSE", "Raw payload type: %s", type(payload))
                         try:
                             payload_text = payload.to_py() if hasattr(payload, "to_py") else payload
                         except Exception as convert_ex:
-                            print(f"[SSE] Failed to convert payload: {convert_ex}")
+                            log.warning("SSE", "Failed to convert payload: %s", convert_ex)
                             payload_text = payload
                         if not isinstance(payload_text, str):
                             payload_text = str(payload_text)
-                        print(f"[SSE] Converted payload length: {len(payload_text)} chars")
-                        # Schedule async processing to avoid blocking
-                        asyncio.create_task(process_payload_text(payload_text))
+                        if tracing:
+                            log.debug("SSE", "Converted payload length: %s chars", len(payload_text))
+                        process_payload_text(payload_text)
                     except Exception as ex:
-                        print(f"[SSE] Error processing message: {ex}")
+                        log.warning("SSE", "Error processing message: %s", ex)
 
                 def on_error(e):
-                    print(f"[SSE] Connection error occurred: {e}")
-                    print(f"[SSE] Error type: {type(e)}")
+                    log.warning("SSE", "Connection error occurred: %s", e)
+                    log.debug("SSE", "Error type: %s", type(e))
                     try:
-                        print(f"[SSE] Error details: readyState={getattr(e.target, 'readyState', 'unknown')}")
+                        log.debug("SSE", "Error details: readyState=%s", getattr(e.target, 'readyState', 'unknown'))
                     except Exception:
                         pass
                     # Mark disconnected and cleanup using proper mutation
@@ -240,269 +1031,92 @@ class HelloWorldPage(Page):
                         self.state["connection_status"] = "Disconnected"
                     try:
                         if getattr(self, "_event_source", None) is not None:
-                            print("[SSE] Closing EventSource...")
+                            log.debug("SSE", "Closing EventSource...")
                             self._event_source.close()
                     except Exception as close_ex:
-                        print(f"[SSE] Error closing EventSource: {close_ex}")
+                        log.warning("SSE", "Error closing EventSource: %s", close_ex)
                     self._event_source = None
                     # Auto-reconnect if allowed
                     if getattr(self, "_stream_should_run", True):
-                        print("[SSE] Scheduling reconnect in 2 seconds...")
+                        log.info("SSE", "Scheduling reconnect in 2 seconds...")
                         with self.state.mutate("connection_status"):
                             self.state["connection_status"] = "Reconnecting in 2s..."
                         asyncio.create_task(self._reconnect_after_delay())
                     else:
-                        print("[SSE] Auto-reconnect disabled")
+                        log.debug("SSE", "Auto-reconnect disabled")
 
-                print("[SSE] Setting up event handlers...")
+                log.debug("SSE", "Setting up event handlers...")
                 es.onopen = on_open
                 es.onmessage = on_message
                 es.onerror = on_error
-                print("[SSE] Event handlers configured")
+                log.debug("SSE", "Event handlers configured")
                 
                 # Set a timeout to fallback to fetch if SSE doesn't work
-                print("[SSE] Starting timeout fallback task...")
+                log.debug("SSE", "Starting timeout fallback task...")
                 asyncio.create_task(self._sse_timeout_fallback())
                 
             except Exception as sse_error:
-                print(f"[SSE] EventSource creation failed: {sse_error}")
+                log.warning("SSE", "EventSource creation failed: %s", sse_error)
                 self.state["is_connected"] = False
                 with self.state.mutate("connection_status"):
                     self.state["connection_status"] = f"SSE Error: {str(sse_error)}"
                 
         except Exception as e:
-            print(f"[SSE] Overall connection error: {e}")
+            log.error("SSE", "Overall connection error: %s", e)
             self.state["is_connected"] = False
             with self.state.mutate("connection_status"):
                 self.state["connection_status"] = f"Error: {str(e)}"
     
+    def _flush_stream(self, items, skipped):
+        """Move a batch of queued stream payloads into the page state at once."""
+        ring = self.state["stream_data"]
+        if profiler.enabled:
+            profiler.stream_flushed()
+        with self.state.mutate("stream_data", "stream_skipped"):
+            ring.extend(items)
+            if skipped:
+                self.state["stream_skipped"] += skipped
+        log.debug("SSE", "Flushed %s records (%s skipped), total records: %s", len(items), skipped, len(ring))
+
     async def _sse_timeout_fallback(self):
         """Timeout to check for heartbeat/data after 1 minute"""
         try:
-            print("[SSE] Starting 60-second timeout for heartbeat check...")
+            log.debug("SSE", "Starting 60-second timeout for heartbeat check...")
             await asyncio.sleep(60)
             if not self.state.get("is_connected", False):
-                print("[SSE] No heartbeat/data received within 60 seconds")
+                log.warning("SSE", "No heartbeat/data received within 60 seconds")
                 with self.state.mutate("connection_status"):
                     self.state["connection_status"] = "No heartbeat - connection may be dead"
                 self.state["is_connected"] = False
             else:
-                print("[SSE] Heartbeat timeout passed - connection appears active")
+                log.debug("SSE", "Heartbeat timeout passed - connection appears active")
         except Exception as e:
-            print(f"[SSE] Heartbeat timeout check error: {e}")
-    
-    async def _connect_with_fetch_REMOVED(self):
-        """Fallback connection using fetch API"""
-        try:
-            print("[FETCH] Starting fetch-based streaming connection...")
-            self.state["connection_status"] = "Connecting (fetch)..."
-            
-            # Prepare AbortController for clean disconnects
-            print("[FETCH] Creating AbortController...")
-            controller = window.AbortController.new()
-            self._stream_controller = controller
-
-            # Build fetch options as native JS object
-            fetch_opts = window.Object.new()
-            fetch_opts.signal = controller.signal
-            print("[FETCH] Fetch options configured with abort signal")
-
-            url = "https://trailbase.nandi.crabdance.com/api/records/v1/people/subscribe/*"
-            print(f"[FETCH] Attempting fetch request to: {url}")
-            # Use fetch API to connect to the stream with abort signal
-            response = await window.fetch(url, fetch_opts)
-            print(f"[FETCH] Response received - status: {response.status}, ok: {response.ok}")
-
-            if response.ok:
-                print("[FETCH] Response OK, starting stream reading...")
-                self.state["connection_status"] = "Connected (fetch)"
-                self.state["is_connected"] = True
-
-                # Get the readable stream and a UTF-8 decoder
-                print("[FETCH] Getting response body reader...")
-                reader = response.body.getReader()
-                decoder = window.TextDecoder.new("utf-8")
-                print("[FETCH] TextDecoder initialized")
-
-                # Buffers for handling partial lines and SSE events
-                text_buffer = ""
-                sse_data_lines = []
-
-                async def handle_parsed_payload(payload_text: str):
-                    print(f"[FETCH] Processing payload: {payload_text[:200]}{'...' if len(payload_text) > 200 else ''}")
-                    # Try to parse NDJSON/SSE data string into JSON
-                    try:
-                        data_obj = json.loads(payload_text)
-                        print(f"[FETCH] Successfully parsed JSON with {len(data_obj) if isinstance(data_obj, (dict, list)) else 'unknown'} items")
-                        # Only add JSON data to UI
-                        data_obj["timestamp"] = int(time.time() * 1000)  # Convert to milliseconds like Date.now()
-                        new_list = list(self.state.get("stream_data", [])) + [data_obj]
-                        # Keep only last 50
-                        if len(new_list) > 50:
-                            new_list = new_list[-50:]
-                        self.state["stream_data"] = new_list
-                        print(f"[FETCH] Added JSON to stream data, total records: {len(new_list)}")
-                    except Exception as e:
-                        # Try to determine the type of non-JSON data
-                        data_type = "unknown"
-                        if not payload_text or payload_text.strip() == "":
-                            data_type = "empty/whitespace"
-                        elif payload_text.startswith("data:"):
-                            data_type = "SSE data line"
-                        elif payload_text.startswith("event:"):
-                            data_type = "SSE event line"
-                        elif payload_text.startswith("id:"):
-                            data_type = "SSE id line"
-                        elif payload_text.startswith("retry:"):
-                            data_type = "SSE retry line"
-                        elif payload_text.strip() == ":":
-                            data_type = "SSE comment/heartbeat"
-                        elif payload_text.startswith(":"):
-                            data_type = "SSE comment"
-                        elif payload_text.lower().startswith("<!doctype") or payload_text.lower().startswith("<html"):
-                            data_type = "HTML page"
-                        elif payload_text.startswith("<"):
-                            data_type = "XML/HTML fragment"
-                        elif "error" in payload_text.lower():
-                            data_type = "error message"
-                        elif "connect" in payload_text.lower():
-                            data_type = "connection message"
-                        elif payload_text.isdigit():
-                            data_type = "numeric string"
-                        else:
-                            data_type = "plain text"
-                        
-                        print(f"[FETCH] Non-JSON payload [{data_type}] (not adding to UI): {payload_text}")
-                        print(f"[FETCH] JSON parse error: {e}")
-
-                # Start reading the stream
-                print("[FETCH] Starting stream reading loop...")
-                while True:
-                    try:
-                        result = await reader.read()
-                        if result.done:
-                            print("[FETCH] Stream reading completed (done=True)")
-                            break
-
-                        # Decode the Uint8Array chunk using TextDecoder
-                        chunk_text = decoder.decode(result.value)
-                        if not isinstance(chunk_text, str):
-                            chunk_text = str(chunk_text)
-                        
-                        print(f"[FETCH] Received chunk: {len(chunk_text)} chars")
-                        text_buffer += chunk_text
-
-                        # Process complete lines; keep trailing partial in buffer
-                        while "\n" in text_buffer:
-                            line, text_buffer = text_buffer.split("\n", 1)
-                            line = line.rstrip("\r")
-
-                            # Handle SSE format: accumulate data: lines until blank line
-                            if line == "":
-                                if sse_data_lines:
-                                    payload = "\n".join(sse_data_lines)
-                                    print(f"[FETCH] Processing SSE event with {len(sse_data_lines)} data lines")
-                                    sse_data_lines = []
-                                    await handle_parsed_payload(payload)
-                                continue
-
-                            if line.startswith("data:"):
-                                data_content = line[5:].lstrip()
-                                print(f"[FETCH] SSE data line: {data_content[:100]}{'...' if len(data_content) > 100 else ''}")
-                                sse_data_lines.append(data_content)
-                                continue
-
-                            # Handle NDJSON/plain lines
-                            stripped = line.strip()
-                            if stripped:
-                                print(f"[FETCH] Processing NDJSON line: {stripped[:100]}{'...' if len(stripped) > 100 else ''}")
-                                await handle_parsed_payload(stripped)
-
-                    except Exception as e:
-                        print(f"[FETCH] Error during stream reading: {e}")
-                        # If aborted, exit quietly
-                        try:
-                            if getattr(self, "_stream_controller", None) and self._stream_controller.signal.aborted:
-                                print("[FETCH] Stream reading aborted by signal")
-                                break
-                        except Exception as abort_check_ex:
-                            print(f"[FETCH] Error checking abort signal: {abort_check_ex}")
-                        print("[FETCH] Breaking from stream reading loop due to error")
-                        break
-
-                # Flush remaining SSE data on stream end
-                if sse_data_lines:
-                    payload = "\n".join(sse_data_lines)
-                    print(f"[FETCH] Flushing remaining {len(sse_data_lines)} SSE data lines on stream end")
-                    sse_data_lines = []
-                    await handle_parsed_payload(payload)
-
-            else:
-                print(f"[FETCH] Response not OK - status: {response.status}")
-                self.state["connection_status"] = f"Connection failed: {response.status}"
-                # SSE-only mode - no fallbacks
-                print("[FETCH] SSE-only mode - no polling fallback")
-                self.state["connection_status"] = "SSE connection failed - no fallbacks"
-
-        except Exception as e:
-            print(f"[FETCH] Connection error: {e}")
-            # If aborted before response
-            try:
-                if getattr(self, "_stream_controller", None) and self._stream_controller.signal.aborted:
-                    print("[FETCH] Connection was aborted")
-                    self.state["connection_status"] = "Disconnected"
-                else:
-                    print(f"[FETCH] Connection failed with error: {e}")
-                    self.state["connection_status"] = f"Error: {str(e)}"
-            except Exception as status_ex:
-                print(f"[FETCH] Error setting connection status: {status_ex}")
-                self.state["connection_status"] = f"Error: {str(e)}"
-            # SSE-only mode - no fallbacks
-            print("[FETCH] SSE-only mode - no polling fallback")
-            self.state["connection_status"] = "SSE connection failed - no fallbacks"
-        finally:
-            print("[FETCH] Cleaning up fetch connection...")
-            self.state["is_connected"] = False
-            # Auto-reconnect unless user explicitly disconnected
-            try:
-                aborted = False
-                if getattr(self, "_stream_controller", None):
-                    aborted = bool(self._stream_controller.signal.aborted)
-                print(f"[FETCH] Connection aborted: {aborted}")
-            except Exception as abort_check_ex:
-                print(f"[FETCH] Error checking abort status: {abort_check_ex}")
-                aborted = False
-            if getattr(self, "_stream_should_run", True) and not aborted:
-                print("[FETCH] Scheduling reconnect in 2 seconds...")
-                self.state["connection_status"] = "Reconnecting in 2s..."
-                asyncio.create_task(self._reconnect_after_delay())
-            else:
-                print("[FETCH] Auto-reconnect disabled or connection was aborted")
+            log.warning("SSE", "Heartbeat timeout check error: %s", e)
     
     async def _connect_with_polling_REMOVED(self):
         """Final fallback: simple polling approach"""
         try:
-            print("[POLLING] Starting polling connection...")
+            log.debug("SSE", "Starting polling connection...")
             self.state["connection_status"] = "Connected (polling)"
             self.state["is_connected"] = True
             
             # Store last update time to detect changes
             self._last_poll_time = 0
-            print("[POLLING] Initialized polling state")
+            log.debug("SSE", "Initialized polling state")
             
             poll_count = 0
             while getattr(self, "_stream_should_run", True):
                 poll_count += 1
                 try:
                     # Poll the people endpoint to check for updates
-                    url = "https://trailbase.nandi.crabdance.com/api/records/v1/people"
-                    print(f"[POLLING] Poll #{poll_count}: requesting {url}")
+                    url = PEOPLE_URL
+                    log.debug("SSE", "Poll #%s: requesting %s", poll_count, url)
                     response = await window.fetch(url)
                     
                     if response.ok:
-                        print(f"[POLLING] Poll #{poll_count} successful - status: {response.status}")
+                        log.debug("SSE", "Poll #%s successful - status: %s", poll_count, response.status)
                         data = await response.json()
-                        print(f"[POLLING] Poll #{poll_count} received data: {len(data) if isinstance(data, (list, dict)) else 'unknown'} items")
+                        log.debug("SSE", "Poll #%s received data: %s items", poll_count, len(data) if isinstance(data, (list, dict)) else 'unknown')
                         current_time = int(time.time() * 1000)  # Convert to milliseconds like Date.now()
                         
                         # Create a simple update event
@@ -515,43 +1129,42 @@ class HelloWorldPage(Page):
                         }
                         
                         # Add to stream data
-                        new_list = list(self.state.get("stream_data", [])) + [update_event]
-                        if len(new_list) > 50:
-                            new_list = new_list[-50:]
-                        self.state["stream_data"] = new_list
-                        print(f"[POLLING] Poll #{poll_count} added to stream data, total records: {len(new_list)}")
+                        ring = self.state["stream_data"]
+                        with self.state.mutate("stream_data"):
+                            ring.append(json.dumps(update_event), current_time)
+                        log.debug("SSE", "Poll #%s added to stream data, total records: %s", poll_count, len(ring))
                         
                     else:
-                        print(f"[POLLING] Poll #{poll_count} failed - status: {response.status}")
+                        log.warning("SSE", "Poll #%s failed - status: %s", poll_count, response.status)
                         
                 except Exception as e:
-                    print(f"[POLLING] Poll #{poll_count} error: {e}")
+                    log.warning("SSE", "Poll #%s error: %s", poll_count, e)
                 
                 # Wait 3 seconds before next poll
-                print(f"[POLLING] Poll #{poll_count} complete, waiting 3 seconds...")
+                log.debug("SSE", "Poll #%s complete, waiting 3 seconds...", poll_count)
                 await asyncio.sleep(3)
                 
         except Exception as e:
-            print(f"[POLLING] Overall polling error: {e}")
+            log.warning("SSE", "Overall polling error: %s", e)
             self.state["is_connected"] = False
             self.state["connection_status"] = f"Polling error: {str(e)}"
 
     async def _reconnect_after_delay(self):
-        print("[RECONNECT] Starting 2-second delay before reconnect...")
+        log.debug("SSE", "Starting 2-second delay before reconnect...")
         try:
             await asyncio.sleep(2)
         except Exception as sleep_ex:
-            print(f"[RECONNECT] Sleep interrupted: {sleep_ex}")
+            log.debug("SSE", "Sleep interrupted: %s", sleep_ex)
             return
         if getattr(self, "_stream_should_run", True) and not self.state.get("is_connected", False):
-            print("[RECONNECT] Attempting to reconnect...")
+            log.debug("SSE", "Attempting to reconnect...")
             try:
                 asyncio.create_task(self.connect_to_stream())
-                print("[RECONNECT] Reconnect task created successfully")
+                log.debug("SSE", "Reconnect task created successfully")
             except Exception as e:
-                print(f"[RECONNECT] Failed to create reconnect task: {e}")
+                log.warning("SSE", "Failed to create reconnect task: %s", e)
         else:
-            print(f"[RECONNECT] Skipping reconnect - should_run: {getattr(self, '_stream_should_run', True)}, is_connected: {self.state.get('is_connected', False)}")
+            log.debug("SSE", "Skipping reconnect - should_run: %s, is_connected: %s", getattr(self, '_stream_should_run', True), self.state.get('is_connected', False))
     
     def handle_connect_stream(self, event):
         """Handle connect button click"""
@@ -587,6 +1200,12 @@ class HelloWorldPage(Page):
             self.state["connection_status"] = "Disconnected"
         pass
     
+    def handle_stream_scroll(self, event):
+        """Re-render the stream list only when scrolling changes which records are shown"""
+        viewport = self._stream_viewport()
+        viewport.scroll_top = event.target.scrollTop
+        self.state["stream_window"] = viewport.window(self.state["stream_data"].newest_first())
+
     def handle_clear_stream_data(self, event):
         """Clear the stream data"""
         try:
@@ -597,10 +1216,13 @@ class HelloWorldPage(Page):
         except Exception:
             pass
         
-        print("[CLEAR] Clearing stream data...")
-        current_count = len(self.state.get("stream_data", []))
-        self.state["stream_data"] = []
-        print(f"[CLEAR] Cleared {current_count} stream data records")
+        log.debug("SSE", "Clearing stream data...")
+        ring = self.state["stream_data"]
+        current_count = len(ring)
+        with self.state.mutate("stream_data", "stream_skipped"):
+            ring.clear()
+            self.state["stream_skipped"] = 0
+        log.info("SSE", "Cleared %s stream data records", current_count)
     
     def handle_update_user_2_click(self, event):
         """Schedule async update of user 2"""
@@ -647,18 +1269,18 @@ class HelloWorldPage(Page):
             
             # Send PATCH request to update user ID 2
             response = await window.fetch(
-                "https://trailbase.nandi.crabdance.com/api/records/v1/people/2",
+                PEOPLE_URL + "/2",
                 fetch_options
             )
             
             if response.ok:
-                print(f"[UPDATE] Successfully updated user 2 with name: {random_name}, age: {random_age}")
-                print("[UPDATE] Change should appear automatically via stream subscription")
+                log.info("API", "Successfully updated user 2 with name: %s, age: %s", random_name, random_age)
+                log.debug("API", "Change should appear automatically via stream subscription")
             else:
-                print(f"[UPDATE] Failed to update user 2 - status: {response.status}")
+                log.warning("API", "Failed to update user 2 - status: %s", response.status)
                 try:
                     error_text = await response.text()
-                    print(f"[UPDATE] Error details: {error_text}")
+                    log.warning("API", "Error details: %s", error_text)
                 except Exception:
                     pass
                 
@@ -668,44 +1290,44 @@ class HelloWorldPage(Page):
     async def _force_polling_update_REMOVED(self):
         """Force an immediate polling update to see the change"""
         try:
-            print("[FORCE_POLL] Forcing immediate polling update")
-            response = await window.fetch("https://trailbase.nandi.crabdance.com/api/records/v1/people")
+            log.debug("SSE", "Forcing immediate polling update")
+            response = await window.fetch(PEOPLE_URL)
             
             if response.ok:
                 data = await response.json()
                 
                 # Log the forced update but don't add to UI
-                print(f"[FORCE_POLL] Forced polling update received {len(data) if isinstance(data, (list, dict)) else 'unknown'} records")
-                print(f"[FORCE_POLL] Data preview: {str(data)[:200]}{'...' if len(str(data)) > 200 else ''}")
+                log.debug("SSE", "Forced polling update received %s records", len(data) if isinstance(data, (list, dict)) else 'unknown')
+                log.debug("SSE", "Data preview: %s%s", str(data)[:200], '...' if len(str(data)) > 200 else '')
                 
         except Exception as e:
-            print(f"[FORCE_POLL] Forced polling error: {e}")
+            log.warning("SSE", "Forced polling error: %s", e)
     
     def auto_connect_stream(self):
         """Auto-connect to stream on page load"""
-        print("[AUTO] Auto-connect stream called")
+        log.debug("SSE", "Auto-connect stream called")
         # Defer a bit to avoid race with mount/render/event loop init
         def _start_connect():
-            print("[AUTO] Auto-connect timeout fired; starting stream")
+            log.debug("SSE", "Auto-connect timeout fired; starting stream")
             try:
-                print("[AUTO] Creating asyncio task for connect_to_stream...")
+                log.debug("SSE", "Creating asyncio task for connect_to_stream...")
                 task = asyncio.create_task(self.connect_to_stream())
-                print(f"[AUTO] Connect task created successfully: {task}")
+                log.debug("SSE", "Connect task created successfully: %s", task)
             except Exception as e:
-                print(f"[AUTO] Failed to auto-connect stream: {e}")
+                log.warning("SSE", "Failed to auto-connect stream: %s", e)
                 with self.state.mutate("connection_status"):
                     self.state["connection_status"] = f"Auto-connect failed: {str(e)}"
         
         # Try setTimeout first, but also start immediately as backup
         try:
-            print("[AUTO] Attempting to use setTimeout...")
+            log.debug("SSE", "Attempting to use setTimeout...")
             window.setTimeout(_start_connect, 250)
-            print("[AUTO] Auto-connect scheduled for 250ms delay")
+            log.debug("SSE", "Auto-connect scheduled for 250ms delay")
         except Exception as e:
-            print(f"[AUTO] setTimeout not available or failed: {e}")
+            log.warning("SSE", "setTimeout not available or failed: %s", e)
         
         # Also start immediately to ensure connection attempt
-        print("[AUTO] Starting connection immediately as well...")
+        log.debug("SSE", "Starting connection immediately as well...")
         _start_connect()
     
     def handle_increment(self, event):
@@ -812,19 +1434,11 @@ class HelloWorldPage(Page):
             window.location = "#/test"
 
     def persist_state(self):
+        # Queues the change for the OPFS journal; see StateJournal
         try:
-            state_snapshot = {
-                "count": self.state.get("count", 0),
-                "input_text": self.state.get("input_text", ""),
-                "todos": list(self.state.get("todos", [])),
-                "completed": list(self.state.get("completed", [])),
-            }
-            if hasattr(window, "__opfs__"):
-                import json
-                # Pass JSON string to avoid proxy conversion issues
-                window.__opfs__.saveState(json.dumps(state_snapshot))
+            self._journal.record({key: self.state[key] for key in PERSISTED_KEYS})
         except Exception as e:
-            pass
+            log.warning("PERSIST", "Failed to queue state change: %s", e)
     
     def populate(self):
         t.h1("Hello, World!", class_name="text-3xl font-bold mb-6 text-center text-catppuccin-mauve")
@@ -922,18 +1536,16 @@ class HelloWorldPage(Page):
                 status_text = f"Status: {self.state['connection_status']}"
                 is_connected = "Connected" in self.state["connection_status"]
                 
-                import time
-                print(f"DEBUG RENDER: populate() called at {time.time()}")
-                print(f"DEBUG RENDER: connection_status = '{self.state['connection_status']}'")
-                print(f"DEBUG RENDER: is_connected = {is_connected}")
+                if log.enabled("RENDER", DEBUG):
+                    log.debug("RENDER", "populate() called at %s", time.time())
+                    log.debug("RENDER", "connection_status = '%s'", self.state['connection_status'])
+                    log.debug("RENDER", "is_connected = %s, using %s inline style", is_connected, "GREEN" if is_connected else "RED")
                 
                 if is_connected:
-                    print(f"DEBUG RENDER: Using GREEN inline style")
                     t.p(status_text, 
                         style="margin-bottom: 0.5rem; color: #a6e3a1;", 
                         key="status-green")
                 else:
-                    print(f"DEBUG RENDER: Using RED inline style") 
                     t.p(status_text, 
                         style="margin-bottom: 0.5rem; color: #f38ba8;", 
                         key="status-red")
@@ -956,54 +1568,68 @@ class HelloWorldPage(Page):
                             key="btn-clear-data"
                         )
             
-            # Stream data display
+            # Stream data display; cached cards of evicted records are dropped first
+            self._record_cards().discard_before(self.state["stream_data"].first_seq())
             if len(self.state["stream_data"]) == 0:
                 t.p("No stream data received yet. Stream auto-connects on page load. Click 'Update User 2' to generate test data.", 
                     class_name="text-catppuccin-subtext0")
             else:
-                t.p(f"Received {len(self.state['stream_data'])} records:", 
+                skipped = self.state["stream_skipped"]
+                t.p(f"Received {len(self.state['stream_data'])} records{f' ({skipped} skipped)' if skipped else ''}:", 
                     class_name="mb-3 text-catppuccin-text")
                 
-                # Display the most recent data first
-                for i, data in enumerate(reversed(self.state["stream_data"])):
-                    record_number = len(self.state['stream_data']) - i
-                    # Create unique key for each record to prevent rendering issues
-                    record_key = f"record-{record_number}-{data.get('timestamp', i)}"
-                    with t.div(class_name="mb-3 p-3 rounded border bg-catppuccin-surface1 border-catppuccin-surface2", key=record_key):
-                        t.p(f"Record #{record_number}",
-                            class_name="font-semibold mb-2 text-catppuccin-blue")
-                        
-                        # Display timestamp if available
-                        if "timestamp" in data:
-                            try:
-                                # Handle both string timestamps and numeric timestamps
-                                if isinstance(data["timestamp"], str):
-                                    # If it's a string, try to parse it as a number
-                                    timestamp_num = float(data["timestamp"])
-                                else:
-                                    timestamp_num = data["timestamp"]
-                                
-                                timestamp = window.Date(timestamp_num).toLocaleString()
-                                t.p(f"Time: {timestamp}", 
-                                    class_name="text-sm mb-2 text-catppuccin-subtext0")
-                            except Exception as e:
-                                # Fallback to showing the raw timestamp
-                                t.p(f"Time: {data['timestamp']}", 
-                                    class_name="text-sm mb-2 text-catppuccin-subtext0")
-                        
-                        # Display the data as formatted JSON with proper width constraints
-                        try:
-                            formatted_json = json.dumps(data, indent=2)
-                            t.pre(formatted_json, 
-                                  class_name="json-display")
-                        except Exception:
-                            t.p(str(data), 
-                                class_name="text-sm break-words text-catppuccin-text")
+                # Display the most recent data first; records are parsed on first render
+                records = self.state["stream_data"].newest_first()
+                if STREAM_VIRTUALIZE:
+                    top, records, bottom = self._stream_viewport().slice(records)
+                    with t.div(ref="stream_list", style=f"max-height: {STREAM_VIEWPORT_HEIGHT}px; overflow-y: auto;",
+                               on_scroll=self.handle_stream_scroll):
+                        t.div(style=f"height: {top}px;", key="stream-spacer-top")
+                        for record in records:
+                            self._render_stream_record(record)
+                        t.div(style=f"height: {bottom}px;", key="stream-spacer-bottom")
+                else:
+                    for record in records:
+                        self._render_stream_record(record)
+
+    def _render_stream_record(self, record):
+        # The sequence number is stable across evictions, so it keys the record
+        key = f"record-{record.seq}-{record.received}"
+        cards = self._record_cards()
+        card = cards.get(key, record.text)
+        if card is not None:
+            # Unchanged since an earlier render: reuse its tags instead of formatting it again
+            Tag.stack[-1].add(card)
+            self.refs[key] = card
+            return
+        data = record.data
+        # An explicit ref keeps puepy from recycling a cached card for another position
+        with t.div(class_name="mb-3 p-3 rounded border bg-catppuccin-surface1 border-catppuccin-surface2",
+                   ref=key, key=key, data_seq=str(record.seq)) as card:
+            t.p(f"Record #{record.seq}",
+                class_name="font-semibold mb-2 text-catppuccin-blue")
+            try:
+                timestamp = window.Date(record.received).toLocaleString()
+                t.p(f"Time: {timestamp}", 
+                    class_name="text-sm mb-2 text-catppuccin-subtext0")
+            except Exception as e:
+                # Fallback to showing the raw timestamp
+                t.p(f"Time: {record.received}", 
+                    class_name="text-sm mb-2 text-catppuccin-subtext0")
+            
+            # Display the data as formatted JSON with proper width constraints
+            if data is not None:
+                t.pre(record.formatted, 
+                      class_name="json-display")
+            else:
+                t.p(record.text, 
+                    class_name="text-sm break-words text-catppuccin-text")
+        cards.put(key, record.text, record.seq, card)
 
 
 # Define routes without base path in the decorator
 @app.page("/test", name="test")
-class TestPage(Page):
+class TestPage(PrerenderedPage):
     def goto_home(self, event):
         """Navigate to the home route using client-side routing"""
         if self.router:
@@ -1020,35 +1646,40 @@ class TestPage(Page):
         t.button("Go back to Home", on_click=self.goto_home, class_name="btn-base btn-blue")
 
 
-print("[STARTUP] Mounting app to #app...")
-try:
-    app.mount("#app")
-    print("[STARTUP] App mounted successfully")
-except Exception as e:
-    print(f"[STARTUP] Failed to mount app: {e}")
-    import traceback
-    traceback.print_exc()
-
-# Force auto-connect since on_mount might not be called
-print("[STARTUP] Manually triggering auto-connect...")
-try:
-    # Get the page instance and call auto_connect
-    if hasattr(app, 'page_instance'):
-        app.page_instance.auto_connect_stream()
-except Exception as e:
-    print(f"[STARTUP] Failed to manually trigger auto-connect: {e}")
-    # Try a different approach - create a delayed task
+# The prerender build step imports this module under CPython to render the
+# pages; only mount in the browser.
+if not is_server_side:
+    log.debug("INIT", "Mounting app to #app...")
     try:
-        def delayed_connect():
-            print("[STARTUP] Delayed connect attempting...")
-            # This will run after the page is fully initialized
-            import asyncio
-            from js import document
-            app_element = document.getElementById("app")
-            if app_element and hasattr(window, 'app_page_instance'):
-                window.app_page_instance.auto_connect_stream()
+        app.mount("#app")
+        log.info("INIT", "App mounted successfully")
+        if profiler.enabled:
+            profiler.install()
+    except Exception as e:
+        log.error("INIT", "Failed to mount app: %s", e)
+        import traceback
+        traceback.print_exc()
+
+    # Force auto-connect since on_mount might not be called
+    log.debug("INIT", "Manually triggering auto-connect...")
+    try:
+        # Get the page instance and call auto_connect
+        if hasattr(app, 'page_instance'):
+            app.page_instance.auto_connect_stream()
+    except Exception as e:
+        log.warning("INIT", "Failed to manually trigger auto-connect: %s", e)
+        # Try a different approach - create a delayed task
+        try:
+            def delayed_connect():
+                log.debug("INIT", "Delayed connect attempting...")
+                # This will run after the page is fully initialized
+                import asyncio
+                from js import document
+                app_element = document.getElementById("app")
+                if app_element and hasattr(window, 'app_page_instance'):
+                    window.app_page_instance.auto_connect_stream()
         
-        window.setTimeout(delayed_connect, 1000)
-        print("[STARTUP] Scheduled delayed auto-connect")
-    except Exception as e2:
-        print(f"[STARTUP] Failed to schedule delayed auto-connect: {e2}")
\ No newline at end of file
+            window.setTimeout(delayed_connect, 1000)
+            log.debug("INIT", "Scheduled delayed auto-connect")
+        except Exception as e2:
+            log.warning("INIT", "Failed to schedule delayed auto-connect: %s", e2)
\ No newline at end of file
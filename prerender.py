@@ -0,0 +1,192 @@
+"""
+Prerender the PuePy pages of the app into its index.html.
+
+The app module is imported under CPython with stand-ins for the browser-only
+`js` and `pyscript` modules, and every page reachable without route
+arguments is rendered into an xml.dom.minidom document. The resulting markup
+is written into index.html as one <template> per route, plus an inline
+script that shows the template matching the current hash route until
+PyScript boots and hydrates it (see PrerenderedPage in hello_world.py).
+
+Used by `build_assets.py prerender`; needs puepy installed.
+"""
+
+import contextlib
+import html
+import html.parser
+import importlib.util
+import io
+import itertools
+import os
+import re
+import sys
+import types
+from xml.dom import minidom
+
+START_MARKER = '<!-- prerender:start -->'
+END_MARKER = '<!-- prerender:end -->'
+VOID_ELEMENTS = frozenset(('area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+                           'source', 'track', 'wbr'))
+SWAP_SCRIPT = """<script>
+        // Show the prerendered page for the current hash route until PyScript hydrates it
+        (function () {
+            var route = location.hash.replace(/^#/, '').split('?')[0] || '/';
+            var templates = document.querySelectorAll('template[data-prerender-route]');
+            for (var i = 0; i < templates.length; i++) {
+                if (templates[i].getAttribute('data-prerender-route') === route) {
+                    document.getElementById('app').replaceChildren(templates[i].content.cloneNode(true));
+                }
+            }
+        })();
+    </script>"""
+
+class _Location:
+    hash = ''
+    pathname = '/'
+    search = ''
+
+class _Window:
+    """The parts of `js.window` the app reads while rendering."""
+    __INITIAL_STATE__ = ''
+    location = _Location()
+
+    def setTimeout(self, callback, delay=0):
+        return 0
+
+def _stand_in_modules():
+    window = _Window()
+    js = types.ModuleType('js')
+    js.window = window
+    js.document = None
+    js.setTimeout = window.setTimeout
+    pyscript = types.ModuleType('pyscript')
+    pyscript.window = window
+    return {'js': js, 'pyscript': pyscript}
+
+def load_module(script_path, module_name='hello_world'):
+    """Import the app module at `script_path` with the browser stand-ins."""
+    stand_ins = _stand_in_modules()
+    saved = {name: sys.modules.get(name) for name in stand_ins}
+    sys.modules.update(stand_ins)
+    try:
+        spec = importlib.util.spec_from_file_location(module_name, script_path)
+        module = importlib.util.module_from_spec(spec)
+        # The app prints startup and render diagnostics
+        with contextlib.redirect_stdout(io.StringIO()):
+            spec.loader.exec_module(module)
+    finally:
+        for name, previous in saved.items():
+            if previous is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = previous
+    return module
+
+def load_app(script_path, module_name='hello_world'):
+    """Import the app module at `script_path` and return its `app`."""
+    return load_module(script_path, module_name).app
+
+def to_html(node):
+    """Serialize a minidom node as HTML (void elements, no self-closing tags)."""
+    if node.nodeType == node.TEXT_NODE:
+        return html.escape(node.data, quote=False)
+    if node.nodeType != node.ELEMENT_NODE:
+        return ''
+    name = node.tagName.lower()
+    attrs = ''.join(f' {key}="{html.escape(value)}"' for key, value in node.attributes.items())
+    if name in VOID_ELEMENTS:
+        return f'<{name}{attrs}>'
+    return f'<{name}{attrs}>{"".join(to_html(child) for child in node.childNodes)}</{name}>'
+
+def render_page(app, page_class, route=None):
+    """Render `page_class` the way Application.mount_page() would, as HTML."""
+    from puepy.core import Tag
+
+    previous, Tag.document = Tag.document, minidom.Document()
+    # Ids come from a counter; start it where a freshly loaded client starts
+    app.element_id_generator.counter = itertools.count()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            page_class._expanded_props()
+            page = page_class(matched_route=route, application=app)
+            page.update_title()
+            with page:
+                page.generate_children()
+            element = page.render()
+    finally:
+        Tag.document = previous
+    element.setAttribute('data-prerendered', '')
+    return to_html(element)
+
+def prerender_routes(app):
+    """Return {hash route: HTML} for the default page and argument-free routes."""
+    pages = {}
+    if app.default_page is not None:
+        pages['/'] = render_page(app, app.default_page)
+    if app.router is not None:
+        for route in app.router.routes:
+            if '<' not in route.path_match:
+                pages['/' + route.path_match.strip('/')] = render_page(app, route.page, route)
+    return pages
+
+class _MountPointFinder(html.parser.HTMLParser):
+    """Finds the (line, column) of the end tag of the element with id `mount_id`."""
+
+    def __init__(self, mount_id):
+        super().__init__()
+        self.mount_id = mount_id
+        self.depth = 0
+        self.end = None
+
+    def handle_starttag(self, tag, attrs):
+        if self.end is not None or tag in VOID_ELEMENTS:
+            return
+        if self.depth:
+            self.depth += 1
+        elif dict(attrs).get('id') == self.mount_id:
+            self.depth = 1
+
+    def handle_endtag(self, tag):
+        if self.depth and self.end is None:
+            self.depth -= 1
+            if not self.depth:
+                self.end = self.getpos()
+
+def _end_of_element(document, mount_id):
+    """Return the offset just past the closing tag of the element `mount_id`."""
+    lines = document.splitlines(True)
+    finder = _MountPointFinder(mount_id)
+    finder.feed(document)
+    if finder.end is None:
+        raise ValueError(f'no element with id="{mount_id}" found')
+    line, column = finder.end
+    offset = sum(len(text) for text in lines[:line - 1]) + column
+    return document.index('>', offset) + 1
+
+def inject(document, pages, mount_id='app'):
+    """Return `document` with the prerendered `pages` placed after the mount point."""
+    document = re.sub(r'\n?[ \t]*' + re.escape(START_MARKER) + '.*?' + re.escape(END_MARKER), '',
+                      document, flags=re.DOTALL)
+    templates = ''.join(f'\n    <template data-prerender-route="{html.escape(route)}">{markup}</template>'
+                        for route, markup in pages.items())
+    block = f'\n    {START_MARKER}{templates}\n    {SWAP_SCRIPT}\n    {END_MARKER}'
+    end = _end_of_element(document, mount_id)
+    return document[:end] + block + document[end:]
+
+def app_script(document):
+    """Return the src of the PyScript app script in `document`."""
+    match = re.search(r'<script[^>]*\btype="m?py"[^>]*\bsrc="([^"]+)"', document)
+    if match is None:
+        raise ValueError('no <script type="mpy"> or <script type="py"> with a src found')
+    return match.group(1)
+
+def prerender_app(root, entry='index.html'):
+    """Prerender the app referenced by `root`/`entry` into that file; return the routes."""
+    path = os.path.join(root, entry)
+    with open(path, encoding='utf-8') as f:
+        document = f.read()
+    script = os.path.join(root, os.path.normpath(app_script(document).lstrip('/')))
+    pages = prerender_routes(load_app(script))
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(inject(document, pages))
+    return list(pages)
@@ -2,43 +2,2447 @@
 """
 A simple HTTP server that serves static files and supports SPA routing.
 For any route that doesn't correspond to a file, it serves index.html.
+
+Connections are handled by one of several engines, selected with --engine:
+
+  serial   one request at a time (the original behaviour)
+  threads  a bounded pool of worker threads (default)
+  asyncio  a single event loop; responses are buffered and streamed back
+           with flow control so slow clients never hold a worker
+
+File responses are kept in an in-memory LRU cache (see AssetCache) with
+strong ETags, so conditional requests are answered with 304 from memory.
+Compressible assets are sent zstd- or gzip-encoded according to
+Accept-Encoding, preferring the precompressed siblings written by
+`build_assets.py compress` and falling back to gzip on the fly.
+
+Single byte ranges (Range / If-Range) are answered with 206. Files too large
+for the cache are streamed with sendfile() instead of a userspace copy loop.
+
+Servable files are indexed at startup into a RouteManifest, which doubles as
+a strict allow-list: request routing and the SPA fallback are dict lookups,
+and a background watcher rescans the tree to pick up changes.
+
+For deployments, `build_assets.py pack` writes the whole tree (with its
+precompressed variants, ETags and preload links) into one file that --pack
+serves from a read-only mmap (see AssetPack): no per-request open() or
+stat(), and worker processes share the pages.
+
+Responses are HTTP/1.1 with persistent connections: idle connections are
+closed after --keepalive-timeout seconds and after --max-requests requests,
+and pipelined requests are answered in order.
+
+With --workers N a supervisor forks N worker processes that each bind the
+port with SO_REUSEPORT, restarts workers that die, and drains them on
+SIGTERM. Every process stops accepting and finishes in-flight requests on
+SIGTERM.
+
+Under overload the server sheds work instead of queueing it (see
+AdmissionControl): --max-connections answers connections beyond the limit
+with an immediate 503 and Retry-After, --rate-limit/--rate-burst give each
+client address a token bucket (429 when empty), --max-expensive caps
+concurrent downloads of files too large for the asset cache so cached
+assets keep priority, and --backlog bounds the kernel's accept queue.
+
+Request counts, latency histograms, bytes sent, open connections and cache
+hit ratios are exposed in Prometheus text format at --metrics-path (per
+process; see Metrics).
+
+Access log lines are handed to a background writer through a bounded queue
+(see AccessLog), so request threads never block on log I/O; when the queue
+is full, lines are dropped and counted.
+
+The boot chain referenced by index.html and its PyScript config (styles,
+module scripts and their static imports, the app script, config and
+packages) is read at startup and advertised with Link preload headers on
+the HTML shell, optionally ahead of it as a 103 Early Hints response, so
+browsers fetch it in parallel instead of as a waterfall.
+
+With --records-api the server also answers a small in-memory stand-in for
+the TrailBase records API the app talks to (list, read, create, PATCH,
+delete and `subscribe` server-sent events) under /api/records/v1/. Event
+streams are handed to one EventBroadcaster thread that fans each change out
+to every subscriber through a bounded per-client queue, evicting clients
+that fall behind, so thousands of streams cost neither threads nor
+coroutines.
+
+With --records-upstream the event streams are instead proxied to TrailBase:
+every topic has one upstream subscription (see RecordsProxy), reconnected
+with backoff, whose events are fanned out the same way. The broadcaster
+numbers events and replays recent ones to late joiners and to clients
+resuming with Last-Event-ID.
+
+Content-hashed assets written by `build_assets.py fingerprint` are served
+with a year-long immutable Cache-Control; HTML gets --html-max-age and
+everything else is revalidated with its ETag.
 """
 
+import argparse
+import asyncio
+import bisect
+import email.utils
+import gzip
+import hashlib
+import html.parser
+import http.client
 import http.server
+import io
+import json
+import mimetypes
+import mmap
+import queue
+import random
+import socket
 import socketserver
 import os
+import posixpath
+import re
+import selectors
+import signal
+import stat
 import sys
-from urllib.parse import urlparse
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import unquote, urlparse
+
+DEFAULT_PORT = 4000
+DEFAULT_THREADS = 32
+ENGINES = ('serial', 'threads', 'asyncio')
+DEFAULT_CACHE_MB = 64
+DEFAULT_SENDFILE_KB = 1024
+DEFAULT_WATCH_INTERVAL = 1.0
+DEFAULT_KEEPALIVE_TIMEOUT = 5.0
+DEFAULT_MAX_REQUESTS = 100
+# Seconds the asyncio engine waits for open connections when shutting down
+DRAIN_TIMEOUT = 10.0
+# Minimum lifetime of a worker before it is restarted without a pause
+RESPAWN_BACKOFF = 1.0
+DEFAULT_METRICS_PATH = '/metrics'
+ACCESS_LOG_FORMATS = ('text', 'json')
+# Access log entries buffered per process before new ones are dropped
+DEFAULT_ACCESS_LOG_BUFFER = 8192
+ACCESS_LOG_BATCH = 256
+RECORDS_API_PREFIX = '/api/records/v1/'
+# Events queued per event-stream client before it is evicted as too slow
+DEFAULT_SSE_QUEUE = 256
+DEFAULT_SSE_HEARTBEAT = 15.0
+# Events kept per topic for late joiners and Last-Event-ID resume
+DEFAULT_SSE_REPLAY = 32
+# Reconnect delays to an upstream event stream: first, and cap for the doubling
+UPSTREAM_BACKOFF = (0.5, 30.0)
+UPSTREAM_TIMEOUT = 30.0
+# An upstream stream that stays silent (no heartbeat) this long is reconnected
+UPSTREAM_READ_TIMEOUT = 60.0
+# Seconds an upstream subscription is kept open without local subscribers
+UPSTREAM_IDLE = 30.0
+# Listen backlog; socketserver's default of 5 drops SYNs when many clients
+# (event-stream subscribers, say) connect at once.
+LISTEN_BACKLOG = socket.SOMAXCONN
+# Asset packs (see AssetPack) start with PACK_MAGIC and an 8-byte header length
+PACK_MAGIC = b'SPAPACK\x01'
+# Admission control (see AdmissionControl); 0 disables a limit
+DEFAULT_MAX_CONNECTIONS = 0
+DEFAULT_MAX_EXPENSIVE = 0
+DEFAULT_RATE_LIMIT = 0.0
+DEFAULT_RATE_BURST = 20
+# Clients whose request rate is tracked; the least recently seen are forgotten
+RATE_LIMIT_CLIENTS = 65536
+# Seconds clients are asked to wait after a 503
+SHED_RETRY_AFTER = 1
+SHED_RESPONSE = (f'HTTP/1.1 503 Service Unavailable\r\nRetry-After: {SHED_RETRY_AFTER}\r\n'
+                 'Content-Length: 0\r\nConnection: close\r\n\r\n').encode('latin-1')
+# Hex digits of the content hash in fingerprinted asset names, which look
+# like dist/styles.<hash>.css or, where the name must not change, <hash>/name
+FINGERPRINT_LENGTH = 12
+FINGERPRINT_RE = re.compile(r'\.[0-9a-f]{%d}\.[^/]+$|/[0-9a-f]{%d}/[^/]+$' % (FINGERPRINT_LENGTH, FINGERPRINT_LENGTH))
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+DEFAULT_HTML_MAX_AGE = 0
+# Upper bounds of the request latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# Names never served, at any depth of the tree.
+EXCLUDED_NAMES = ('node_modules', '__pycache__')
+
+# Content encodings in server preference order, with their sibling suffixes.
+ENCODING_SUFFIXES = {'zstd': '.zst', 'gzip': '.gz'}
+COMPRESSIBLE_TYPES = ('application/javascript', 'application/json', 'image/svg+xml')
+# Bodies outside this range are not worth compressing on the fly.
+MIN_COMPRESS_BYTES = 256
+MAX_DYNAMIC_COMPRESS_BYTES = 1024 * 1024
+
+def is_compressible(content_type):
+    return content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES
+
+def parse_accept_encoding(header):
+    """Return the encodings from ENCODING_SUFFIXES the client accepts, best first."""
+    weights = {}
+    for item in header.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding == '*':
+            for encoding in ENCODING_SUFFIXES:
+                weights.setdefault(encoding, q)
+        elif coding in ENCODING_SUFFIXES:
+            weights[coding] = q
+    ranked = [encoding for encoding in ENCODING_SUFFIXES if weights.get(encoding, 0) > 0]
+    return sorted(ranked, key=lambda encoding: -weights[encoding])
+
+def is_fingerprinted(url_path):
+    return FINGERPRINT_RE.search(url_path) is not None
+
+def guess_content_type(path):
+    _, ext = os.path.splitext(path)
+    extensions_map = http.server.SimpleHTTPRequestHandler.extensions_map
+    if ext in extensions_map:
+        return extensions_map[ext]
+    if ext.lower() in extensions_map:
+        return extensions_map[ext.lower()]
+    return mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+class RouteEntry:
+    __slots__ = ('path', 'size', 'mtime_ns', 'content_type', 'immutable', 'variants')
+
+    def __init__(self, path, st, url):
+        self.path = path
+        self.size = st.st_size
+        self.mtime_ns = st.st_mtime_ns
+        self.content_type = guess_content_type(path)
+        self.immutable = is_fingerprinted(url)
+        # encoding -> RouteEntry of a fresh precompressed sibling
+        self.variants = {}
+
+    def same_file(self, other):
+        return self.path == other.path and self.size == other.size and self.mtime_ns == other.mtime_ns
+
+class RouteManifest:
+    """Index of servable files under `root`, keyed by URL path.
+
+    Only files in the index are ever opened, so it is also the allow-list
+    that keeps requests inside the tree: hidden files, symlinks leaving the
+    root and EXCLUDED_NAMES are never indexed. Unknown paths resolve to the
+    SPA fallback ('/', i.e. index.html).
+    """
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        # The shell's resolved path, as RouteEntry.path has it
+        self.index_path = os.path.join(self.root, 'index.html')
+        self.routes = self._scan()
+        self._watcher = None
+
+    def lookup(self, url_path):
+        return self.routes.get(unquote(url_path))
+
+    def resolve(self, url_path):
+        """Return (entry, is_fallback) for `url_path`.
+
+        Unknown paths get the SPA fallback entry, which is None if the tree
+        has no index.html.
+        """
+        routes = self.routes
+        entry = routes.get(unquote(url_path))
+        if entry is not None:
+            return entry, False
+        return routes.get('/'), True
+
+    def refresh(self):
+        """Rescan the tree; swap in the new index if anything changed."""
+        routes = self._scan()
+        current = self.routes
+        if routes.keys() != current.keys() or any(
+                not entry.same_file(current[url]) for url, entry in routes.items()):
+            self.routes = routes
+            return True
+        return False
+
+    def watch(self, interval=DEFAULT_WATCH_INTERVAL):
+        """Refresh the index every `interval` seconds on a daemon thread."""
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh()
+                except OSError:
+                    pass
+        self._watcher = threading.Thread(target=run, name='route-manifest-watcher', daemon=True)
+        self._watcher.start()
+
+    def _scan(self):
+        routes = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [name for name in dirnames if self._allowed(dirpath, name)]
+            for name in filenames:
+                if not self._allowed(dirpath, name):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+                url = '/' + os.path.relpath(path, self.root).replace(os.sep, '/')
+                routes[url] = RouteEntry(path, st, url)
+                if name == 'index.html':
+                    routes[url[:-len('index.html')]] = routes[url]
+        for url, entry in routes.items():
+            if not is_compressible(entry.content_type):
+                continue
+            for encoding, suffix in ENCODING_SUFFIXES.items():
+                variant = routes.get(url + suffix)
+                if variant is not None and variant.mtime_ns >= entry.mtime_ns:
+                    entry.variants[encoding] = variant
+        return routes
+
+    def _allowed(self, dirpath, name):
+        if name.startswith('.') or name in EXCLUDED_NAMES:
+            return False
+        path = os.path.join(dirpath, name)
+        if os.path.islink(path):
+            target = os.path.realpath(path)
+            return target.startswith(self.root + os.sep)
+        return True
+
+# Static imports (and literal dynamic imports) in inline module scripts
+_IMPORT_RE = re.compile(r"""\bimport\s*(?:[\w*{}\s,]+from\s*)?\(?\s*['"]([^'"]+)['"]""")
+
+class _BootChainParser(html.parser.HTMLParser):
+    """Collects (url, rel, as, crossorigin) for resources index.html boots with."""
+
+    def __init__(self):
+        super().__init__()
+        self.resources = []
+        self.configs = []
+        self._module_script = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'link' and attrs.get('rel') == 'stylesheet' and attrs.get('href'):
+            self.resources.append((attrs['href'], 'preload', 'style', False))
+        elif tag == 'script':
+            kind = attrs.get('type')
+            self._module_script = kind == 'module' and 'src' not in attrs
+            if kind == 'module' and attrs.get('src'):
+                self.resources.append((attrs['src'], 'modulepreload', None, False))
+            elif kind in ('py', 'mpy'):
+                # PyScript loads these with fetch(), which is a CORS request
+                if attrs.get('src'):
+                    self.resources.append((attrs['src'], 'preload', 'fetch', True))
+                if attrs.get('config'):
+                    self.resources.append((attrs['config'], 'preload', 'fetch', True))
+                    self.configs.append(attrs['config'])
+
+    def handle_endtag(self, tag):
+        if tag == 'script':
+            self._module_script = False
+
+    def handle_data(self, data):
+        if self._module_script:
+            for specifier in _IMPORT_RE.findall(data):
+                if specifier.startswith(('./', '../', '/')):
+                    self.resources.append((specifier, 'modulepreload', None, False))
+
+def _local_path(root, ref):
+    """Return (url_path, file_path) for a same-origin reference, or None."""
+    parsed = urlparse(ref)
+    if parsed.scheme or parsed.netloc:
+        return None
+    # The shell is also served for deep routes; resolve against the root
+    url_path = posixpath.normpath('/' + unquote(parsed.path).lstrip('/'))
+    return url_path, os.path.join(root, *url_path.split('/'))
+
+def preload_links(root, entry='index.html'):
+    """Return a Link header value preloading the boot chain of `entry`, or None.
+
+    Same-origin references are only included if the file exists under
+    `root`; local packages and files listed in a JSON PyScript config are
+    followed as well.
+    """
+    try:
+        with open(os.path.join(root, entry), encoding='utf-8') as f:
+            parser = _BootChainParser()
+            parser.feed(f.read())
+    except OSError:
+        return None
+    resources = list(parser.resources)
+    for config in parser.configs:
+        local = _local_path(root, config)
+        if local is None or not local[1].endswith('.json'):
+            continue
+        try:
+            with open(local[1], encoding='utf-8') as f:
+                settings = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for ref in list(settings.get('packages', [])) + list(settings.get('files', {})):
+            if _local_path(root, ref) is not None:
+                resources.append((ref, 'preload', 'fetch', True))
+
+    links = []
+    seen = set()
+    for ref, rel, kind, crossorigin in resources:
+        local = _local_path(root, ref)
+        if local is not None:
+            if not os.path.isfile(local[1]):
+                continue
+            ref = local[0]
+        if ref in seen:
+            continue
+        seen.add(ref)
+        link = f'<{ref}>; rel={rel}'
+        if kind:
+            link += f'; as={kind}'
+        if crossorigin:
+            link += '; crossorigin'
+        links.append(link)
+    return ', '.join(links) or None
+
+def asset_etag(body):
+    return '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+
+class CachedAsset:
+    __slots__ = ('body', 'content_type', 'etag', 'last_modified', 'mtime', 'mtime_ns', 'checked_at',
+                 'variants', '_gzipped')
+
+    def __init__(self, body, content_type, mtime, mtime_ns, checked_at):
+        self.body = body
+        self.content_type = content_type
+        self.etag = asset_etag(body)
+        self.last_modified = email.utils.formatdate(mtime, usegmt=True)
+        self.mtime = int(mtime)
+        self.mtime_ns = mtime_ns
+        self.checked_at = checked_at
+        # encoding -> whether a fresh precompressed sibling exists
+        self.variants = {}
+        self._gzipped = None
+
+    @property
+    def size(self):
+        return len(self.body)
+
+    @property
+    def footprint(self):
+        """Bytes held for this asset, including a gzip copy made on the fly."""
+        return len(self.body) + (len(self._gzipped.body) if self._gzipped is not None else 0)
+
+    def open_range(self, start, length):
+        if start == 0 and length == len(self.body):
+            return io.BytesIO(self.body)
+        return io.BytesIO(self.body[start:start + length])
+
+class FileAsset:
+    """An open file that is served from disk rather than from the cache."""
+
+    __slots__ = ('file', 'size', 'content_type', 'etag', 'last_modified', 'mtime')
+
+    def __init__(self, file, st, content_type):
+        self.file = file
+        self.size = st.st_size
+        self.content_type = content_type
+        self.etag = '"%x-%x"' % (st.st_size, st.st_mtime_ns)
+        self.last_modified = email.utils.formatdate(st.st_mtime, usegmt=True)
+        self.mtime = int(st.st_mtime)
+
+    def open_range(self, start, length):
+        return FileRange(self.file, start, length)
+
+class FileRange:
+    """A byte window of an open file, sent with sendfile() when possible."""
+
+    def __init__(self, file, offset, count):
+        self.file = file
+        self.offset = offset
+        self.count = count
+
+    def read(self, size=-1):
+        self.file.seek(self.offset)
+        size = self.count if size < 0 else min(size, self.count)
+        data = self.file.read(size)
+        self.offset += len(data)
+        self.count -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+class PackedAsset:
+    """A file inside an AssetPack; `body` is a view of the mapped pack."""
+
+    __slots__ = ('name', 'body', 'content_type', 'etag', 'last_modified', 'mtime', 'immutable', 'variants')
+
+    def __init__(self, name, body, content_type, etag, mtime):
+        self.name = name
+        self.body = body
+        self.content_type = content_type
+        self.etag = etag
+        self.last_modified = email.utils.formatdate(mtime, usegmt=True)
+        self.mtime = int(mtime)
+        self.immutable = is_fingerprinted('/' + name)
+        # encoding -> PackedAsset of the precompressed sibling
+        self.variants = {}
+
+    @property
+    def size(self):
+        return len(self.body)
+
+    def open_range(self, start, length):
+        return PackRange(self.body[start:start + length])
+
+class PackRange:
+    """A byte window of a mapped pack, written without copying it first."""
+
+    __slots__ = ('view',)
+
+    def __init__(self, view):
+        self.view = view
+
+    def close(self):
+        # The asyncio engine may still hold the view; it goes with the last reference
+        pass
+
+class AssetPack:
+    """Servable files packed into one file by `build_assets.py pack`, mmapped.
+
+    The pack is PACK_MAGIC, the length of a JSON header, the header and then
+    the file bodies. The header lists every file (name, offset and length in
+    the body section, content type, ETag, mtime, precompressed variants), the
+    URL routes that map to them and the boot-chain Link value. Requests are
+    answered from read-only views of the mapping, with no open() or stat(),
+    and every worker process mapping the pack shares its page cache.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(PACK_MAGIC)] != PACK_MAGIC:
+            raise ValueError(f'{path} is not an asset pack')
+        start = len(PACK_MAGIC) + 8
+        header_length = int.from_bytes(self._map[len(PACK_MAGIC):start], 'big')
+        header = json.loads(self._map[start:start + header_length])
+        view = memoryview(self._map)
+        base = start + header_length
+        files = [PackedAsset(record['name'], view[base + record['offset']:base + record['offset'] + record['length']],
+                             record['content_type'], record['etag'], record['mtime'])
+                 for record in header['files']]
+        for asset, record in zip(files, header['files']):
+            for encoding, index in record['variants'].items():
+                # Served as an encoding of `asset`, so with its content type
+                variant = header['files'][index]
+                asset.variants[encoding] = PackedAsset(variant['name'], files[index].body, asset.content_type,
+                                                       variant['etag'], variant['mtime'])
+        self.routes = {url: files[index] for url, index in header['routes'].items()}
+        self.links = header.get('links')
+        self.size = len(self._map)
+
+    def resolve(self, url_path):
+        """Return (asset, is_fallback) like RouteManifest.resolve()."""
+        asset = self.routes.get(unquote(url_path))
+        if asset is not None:
+            return asset, False
+        return self.routes.get('/'), True
+
+RANGE_NOT_SATISFIABLE = object()
+
+def etag_matches(etag, header):
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or etag in tags or 'W/' + etag in tags
+
+def parse_range(header, size):
+    """Parse a single-range `Range` header against an entity of `size` bytes.
+
+    Returns (start, length), None when the header should be ignored (absent,
+    malformed or multi-range), or RANGE_NOT_SATISFIABLE.
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, sep, last = spec.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+            if last and end < start:
+                return None
+        else:
+            suffix = int(last)
+            if suffix == 0:
+                return RANGE_NOT_SATISFIABLE
+            start = max(size - suffix, 0)
+            end = size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        return RANGE_NOT_SATISFIABLE
+    return start, min(end, size - 1) - start + 1
+
+class AssetCache:
+    """LRU cache of file bodies keyed by resolved path, bounded by total bytes.
+
+    Entries are revalidated against the file's mtime at most once every
+    `revalidate_after` seconds, so hot assets are served without any syscall.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_MB * 1024 * 1024, max_entry_bytes=None, revalidate_after=1.0):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes if max_entry_bytes is not None else max_bytes // 4
+        self.revalidate_after = revalidate_after
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, content_type, mtime_ns=None):
+        """Return the CachedAsset for `path`, loading it on a miss.
+
+        When the caller already knows the file's `mtime_ns` (from the route
+        manifest) it is used for validation instead of a stat() call.
+        Returns None when the path is not a regular file or is too large to
+        cache; the caller should then serve it from disk.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                if mtime_ns is not None:
+                    fresh = entry.mtime_ns == mtime_ns
+                else:
+                    fresh = now - entry.checked_at < self.revalidate_after
+                if fresh:
+                    self._entries.move_to_end(path)
+                    self.hits += 1
+                    return entry
+        if entry is not None and mtime_ns is None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                self.invalidate(path)
+                return None
+            if st.st_mtime_ns == entry.mtime_ns and st.st_size == len(entry.body):
+                entry.checked_at = now
+                with self._lock:
+                    if path in self._entries:
+                        self._entries.move_to_end(path)
+                    self.hits += 1
+                return entry
+        return self._load(path, content_type, now)
+
+    def invalidate(self, path):
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self.size -= entry.footprint
+
+    def gzipped(self, path, entry):
+        """Return a gzip-encoded copy of `entry`, compressed once and counted in `size`."""
+        variant = entry._gzipped
+        if variant is not None:
+            return variant
+        body = gzip.compress(entry.body, compresslevel=6, mtime=0)
+        variant = CachedAsset(body, entry.content_type, entry.mtime, entry.mtime_ns, entry.checked_at)
+        with self._lock:
+            if entry._gzipped is not None:
+                return entry._gzipped
+            entry._gzipped = variant
+            # An entry already evicted or replaced is no longer counted
+            if self._entries.get(path) is entry:
+                self.size += len(body)
+                self._evict()
+        return variant
+
+    def _load(self, path, content_type, now):
+        try:
+            with open(path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                if not stat.S_ISREG(st.st_mode) or st.st_size > self.max_entry_bytes:
+                    self.invalidate(path)
+                    return None
+                body = f.read()
+        except OSError:
+            self.invalidate(path)
+            return None
+        entry = CachedAsset(body, content_type, st.st_mtime, st.st_mtime_ns, now)
+        with self._lock:
+            self.misses += 1
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self.size -= old.footprint
+            self._entries[path] = entry
+            self.size += len(body)
+            self._evict()
+        return entry
+
+    def _evict(self):
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= evicted.footprint
+
+class AdmissionControl:
+    """Decides what to turn away when the server is saturated.
+
+    Connections beyond `max_connections` (queued or active) are answered
+    with an immediate 503 instead of waiting for a worker. Each client
+    address gets a token bucket refilled at `rate` requests per second up to
+    `burst`; requests beyond it get 429. At most `max_expensive` requests
+    for files streamed from disk (too large for the asset cache) run at
+    once and the rest get 503, so the small cached assets of the app keep
+    flowing while big downloads are throttled. Turned-away counts are kept
+    in `shed` by reason.
+    """
+
+    def __init__(self, max_connections=DEFAULT_MAX_CONNECTIONS, rate=DEFAULT_RATE_LIMIT,
+                 burst=DEFAULT_RATE_BURST, max_expensive=DEFAULT_MAX_EXPENSIVE):
+        self.max_connections = max_connections
+        self.rate = rate
+        self.burst = burst
+        self.connections = 0
+        self.shed = {'connections': 0, 'rate': 0, 'expensive': 0}
+        self._expensive = threading.BoundedSemaphore(max_expensive) if max_expensive else None
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def open_connection(self):
+        """Count a new connection; return False if it should be shed instead."""
+        with self._lock:
+            if self.max_connections and self.connections >= self.max_connections:
+                self.shed['connections'] += 1
+                return False
+            self.connections += 1
+            return True
+
+    def close_connection(self):
+        with self._lock:
+            self.connections -= 1
+
+    def throttle(self, client):
+        """Take a token for `client`; return 0, or the seconds until one is available."""
+        if not self.rate:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._clients.pop(client, None)
+            tokens = self.burst if bucket is None else min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / self.rate
+                self.shed['rate'] += 1
+            self._clients[client] = (tokens, now)
+            if len(self._clients) > RATE_LIMIT_CLIENTS:
+                self._clients.popitem(last=False)
+        return wait
+
+    def acquire_expensive(self):
+        if self._expensive is None or self._expensive.acquire(blocking=False):
+            return True
+        with self._lock:
+            self.shed['expensive'] += 1
+        return False
+
+    def release_expensive(self):
+        if self._expensive is not None:
+            self._expensive.release()
+
+def shed_connection(sock):
+    """Answer a connection accepted over the limit with 503 and close it."""
+    try:
+        sock.setblocking(False)
+        # Read what has arrived, so closing does not reset the connection
+        # before the client has seen the response.
+        try:
+            sock.recv(65536)
+        except BlockingIOError:
+            pass
+        sock.send(SHED_RESPONSE)
+        sock.shutdown(socket.SHUT_WR)
+    except OSError:
+        pass
+    finally:
+        sock.close()
+
+class _MetricsShard:
+    __slots__ = ('requests', 'responses', 'latency', 'latency_sum', 'bytes_sent', 'opened', 'closed')
+
+    def __init__(self):
+        self.requests = {}
+        self.responses = {}
+        # route -> per-bucket counts, the last slot being +Inf
+        self.latency = {}
+        self.latency_sum = {}
+        self.bytes_sent = 0
+        self.opened = 0
+        self.closed = 0
+
+class Metrics:
+    """Server metrics kept in per-thread shards.
+
+    Each thread only ever writes to its own shard, so recording takes no
+    lock; render() sums the shards when the metrics path is scraped. Every
+    process keeps its own metrics, so with --workers each scrape reports the
+    worker that answered it.
+    """
+
+    def __init__(self, cache=None, access_log=None, broadcaster=None, records_proxy=None, admission=None):
+        self.cache = cache
+        self.admission = admission
+        self.access_log = access_log
+        self.broadcaster = broadcaster
+        self.records_proxy = records_proxy
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _MetricsShard()
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def connection_opened(self):
+        self._shard().opened += 1
+
+    def connection_closed(self):
+        self._shard().closed += 1
+
+    def record(self, route, status, seconds, bytes_sent):
+        shard = self._shard()
+        shard.requests[route] = shard.requests.get(route, 0) + 1
+        shard.responses[status] = shard.responses.get(status, 0) + 1
+        buckets = shard.latency.get(route)
+        if buckets is None:
+            buckets = shard.latency[route] = [0] * (len(LATENCY_BUCKETS) + 1)
+            shard.latency_sum[route] = 0.0
+        buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        shard.latency_sum[route] += seconds
+        shard.bytes_sent += bytes_sent
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            shards = list(self._shards)
+        requests, responses, latency, latency_sum = {}, {}, {}, {}
+        for shard in shards:
+            for route, count in list(shard.requests.items()):
+                requests[route] = requests.get(route, 0) + count
+            for status, count in list(shard.responses.items()):
+                responses[status] = responses.get(status, 0) + count
+            for route, buckets in list(shard.latency.items()):
+                total = latency.setdefault(route, [0] * len(buckets))
+                for i, count in enumerate(buckets):
+                    total[i] += count
+                latency_sum[route] = latency_sum.get(route, 0.0) + shard.latency_sum.get(route, 0.0)
+        opened = sum(shard.opened for shard in shards)
+        closed = sum(shard.closed for shard in shards)
+
+        lines = []
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{name}{labels} {value}')
+
+        metric('spa_requests_total', 'counter',
+               'Requests served, by route kind (static, fallback, not_modified, error, metrics).',
+               [(f'{{route="{route}"}}', count) for route, count in sorted(requests.items())])
+        metric('spa_responses_total', 'counter', 'Responses sent, by status code.',
+               [(f'{{code="{status}"}}', count) for status, count in sorted(responses.items())])
+        lines.append('# HELP spa_request_duration_seconds Time from request line to response sent.')
+        lines.append('# TYPE spa_request_duration_seconds histogram')
+        for route, buckets in sorted(latency.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), buckets):
+                cumulative += count
+                lines.append(f'spa_request_duration_seconds_bucket{{route="{route}",le="{bound}"}} {cumulative}')
+            lines.append(f'spa_request_duration_seconds_sum{{route="{route}"}} {latency_sum[route]:.6f}')
+            lines.append(f'spa_request_duration_seconds_count{{route="{route}"}} {cumulative}')
+        metric('spa_response_bytes_total', 'counter', 'Response body bytes sent.',
+               [('', sum(shard.bytes_sent for shard in shards))])
+        metric('spa_connections_total', 'counter', 'Client connections accepted.', [('', opened)])
+        metric('spa_connections_in_flight', 'gauge', 'Client connections currently open.', [('', opened - closed)])
+        if self.cache is not None:
+            hits, misses = self.cache.hits, self.cache.misses
+            metric('spa_cache_hits_total', 'counter', 'Asset cache hits.', [('', hits)])
+            metric('spa_cache_misses_total', 'counter', 'Asset cache misses.', [('', misses)])
+            metric('spa_cache_hit_ratio', 'gauge', 'Asset cache hits over lookups.',
+                   [('', f'{hits / (hits + misses):.4f}' if hits + misses else 0)])
+            metric('spa_cache_bytes', 'gauge', 'Bytes held by the asset cache.', [('', self.cache.size)])
+        if self.admission is not None:
+            metric('spa_shed_total', 'counter', 'Connections and requests turned away, by reason.',
+                   [(f'{{reason="{reason}"}}', count) for reason, count in sorted(self.admission.shed.items())])
+        if self.access_log is not None:
+            metric('spa_access_log_dropped_total', 'counter', 'Access log entries dropped because the buffer was full.',
+                   [('', self.access_log.dropped)])
+        if self.broadcaster is not None:
+            broadcaster = self.broadcaster
+            metric('spa_sse_subscribers', 'gauge', 'Open event-stream subscriptions.', [('', broadcaster.subscribers)])
+            metric('spa_sse_events_published_total', 'counter', 'Events published to the broadcaster.',
+                   [('', broadcaster.published)])
+            metric('spa_sse_frames_sent_total', 'counter', 'Event frames fully written to subscribers.',
+                   [('', broadcaster.delivered)])
+            metric('spa_sse_evictions_total', 'counter', 'Subscribers dropped because their queue was full.',
+                   [('', broadcaster.evicted)])
+            metric('spa_sse_replayed_total', 'counter', 'Buffered events replayed to new subscribers.',
+                   [('', broadcaster.replayed)])
+        if self.records_proxy is not None:
+            proxy = self.records_proxy
+            metric('spa_sse_upstream_streams', 'gauge', 'Open upstream event-stream subscriptions.',
+                   [('', len(proxy.streams))])
+            metric('spa_sse_upstream_connects_total', 'counter', 'Successful upstream event-stream connections.',
+                   [('', proxy.connects)])
+            metric('spa_sse_upstream_reconnects_total', 'counter', 'Upstream event streams lost or refused.',
+                   [('', proxy.reconnects)])
+        return '\n'.join(lines) + '\n'
+
+class AccessLog:
+    """Access log written by a background thread.
+
+    log() only samples and enqueues a tuple; formatting and writing happen on
+    the writer thread, which drains up to ACCESS_LOG_BATCH entries per write.
+    The queue is bounded: when the writer falls behind, new entries are
+    dropped and counted in `dropped` rather than slowing requests down.
+    Error responses (status >= 400) are never sampled out.
+    """
+
+    def __init__(self, stream, fmt='text', sample=1.0, capacity=DEFAULT_ACCESS_LOG_BUFFER):
+        if fmt not in ACCESS_LOG_FORMATS:
+            raise ValueError(f"Unknown access log format: {fmt}")
+        self.stream = stream
+        self.format = fmt
+        self.sample = sample
+        self.dropped = 0
+        self._queue = queue.Queue(capacity)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='access-log', daemon=True)
+        self._thread.start()
+
+    def log(self, client, requestline, status, bytes_sent, seconds):
+        if status < 400 and self.sample < 1.0 and random.random() >= self.sample:
+            return
+        self._put((time.time(), client, requestline, status, bytes_sent, seconds))
+
+    def message(self, client, text):
+        """Log a free-form message, such as the base handler's error lines."""
+        self._put((time.time(), client, text))
+
+    def close(self, timeout=DRAIN_TIMEOUT):
+        """Write out what is buffered and stop the writer thread."""
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def _put(self, entry):
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while batch[-1] is not None and len(batch) < ACCESS_LOG_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = batch[-1] is None
+            if stopping:
+                batch.pop()
+            try:
+                self.stream.write(''.join(self._format(entry) for entry in batch))
+                self.stream.flush()
+            except (OSError, ValueError):
+                with self._lock:
+                    self.dropped += len(batch)
+            if stopping:
+                return
+
+    def _format(self, entry):
+        timestamp, client = entry[0], entry[1]
+        if self.format == 'json':
+            stamp = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(timestamp))
+            record = {'time': f'{stamp}.{int(timestamp * 1000) % 1000:03d}Z', 'client': client}
+            if len(entry) == 3:
+                record['message'] = entry[2]
+            else:
+                record.update(request=entry[2], status=entry[3], bytes=entry[4], duration_ms=round(entry[5] * 1000, 3))
+            return json.dumps(record) + '\n'
+        date = time.strftime('%d/%b/%Y %H:%M:%S', time.localtime(timestamp))
+        if len(entry) == 3:
+            return f'{client} - - [{date}] {entry[2]}\n'
+        return f'{client} - - [{date}] "{entry[2]}" {entry[3]} {entry[4]} {entry[5] * 1000:.3f}ms\n'
+
+def sse_frame(data, event=None, event_id=None):
+    """Encode one server-sent event; `data` may span several lines."""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    if event:
+        lines.append(f'event: {event}')
+    lines.extend(f'data: {line}' for line in data.split('\n'))
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+class _Subscriber:
+    __slots__ = ('sock', 'topic', 'last_event_id', 'pending', 'offset', 'events')
+
+    def __init__(self, sock, topic, last_event_id):
+        self.sock = sock
+        self.topic = topic
+        self.last_event_id = last_event_id
+        self.pending = deque()
+        self.offset = 0
+        self.events = selectors.EVENT_READ
+
+class EventBroadcaster:
+    """Fans server-sent events out to many sockets from a single thread.
+
+    Subscribing hands over a socket whose response head has been sent.
+    publish() may be called from any thread: the frame is encoded once and
+    queued for every subscriber of its topics, then written without blocking
+    as each socket becomes writable. A subscriber with `max_queue` frames
+    still unsent is evicted rather than buffered further, and a comment
+    heartbeat keeps idle streams (and the detection of dead peers) going.
+
+    Events carry ids of the form <epoch>-<sequence>, and the last `replay`
+    frames of every topic are kept: a new subscriber first receives those
+    after its Last-Event-ID, or all of them if the id is unknown or absent.
+    """
+
+    def __init__(self, max_queue=DEFAULT_SSE_QUEUE, heartbeat=DEFAULT_SSE_HEARTBEAT, replay=DEFAULT_SSE_REPLAY):
+        self.max_queue = max_queue
+        self.heartbeat = heartbeat
+        self.replay = replay
+        # Distinguishes the ids of this process from those of an earlier one
+        self.epoch = f'{time.time_ns():x}'
+        self.subscribers = 0
+        self.published = 0
+        self.delivered = 0
+        self.evicted = 0
+        self.replayed = 0
+        # Subscribers per topic; only the broadcaster thread writes to it
+        self.topics = {}
+        self._sequence = 0
+        self._history = {}
+        self._selector = selectors.DefaultSelector()
+        self._wakeup, self._waker = socket.socketpair()
+        self._wakeup.setblocking(False)
+        self._waker.setblocking(False)
+        self._selector.register(self._wakeup, selectors.EVENT_READ)
+        # Commands from other threads; deque appends and pops are atomic
+        self._inbox = deque()
+        self._thread = threading.Thread(target=self._run, name='sse-broadcaster', daemon=True)
+        self._thread.start()
+
+    def subscribe(self, sock, topic, last_event_id=None):
+        self._send_command('subscribe', _Subscriber(sock, topic, last_event_id))
+
+    def publish(self, topics, data, event=None):
+        """Send `data` to the subscribers of any of `topics`."""
+        self._send_command('publish', (tuple(topics), data, event))
+
+    def close(self):
+        self._send_command('close', None)
+        self._thread.join(DRAIN_TIMEOUT)
+
+    def _send_command(self, kind, payload):
+        self._inbox.append((kind, payload))
+        try:
+            self._waker.send(b'\0')
+        except OSError:
+            # The wakeup buffer is full, so the loop is already due to run
+            pass
+
+    def _run(self):
+        next_heartbeat = time.monotonic() + self.heartbeat
+        while True:
+            for key, events in self._selector.select(max(0.0, next_heartbeat - time.monotonic())):
+                if key.fileobj is self._wakeup:
+                    try:
+                        while self._wakeup.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                subscriber = key.data
+                if events & selectors.EVENT_READ and not self._read(subscriber):
+                    continue
+                if events & selectors.EVENT_WRITE:
+                    self._flush(subscriber)
+            while self._inbox:
+                kind, payload = self._inbox.popleft()
+                if kind == 'publish':
+                    self._publish(*payload)
+                elif kind == 'subscribe':
+                    self._add(payload)
+                else:
+                    for key in list(self._selector.get_map().values()):
+                        if key.data is not None:
+                            self._drop(key.data)
+                    self._selector.close()
+                    self._wakeup.close()
+                    self._waker.close()
+                    return
+            if time.monotonic() >= next_heartbeat:
+                self._fan_out(None, b': heartbeat\n\n')
+                next_heartbeat = time.monotonic() + self.heartbeat
+
+    def _publish(self, topics, data, event):
+        self.published += 1
+        self._sequence += 1
+        frame = sse_frame(data, event, f'{self.epoch}-{self._sequence}')
+        if self.replay:
+            for topic in topics:
+                history = self._history.get(topic)
+                if history is None:
+                    history = self._history[topic] = deque(maxlen=self.replay)
+                history.append((self._sequence, frame))
+        self._fan_out(topics, frame)
+
+    def _backlog(self, subscriber):
+        """Return the replayed frames owed to a new subscriber."""
+        history = self._history.get(subscriber.topic, ())
+        epoch, _, sequence = (subscriber.last_event_id or '').partition('-')
+        if epoch == self.epoch and sequence.isdigit():
+            return [frame for number, frame in history if number > int(sequence)]
+        return [frame for _, frame in history]
+
+    def _add(self, subscriber):
+        try:
+            subscriber.sock.setblocking(False)
+            self._selector.register(subscriber.sock, subscriber.events, subscriber)
+        except (OSError, ValueError):
+            subscriber.sock.close()
+            return
+        self.subscribers += 1
+        self.topics[subscriber.topic] = self.topics.get(subscriber.topic, 0) + 1
+        backlog = self._backlog(subscriber)[-self.max_queue:]
+        if backlog:
+            self.replayed += len(backlog)
+            subscriber.pending.extend(backlog)
+            self._flush(subscriber)
+
+    def _fan_out(self, topics, frame):
+        for key in list(self._selector.get_map().values()):
+            subscriber = key.data
+            if subscriber is None or topics is not None and subscriber.topic not in topics:
+                continue
+            if len(subscriber.pending) >= self.max_queue:
+                self.evicted += 1
+                self._drop(subscriber)
+                continue
+            subscriber.pending.append(frame)
+            if len(subscriber.pending) == 1:
+                self._flush(subscriber)
+
+    def _read(self, subscriber):
+        """Discard anything the client sends; return False if it went away."""
+        try:
+            if subscriber.sock.recv(4096):
+                return True
+        except BlockingIOError:
+            return True
+        except OSError:
+            pass
+        self._drop(subscriber)
+        return False
+
+    def _flush(self, subscriber):
+        pending = subscriber.pending
+        try:
+            while pending:
+                frame = pending[0]
+                subscriber.offset += subscriber.sock.send(memoryview(frame)[subscriber.offset:])
+                if subscriber.offset < len(frame):
+                    break
+                pending.popleft()
+                subscriber.offset = 0
+                self.delivered += 1
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._drop(subscriber)
+            return
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if pending else 0)
+        if events != subscriber.events:
+            subscriber.events = events
+            self._selector.modify(subscriber.sock, events, subscriber)
+
+    def _drop(self, subscriber):
+        self._selector.unregister(subscriber.sock)
+        subscriber.sock.close()
+        self.subscribers -= 1
+        remaining = self.topics[subscriber.topic] - 1
+        if remaining:
+            self.topics[subscriber.topic] = remaining
+        else:
+            del self.topics[subscriber.topic]
+
+class RecordsAPI:
+    """In-memory stand-in for the TrailBase records API used by the app.
+
+    Tables map integer record ids to JSON objects. Changes are published to
+    `broadcaster` as TrailBase change events ({"Insert"|"Update"|"Delete":
+    record}).
+    """
+
+    def __init__(self, broadcaster, tables=None):
+        self.broadcaster = broadcaster
+        if tables is None:
+            tables = {'people': [{'name': 'Alice', 'age': 30}, {'name': 'Bob', 'age': 25},
+                                 {'name': 'Charlie', 'age': 35}]}
+        self.tables = {}
+        self._next_id = {}
+        self._lock = threading.Lock()
+        for table, records in tables.items():
+            self.tables[table] = OrderedDict()
+            self._next_id[table] = 1
+            for record in records:
+                self._insert(table, dict(record))
+
+    def list(self, table, limit=None, offset=0):
+        with self._lock:
+            records = list(self.tables[table].values())
+        end = None if limit is None else offset + limit
+        return {'cursor': None, 'records': records[offset:end]}
+
+    def read(self, table, record_id):
+        with self._lock:
+            return self.tables[table][record_id]
+
+    def create(self, table, values):
+        with self._lock:
+            record = self._insert(table, values)
+        self._publish(table, 'Insert', record)
+        return {'ids': [str(record['id'])]}
+
+    def update(self, table, record_id, values):
+        with self._lock:
+            record = dict(self.tables[table][record_id])
+            record.update(values)
+            record['id'] = record_id
+            self.tables[table][record_id] = record
+        self._publish(table, 'Update', record)
+        return record
+
+    def delete(self, table, record_id):
+        with self._lock:
+            record = self.tables[table].pop(record_id)
+        self._publish(table, 'Delete', record)
+
+    def _insert(self, table, record):
+        # Caller holds the lock (or is the constructor)
+        records = self.tables[table]
+        record_id = record.pop('id', None)
+        if not isinstance(record_id, int):
+            record_id = self._next_id[table]
+        self._next_id[table] = max(self._next_id[table], record_id + 1)
+        record = records[record_id] = {'id': record_id, **record}
+        return record
+
+    def _publish(self, table, change, record):
+        topics = (records_topic(table, '*'), records_topic(table, record['id']))
+        self.broadcaster.publish(topics, json.dumps({change: record}, separators=(',', ':')))
+
+def records_topic(table, record):
+    """Return the broadcaster topic of a records API event stream: its URL path."""
+    return f'{RECORDS_API_PREFIX}{table}/subscribe/{record}'
+
+class RecordsProxy:
+    """Shares one upstream records event stream per topic among local clients.
+
+    `upstream` is the base URL of the TrailBase server (or of another
+    spa_server.py running --records-api). The first local subscriber to a
+    topic starts an UpstreamStream, which republishes every upstream event to
+    `broadcaster`; it reconnects with backoff, resuming with Last-Event-ID,
+    and closes once the topic has had no subscribers for `idle` seconds.
+    Other records requests (list, read, create, PATCH, delete) are forwarded
+    upstream one by one with `forward`.
+    """
+
+    def __init__(self, upstream, broadcaster, idle=UPSTREAM_IDLE):
+        url = urlparse(upstream)
+        if url.scheme not in ('http', 'https') or not url.hostname:
+            raise ValueError(f'unsupported upstream URL {upstream!r}')
+        self.upstream = upstream
+        self.broadcaster = broadcaster
+        self.idle = idle
+        self.streams = {}
+        self.connects = 0
+        self.reconnects = 0
+        self._connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self._address = (url.hostname, url.port)
+        self._base_path = url.path.rstrip('/')
+        self._lock = threading.Lock()
+
+    def watch(self, topic):
+        """Make sure an upstream subscription to `topic` is open."""
+        with self._lock:
+            stream = self.streams.get(topic)
+            if stream is None:
+                stream = self.streams[topic] = UpstreamStream(self, topic)
+                stream.start()
+            stream.wanted = time.monotonic()
+
+    def retire(self, stream):
+        """Return True (and forget `stream`) if nobody has wanted it for `idle` seconds."""
+        with self._lock:
+            if self.broadcaster.topics.get(stream.topic) or time.monotonic() - stream.wanted < self.idle:
+                return False
+            del self.streams[stream.topic]
+            return True
+
+    def connect(self, path, last_event_id=None):
+        """Open the upstream event stream at `path`; return (connection, response)."""
+        headers = {'Accept': 'text/event-stream', 'Cache-Control': 'no-cache'}
+        if last_event_id is not None:
+            headers['Last-Event-ID'] = last_event_id
+        connection = self._connection_class(*self._address, timeout=UPSTREAM_READ_TIMEOUT)
+        try:
+            connection.request('GET', self._base_path + path, headers=headers)
+            response = connection.getresponse()
+            if response.status != HTTPStatus.OK:
+                raise http.client.HTTPException(f'upstream answered {response.status} for {path}')
+        except BaseException:
+            connection.close()
+            raise
+        with self._lock:
+            self.connects += 1
+        return connection, response
+
+    def forward(self, method, path, body=None, content_type=None):
+        """Send one request for `path` upstream; return (status, content type, body)."""
+        headers = {'Accept': 'application/json'}
+        if content_type:
+            headers['Content-Type'] = content_type
+        connection = self._connection_class(*self._address, timeout=UPSTREAM_TIMEOUT)
+        try:
+            connection.request(method, self._base_path + path, body=body, headers=headers)
+            response = connection.getresponse()
+            return response.status, response.getheader('Content-Type', 'application/json'), response.read()
+        finally:
+            connection.close()
+
+    def count_reconnect(self):
+        with self._lock:
+            self.reconnects += 1
+
+class UpstreamStream(threading.Thread):
+    """Relays one upstream event stream into the broadcaster (see RecordsProxy)."""
+
+    def __init__(self, proxy, topic):
+        super().__init__(name=f'sse-upstream {topic}', daemon=True)
+        self.proxy = proxy
+        self.topic = topic
+        self.wanted = time.monotonic()
+        self.last_event_id = None
+
+    def run(self):
+        delay = UPSTREAM_BACKOFF[0]
+        while not self.proxy.retire(self):
+            try:
+                connection, response = self.proxy.connect(self.topic, self.last_event_id)
+            except (OSError, http.client.HTTPException):
+                pass
+            else:
+                delay = UPSTREAM_BACKOFF[0]
+                try:
+                    if self._relay(response):
+                        return
+                except (OSError, http.client.HTTPException, ValueError):
+                    pass
+                finally:
+                    connection.close()
+            self.proxy.count_reconnect()
+            # Jitter keeps the streams of many topics (or workers) from reconnecting in step
+            time.sleep(delay * random.uniform(0.5, 1.0))
+            delay = min(delay * 2, UPSTREAM_BACKOFF[1])
+
+    def _relay(self, response):
+        """Republish events until the stream ends; return True once retired."""
+        data, event = [], None
+        while True:
+            line = response.readline()
+            if not line:
+                return False
+            line = line.decode('utf-8').rstrip('\r\n')
+            if line:
+                field, _, value = line.partition(':')
+                value = value[1:] if value.startswith(' ') else value
+                if field == 'data':
+                    data.append(value)
+                elif field == 'event':
+                    event = value
+                elif field == 'id':
+                    self.last_event_id = value
+                continue
+            if data:
+                self.proxy.broadcaster.publish((self.topic,), '\n'.join(data), event)
+                data, event = [], None
+            # Comments (heartbeats) end up here too, so idle topics are noticed
+            if self.proxy.retire(self):
+                return True
 
 class SPAServer(http.server.SimpleHTTPRequestHandler):
+    # Directory to serve; None serves the current directory.
+    root = None
+    # Shared response cache; None serves every request straight from disk.
+    asset_cache = None
+    # Index of servable files; None falls back to filesystem lookups.
+    route_manifest = None
+    # Packed assets served instead of the directory; see AssetPack.
+    asset_pack = None
+    # Background access log; None disables access and error lines.
+    access_log = None
+    # Records API stand-in served under RECORDS_API_PREFIX; None disables it.
+    records_api = None
+    # Proxy for the event streams under RECORDS_API_PREFIX; None disables it.
+    records_proxy = None
+    # Connection, rate and priority limits; None admits everything.
+    admission = None
+    # Request metrics, served at metrics_path; None disables both.
+    metrics = None
+    metrics_path = DEFAULT_METRICS_PATH
+    # Link header value sent with the HTML shell (see preload_links)
+    preload_links = None
+    # Also send preload_links ahead of the shell as 103 Early Hints
+    early_hints = False
+    # max-age for HTML responses; 0 makes browsers revalidate every time
+    html_max_age = DEFAULT_HTML_MAX_AGE
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; with Nagle enabled the body
+    # waits for the client's delayed ACK on every keep-alive request.
+    disable_nagle_algorithm = True
+    # Idle timeout for persistent connections, in seconds
+    timeout = DEFAULT_KEEPALIVE_TIMEOUT
+    max_requests = DEFAULT_MAX_REQUESTS
+
     def __init__(self, *args, **kwargs):
-        super().__init__(*args, directory=os.getcwd(), **kwargs)
-    
+        super().__init__(*args, directory=self.root or os.getcwd(), **kwargs)
+
+    @classmethod
+    def may_block(cls, request_line):
+        """Whether handling `request_line` may wait on another server.
+
+        The asyncio engine runs such requests (those forwarded upstream by
+        records_proxy) off its event loop.
+        """
+        if cls.records_proxy is None:
+            return False
+        target = request_line.split(b' ', 2)[1:2]
+        return bool(target) and target[0].startswith(RECORDS_API_PREFIX.encode('ascii'))
+
+    def setup(self):
+        super().setup()
+        # The asyncio engine builds one handler per request and carries the
+        # per-connection count on its buffered connection.
+        self.requests_handled = getattr(self.connection, 'requests_handled', 0)
+        # ...and counts the connection itself.
+        self._count_connection = self.metrics is not None and not isinstance(self.connection, _BufferedConnection)
+        if self._count_connection:
+            self.metrics.connection_opened()
+
+    def finish(self):
+        try:
+            super().finish()
+        finally:
+            if self._count_connection:
+                self.metrics.connection_closed()
+
+    def handle_one_request(self):
+        self._body_read = False
+        self._last_request = self.requests_handled + 1 >= self.max_requests
+        self._status = None
+        self._route_kind = 'static'
+        self._bytes_sent = 0
+        self._expensive = False
+        self._started = time.perf_counter()
+        try:
+            super().handle_one_request()
+        finally:
+            if self._expensive:
+                self.admission.release_expensive()
+        self.requests_handled += 1
+        if self._last_request or self._has_unread_body():
+            self.close_connection = True
+        if self._status is None:
+            return
+        elapsed = time.perf_counter() - self._started
+        if self.metrics is not None:
+            if self._status >= 400:
+                self._route_kind = 'error'
+            elif self._status == HTTPStatus.NOT_MODIFIED:
+                self._route_kind = 'not_modified'
+            self.metrics.record(self._route_kind, self._status, elapsed, self._bytes_sent)
+        if self.access_log is not None:
+            self.access_log.log(self.address_string(), self.requestline, self._status, self._bytes_sent, elapsed)
+
+    def log_request(self, code='-', size='-'):
+        # The access line is logged by handle_one_request() once the response is sent
+        pass
+
+    def log_message(self, format, *args):
+        if self.access_log is not None:
+            self.access_log.message(self.address_string(), format % args)
+
+    def parse_request(self):
+        # Don't count time spent idle waiting for the request line
+        self._started = time.perf_counter()
+        if not super().parse_request():
+            return False
+        return self.admission is None or self.admit()
+
+    def admit(self):
+        """Apply the rate limit and priority; send the refusal and return False if shed."""
+        url_path = urlparse(self.path).path
+        if self.metrics is not None and url_path == self.metrics_path:
+            return True
+        wait = self.admission.throttle(self.client_address[0])
+        if wait:
+            self._refuse(HTTPStatus.TOO_MANY_REQUESTS, max(1, int(wait + 0.999)))
+            return False
+        if self.command in ('GET', 'HEAD') and self._is_expensive(url_path):
+            if not self.admission.acquire_expensive():
+                self._refuse(HTTPStatus.SERVICE_UNAVAILABLE, SHED_RETRY_AFTER)
+                return False
+            self._expensive = True
+        return True
+
+    def _is_expensive(self, url_path):
+        """Return True if the response will be streamed from disk rather than the asset cache."""
+        if self._is_records_request() or self.asset_pack is not None:
+            return False
+        limit = self.asset_cache.max_entry_bytes if self.asset_cache is not None else -1
+        if self.route_manifest is not None:
+            route, _ = self.route_manifest.resolve(url_path)
+            return route is not None and route.size > limit
+        try:
+            return os.stat(self.translate_path(self.path)).st_size > limit
+        except OSError:
+            return False
+
+    def _refuse(self, status, retry_after):
+        self.close_connection = status == HTTPStatus.SERVICE_UNAVAILABLE
+        self.send_response(status)
+        self.send_header('Retry-After', str(retry_after))
+        self.send_header('Content-Length', '0')
+        self.send_header('Cache-Control', 'no-store')
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+
+    def send_response_only(self, code, message=None):
+        self._status = code
+        super().send_response_only(code, message)
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'content-length' and self.command != 'HEAD':
+            self._bytes_sent = int(value)
+        super().send_header(keyword, value)
+
+    def end_headers(self):
+        if self._last_request and not self.close_connection:
+            self.send_header('Connection', 'close')
+        super().end_headers()
+
+    def read_request_body(self):
+        """Read the request body, decoding Transfer-Encoding: chunked."""
+        self._body_read = True
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline(65537).split(b';', 1)[0], 16)
+                if size == 0:
+                    # Skip any trailer fields
+                    while self.rfile.readline(65537) not in (b'\r\n', b'\n', b''):
+                        pass
+                    return b''.join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline(65537)
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length > 0 else b''
+
+    def _has_unread_body(self):
+        # A body we never read would be parsed as the next pipelined request.
+        headers = getattr(self, 'headers', None)
+        if headers is None or self._body_read:
+            return False
+        if 'Transfer-Encoding' in headers:
+            return True
+        try:
+            return int(headers.get('Content-Length') or 0) > 0
+        except ValueError:
+            return True
+
     def do_GET(self):
+        if self.metrics is not None and urlparse(self.path).path == self.metrics_path:
+            return self.send_metrics()
+        if self._is_records_request():
+            return self.handle_records()
+        if self.route_manifest is not None or self.asset_pack is not None:
+            # send_head() resolves the route, including the SPA fallback
+            return super().do_GET()
+
         # Parse the URL to get the path
         parsed_url = urlparse(self.path)
         path = parsed_url.path
-        
+
         # If the path corresponds to a file that exists, serve it
-        if path != '/' and os.path.exists(os.path.join(os.getcwd(), path.lstrip('/'))):
+        if path != '/' and os.path.exists(os.path.join(self.directory, path.lstrip('/'))):
             return super().do_GET()
-        
+
         # For all other routes, serve index.html (SPA routing)
+        self._route_kind = 'fallback'
         self.path = '/'
         return super().do_GET()
 
-def main():
-    port = 4000
-    if len(sys.argv) > 1:
-        port = int(sys.argv[1])
-    
-    with socketserver.TCPServer(("", port), SPAServer) as httpd:
-        print(f"Serving at http://localhost:{port}")
-        print("Press Ctrl+C to stop the server")
+    def do_POST(self):
+        if self._is_records_request():
+            return self.handle_records()
+        self.send_error(HTTPStatus.NOT_IMPLEMENTED, f"Unsupported method ({self.command!r})")
+
+    do_PATCH = do_DELETE = do_POST
+
+    def do_OPTIONS(self):
+        if not self._is_records_request():
+            return self.send_error(HTTPStatus.NOT_IMPLEMENTED, f"Unsupported method ({self.command!r})")
+        # CORS preflight, so the app can also be pointed here from another origin
+        self._route_kind = 'records'
+        self.send_response(HTTPStatus.NO_CONTENT)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, PATCH, DELETE')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Max-Age', '86400')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _is_records_request(self):
+        return ((self.records_api is not None or self.records_proxy is not None)
+                and urlparse(self.path).path.startswith(RECORDS_API_PREFIX))
+
+    def handle_records(self):
+        self._route_kind = 'records'
+        api = self.records_api
+        url = urlparse(self.path)
+        parts = url.path[len(RECORDS_API_PREFIX):].strip('/').split('/')
+        table = parts[0]
+        if self.records_proxy is not None:
+            if len(parts) == 3 and parts[1] == 'subscribe' and self.command == 'GET':
+                self.records_proxy.watch(url.path)
+                return self._subscribe(self.records_proxy.broadcaster, url.path)
+            return self._forward_records()
+        if table not in api.tables:
+            return self._send_json(HTTPStatus.NOT_FOUND, {'error': f'unknown table {table!r}'})
+        try:
+            if len(parts) == 3 and parts[1] == 'subscribe' and self.command == 'GET':
+                record = parts[2] if parts[2] == '*' else int(parts[2])
+                return self._subscribe(api.broadcaster, records_topic(table, record))
+            if len(parts) == 1 and self.command == 'GET':
+                query = dict(pair.partition('=')[::2] for pair in url.query.split('&') if pair)
+                limit = int(query['limit']) if 'limit' in query else None
+                return self._send_json(HTTPStatus.OK, api.list(table, limit, int(query.get('offset', 0))))
+            if len(parts) == 1 and self.command == 'POST':
+                return self._send_json(HTTPStatus.OK, api.create(table, self._json_body()))
+            if len(parts) == 2:
+                record_id = int(parts[1])
+                if self.command == 'GET':
+                    return self._send_json(HTTPStatus.OK, api.read(table, record_id))
+                if self.command == 'PATCH':
+                    return self._send_json(HTTPStatus.OK, api.update(table, record_id, self._json_body()))
+                if self.command == 'DELETE':
+                    api.delete(table, record_id)
+                    return self._send_json(HTTPStatus.OK, {})
+        except KeyError:
+            return self._send_json(HTTPStatus.NOT_FOUND, {'error': 'record not found'})
+        except ValueError:
+            return self._send_json(HTTPStatus.BAD_REQUEST, {'error': 'malformed id, query or JSON body'})
+        return self._send_json(HTTPStatus.METHOD_NOT_ALLOWED, {'error': f'{self.command} not supported here'})
+
+    def _forward_records(self):
+        try:
+            body = self.read_request_body() if self.command in ('POST', 'PATCH') else None
+            status, content_type, body = self.records_proxy.forward(self.command, self.path, body,
+                                                                    self.headers.get('Content-Type'))
+        except ValueError:
+            return self._send_json(HTTPStatus.BAD_REQUEST, {'error': 'malformed request body'})
+        except (OSError, http.client.HTTPException) as e:
+            return self._send_json(HTTPStatus.BAD_GATEWAY, {'error': f'upstream request failed: {e}'})
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _json_body(self):
+        values = json.loads(self.read_request_body() or b'{}')
+        if not isinstance(values, dict):
+            raise ValueError('expected a JSON object')
+        return values
+
+    def _send_json(self, status, value):
+        body = json.dumps(value).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _subscribe(self, broadcaster, topic):
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        # The stream runs until either side closes it
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(b': subscribed\n\n')
+        last_event_id = self.headers.get('Last-Event-ID')
+        self.hand_off(lambda sock: broadcaster.subscribe(sock, topic, last_event_id))
+
+    def hand_off(self, consumer):
+        """Pass the client socket to `consumer` once the response so far is sent.
+
+        The handler (and the engine) then forgets the connection without
+        closing it.
+        """
+        self.close_connection = True
+        if isinstance(self.connection, _BufferedConnection):
+            # The asyncio engine writes the buffered response first
+            self.connection.hand_off = consumer
+        else:
+            consumer(socket.socket(fileno=self.connection.detach()))
+
+    def send_metrics(self):
+        self._route_kind = 'metrics'
+        body = self.metrics.render().encode('utf-8')
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_head(self):
+        route = None
+        url_path = urlparse(self.path).path
+        if self.asset_pack is not None:
+            return self._send_packed(url_path)
+        if self.route_manifest is not None:
+            route, fallback = self.route_manifest.resolve(url_path)
+            if fallback:
+                self._route_kind = 'fallback'
+            # A stale hashed URL must not be answered with the HTML shell
+            if route is None or (fallback and is_fingerprinted(url_path)):
+                self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+                return None
+            path, content_type = route.path, route.content_type
+            immutable = route.immutable
+            is_index = path == self.route_manifest.index_path
+        else:
+            path = self.translate_path(self.path)
+            if url_path.endswith('/'):
+                path = os.path.join(path, 'index.html')
+            content_type = self.guess_type(path)
+            immutable = is_fingerprinted(url_path)
+            is_index = path == os.path.join(self.directory, 'index.html')
+
+        headers = {'Cache-Control': self._cache_control(content_type, immutable)}
+        if self.preload_links is not None and is_index:
+            headers['Link'] = self.preload_links
+            if self.early_hints and self.request_version != 'HTTP/1.0':
+                self.send_early_hints()
+        asset = None
+        if self.asset_cache is not None:
+            asset = self.asset_cache.get(path, content_type, route.mtime_ns if route is not None else None)
+        if asset is None:
+            return self._send_file(path, content_type, headers)
+
+        if is_compressible(asset.content_type):
+            encoding, asset = self._select_encoding(path, asset, route)
+            headers['Vary'] = 'Accept-Encoding'
+            if encoding is not None:
+                headers['Content-Encoding'] = encoding
+        return self._send_asset(asset, headers)
+
+    def _send_packed(self, url_path):
+        asset, fallback = self.asset_pack.resolve(url_path)
+        if fallback:
+            self._route_kind = 'fallback'
+        if asset is None or (fallback and is_fingerprinted(url_path)):
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+        headers = {'Cache-Control': self._cache_control(asset.content_type, asset.immutable)}
+        if self.preload_links is not None and asset.name == 'index.html':
+            headers['Link'] = self.preload_links
+            if self.early_hints and self.request_version != 'HTTP/1.0':
+                self.send_early_hints()
+        if is_compressible(asset.content_type):
+            headers['Vary'] = 'Accept-Encoding'
+            for encoding in parse_accept_encoding(self.headers.get('Accept-Encoding', '')):
+                if encoding in asset.variants:
+                    headers['Content-Encoding'] = encoding
+                    asset = asset.variants[encoding]
+                    break
+        return self._send_asset(asset, headers)
+
+    def send_early_hints(self):
+        # Written straight to the socket: it is not the final response, so
+        # it must not touch the status or keep-alive bookkeeping.
+        self.wfile.write(f'{self.protocol_version} 103 Early Hints\r\nLink: {self.preload_links}\r\n\r\n'
+                         .encode('latin-1'))
+
+    def _cache_control(self, content_type, immutable):
+        if immutable:
+            return IMMUTABLE_CACHE_CONTROL
+        if content_type == 'text/html' and self.html_max_age > 0:
+            return f'public, max-age={self.html_max_age}'
+        return 'no-cache'
+
+    def _send_file(self, path, content_type, headers):
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return self._send_missing()
+        try:
+            st = os.fstat(f.fileno())
+            if not stat.S_ISREG(st.st_mode):
+                f.close()
+                return self._send_missing()
+            source = self._send_asset(FileAsset(f, st, content_type), headers)
+        except:
+            f.close()
+            raise
+        if source is None:
+            f.close()
+        return source
+
+    def _send_missing(self):
+        if self.route_manifest is not None:
+            # Indexed but gone since the last scan
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+        return super().send_head()
+
+    def _send_asset(self, asset, headers):
+        """Send the status line and headers for `asset`, honouring conditional
+        and Range requests. Returns the body source, or None if there is none."""
+        if self._not_modified(asset):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            headers.pop('Content-Encoding', None)
+            self._send_headers(asset, headers)
+            self.end_headers()
+            return None
+
+        byte_range = self._requested_range(asset)
+        if byte_range is RANGE_NOT_SATISFIABLE:
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header('Content-Range', f'bytes */{asset.size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+        if byte_range is None:
+            start, length = 0, asset.size
+            self.send_response(HTTPStatus.OK)
+        else:
+            start, length = byte_range
+            self.send_response(HTTPStatus.PARTIAL_CONTENT)
+            self.send_header('Content-Range', f'bytes {start}-{start + length - 1}/{asset.size}')
+        self.send_header('Content-type', asset.content_type)
+        self.send_header('Content-Length', str(length))
+        self.send_header('Accept-Ranges', 'bytes')
+        self._send_headers(asset, headers)
+        self.end_headers()
+        return asset.open_range(start, length)
+
+    def _send_headers(self, asset, headers):
+        self.send_header('Last-Modified', asset.last_modified)
+        self.send_header('ETag', asset.etag)
+        for keyword, value in headers.items():
+            self.send_header(keyword, value)
+
+    def _requested_range(self, asset):
+        header = self.headers.get('Range')
+        if header is None or asset.size == 0:
+            return None
+        if_range = self.headers.get('If-Range')
+        if if_range is not None:
+            if_range = if_range.strip()
+            if if_range.startswith(('"', 'W/')):
+                # If-Range requires a strong comparison
+                if if_range != asset.etag:
+                    return None
+            else:
+                try:
+                    since = email.utils.parsedate_to_datetime(if_range)
+                except (TypeError, IndexError, OverflowError, ValueError):
+                    return None
+                if since.timestamp() != asset.mtime:
+                    return None
+        return parse_range(header, asset.size)
+
+    def copyfile(self, source, outputfile):
+        if isinstance(source, FileRange):
+            if source.count:
+                self.connection.sendfile(source.file, source.offset, source.count)
+        elif isinstance(source, PackRange):
+            outputfile.write(source.view)
+        elif isinstance(source, io.BytesIO):
+            with source.getbuffer() as body:
+                outputfile.write(body)
+        else:
+            super().copyfile(source, outputfile)
+
+    def _select_encoding(self, path, asset, route=None):
+        """Pick the best representation of `asset` for this request's Accept-Encoding."""
+        accepted = parse_accept_encoding(self.headers.get('Accept-Encoding', ''))
+        for encoding in accepted:
+            if route is not None:
+                variant_route = route.variants.get(encoding)
+                if variant_route is None:
+                    continue
+                variant = self.asset_cache.get(variant_route.path, asset.content_type, variant_route.mtime_ns)
+                if variant is not None:
+                    return encoding, variant
+                continue
+            if asset.variants.get(encoding) is False:
+                continue
+            variant = self.asset_cache.get(path + ENCODING_SUFFIXES[encoding], asset.content_type)
+            fresh = variant is not None and variant.mtime_ns >= asset.mtime_ns
+            asset.variants[encoding] = fresh
+            if fresh:
+                return encoding, variant
+        if 'gzip' in accepted and MIN_COMPRESS_BYTES <= len(asset.body) <= MAX_DYNAMIC_COMPRESS_BYTES:
+            return 'gzip', self.asset_cache.gzipped(path, asset)
+        return None, asset
+
+    def _not_modified(self, asset):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return etag_matches(asset.etag, if_none_match)
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is None:
+            return False
         try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, IndexError, OverflowError, ValueError):
+            return False
+        return asset.mtime <= since.timestamp()
+
+class SerialServer(socketserver.TCPServer):
+    allow_reuse_address = True
+    request_queue_size = LISTEN_BACKLOG
+
+class ThreadPoolServer(socketserver.TCPServer):
+    """TCPServer that hands each connection to a bounded pool of threads."""
+
+    allow_reuse_address = True
+    request_queue_size = LISTEN_BACKLOG
+
+    def __init__(self, server_address, RequestHandlerClass, bind_and_activate=True, max_workers=DEFAULT_THREADS):
+        super().__init__(server_address, RequestHandlerClass, bind_and_activate)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='spa-worker')
+
+    def process_request(self, request, client_address):
+        admission = self.RequestHandlerClass.admission
+        if admission is not None and not admission.open_connection():
+            return shed_connection(request)
+        self._pool.submit(self._process_request_worker, request, client_address)
+
+    def _process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            if self.RequestHandlerClass.admission is not None:
+                self.RequestHandlerClass.admission.close_connection()
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=True)
+
+class _BufferedConnection:
+    """Socket stand-in that lets a stream handler run against memory buffers."""
+
+    def __init__(self, data, requests_handled=0):
+        self._data = data
+        self.requests_handled = requests_handled
+        self.chunks = []
+        # Set by SPAServer.hand_off() to take over the socket after the response
+        self.hand_off = None
+
+    def makefile(self, mode, bufsize=-1):
+        if 'r' in mode:
+            return io.BytesIO(self._data)
+        return io.BytesIO()
+
+    def sendall(self, data):
+        # Views of a read-only mapping (an AssetPack) cannot change under us
+        self.chunks.append(data if isinstance(data, memoryview) and data.readonly else bytes(data))
+
+    def sendfile(self, file, offset=0, count=None):
+        # The handler closes `file` when it returns, so keep a duplicate
+        # descriptor for the event loop to send from.
+        self.chunks.append(FileRange(os.fdopen(os.dup(file.fileno()), 'rb'), offset, count))
+
+    def settimeout(self, timeout):
+        pass
+
+    def setsockopt(self, *args):
+        pass
+
+_CONTENT_LENGTH_RE = re.compile(rb'^content-length:[ \t]*(\d+)[ \t]*\r?$', re.IGNORECASE | re.MULTILINE)
+_CHUNKED_RE = re.compile(rb'^transfer-encoding:.*chunked', re.IGNORECASE | re.MULTILINE)
+
+async def _read_body(reader, head):
+    """Read the raw request body that follows `head`, keeping chunked framing."""
+    if _CHUNKED_RE.search(head):
+        parts = []
+        while True:
+            line = await reader.readuntil(b'\n')
+            parts.append(line)
+            size = int(line.split(b';', 1)[0], 16)
+            if size == 0:
+                while line not in (b'\r\n', b'\n'):
+                    line = await reader.readuntil(b'\n')
+                    parts.append(line)
+                return b''.join(parts)
+            parts.append(await reader.readexactly(size + 2))
+    match = _CONTENT_LENGTH_RE.search(head)
+    return await reader.readexactly(int(match.group(1))) if match else b''
+
+class AsyncioServer:
+    """Serves connections on an asyncio event loop.
+
+    Each request head (and body, if any) is read asynchronously, run through
+    the handler against in-memory buffers, and the response is written back
+    with drain() so a slow reader only parks its own coroutine. Requests the
+    handler says may block (see SPAServer.may_block) run in the loop's
+    default executor instead.
+    """
+
+    def __init__(self, server_address, RequestHandlerClass, reuse_port=False, backlog=LISTEN_BACKLOG):
+        self.server_address = server_address
+        self.backlog = backlog
+        self.RequestHandlerClass = RequestHandlerClass
+        # Handle exactly one request per handler instance; the connection loop
+        # below decides whether to keep reading from the socket.
+        self._handler_class = type(
+            'OneShot' + RequestHandlerClass.__name__,
+            (RequestHandlerClass,),
+            {'handle': RequestHandlerClass.handle_one_request},
+        )
+        self.socket = socket.create_server(server_address, backlog=backlog,
+                                           reuse_port=reuse_port)
+        self._loop = None
+        self._stopping = None
+        self._connections = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.server_close()
+
+    def serve_forever(self):
+        asyncio.run(self._serve())
+
+    def shutdown(self):
+        """Stop accepting and let open connections finish; safe from any thread."""
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._stopping.set)
+            except RuntimeError:
+                # The loop has already finished and closed
+                pass
+
+    def server_close(self):
+        self.socket.close()
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        server = await asyncio.start_server(self._handle_connection, sock=self.socket, backlog=self.backlog)
+        async with server:
+            await self._stopping.wait()
+            server.close()
+            if self._connections:
+                await asyncio.wait(self._connections, timeout=DRAIN_TIMEOUT)
+
+    async def _write_chunks(self, writer, chunks):
+        loop = asyncio.get_running_loop()
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, FileRange):
+                    await writer.drain()
+                    await loop.sendfile(writer.transport, chunk.file, chunk.offset, chunk.count)
+                else:
+                    writer.write(chunk)
+            await writer.drain()
+        finally:
+            for chunk in chunks:
+                if isinstance(chunk, FileRange):
+                    chunk.close()
+
+    async def _handle_connection(self, reader, writer):
+        client_address = writer.get_extra_info('peername')
+        # asyncio only disables Nagle for sockets created with proto=IPPROTO_TCP,
+        # which socket.create_server() does not do.
+        writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        timeout = self.RequestHandlerClass.timeout
+        requests_handled = 0
+        admission = self.RequestHandlerClass.admission
+        if admission is not None and not admission.open_connection():
+            return await self._shed(reader, writer)
+        task = asyncio.current_task()
+        self._connections.add(task)
+        metrics = getattr(self.RequestHandlerClass, 'metrics', None)
+        if metrics is not None:
+            metrics.connection_opened()
+        try:
+            while not self._stopping.is_set():
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout)
+                    body = await asyncio.wait_for(_read_body(reader, head), timeout)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                        asyncio.TimeoutError, ValueError):
+                    break
+                connection = _BufferedConnection(head + body, requests_handled)
+                if self.RequestHandlerClass.may_block(head[:head.find(b'\r\n')]):
+                    # A thread may wait on it without holding up other connections
+                    handler = await asyncio.get_running_loop().run_in_executor(
+                        None, self._handler_class, connection, client_address, self)
+                else:
+                    handler = self._handler_class(connection, client_address, self)
+                await self._write_chunks(writer, connection.chunks)
+                requests_handled += 1
+                if connection.hand_off is not None:
+                    # Closing the transport below only closes its own descriptor
+                    sock = writer.get_extra_info('socket')
+                    connection.hand_off(socket.socket(fileno=os.dup(sock.fileno())))
+                    break
+                if handler.close_connection:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self._connections.discard(task)
+            if metrics is not None:
+                metrics.connection_closed()
+            if admission is not None:
+                admission.close_connection()
+            writer.close()
+
+    async def _shed(self, reader, writer):
+        # Take the request off the wire (briefly), so closing does not reset
+        # the connection before the client has read the 503.
+        try:
+            await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), SHED_RETRY_AFTER)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+            pass
+        try:
+            writer.write(SHED_RESPONSE)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+class Supervisor:
+    """Prefork supervisor that keeps `workers` child processes running `target`.
+
+    Workers that exit are restarted (after RESPAWN_BACKOFF if they died
+    young). SIGTERM or SIGINT is forwarded to the workers as SIGTERM, and the
+    supervisor returns once they have all drained and exited.
+    """
+
+    def __init__(self, workers, target):
+        self.workers = workers
+        self.target = target
+        self.children = {}
+        self.stopping = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for _ in range(self.workers):
+            self._spawn()
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            started = self.children.pop(pid, None)
+            if started is None or self.stopping:
+                continue
+            print(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, restarting",
+                  file=sys.stderr)
+            if time.monotonic() - started < RESPAWN_BACKOFF:
+                time.sleep(RESPAWN_BACKOFF)
+            if not self.stopping:
+                self._spawn()
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            # The supervisor forwards Ctrl+C as SIGTERM so workers drain
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            code = 0
+            try:
+                self.target()
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        self.children[pid] = time.monotonic()
+
+    def _stop(self, signum, frame):
+        if self.stopping:
+            return
+        self.stopping = True
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+def make_server(port, engine='threads', threads=DEFAULT_THREADS, reuse_port=False, backlog=LISTEN_BACKLOG):
+    address = ('', port)
+    if engine == 'serial':
+        httpd = SerialServer(address, SPAServer, bind_and_activate=False)
+    elif engine == 'threads':
+        httpd = ThreadPoolServer(address, SPAServer, bind_and_activate=False, max_workers=threads)
+    elif engine == 'asyncio':
+        return AsyncioServer(address, SPAServer, reuse_port=reuse_port, backlog=backlog)
+    else:
+        raise ValueError(f"Unknown engine: {engine}")
+    httpd.allow_reuse_port = reuse_port
+    httpd.request_queue_size = backlog
+    try:
+        httpd.server_bind()
+        httpd.server_activate()
+    except:
+        httpd.server_close()
+        raise
+    return httpd
+
+def configure(args):
+    """Set up the shared handler state; called in each serving process."""
+    SPAServer.timeout = args.keepalive_timeout or None
+    SPAServer.max_requests = args.max_requests
+    SPAServer.root = os.path.abspath(args.directory)
+    SPAServer.html_max_age = args.html_max_age
+    if args.pack:
+        # Everything, including the preload links, comes from the pack
+        SPAServer.asset_pack = AssetPack(args.pack)
+        if args.preload:
+            SPAServer.preload_links = SPAServer.asset_pack.links
+            SPAServer.early_hints = args.early_hints
+    else:
+        if args.preload:
+            SPAServer.preload_links = preload_links(SPAServer.root)
+            SPAServer.early_hints = args.early_hints
+        SPAServer.route_manifest = RouteManifest(SPAServer.root)
+        if args.watch_interval > 0:
+            SPAServer.route_manifest.watch(args.watch_interval)
+        if args.cache_mb > 0:
+            SPAServer.asset_cache = AssetCache(args.cache_mb * 1024 * 1024,
+                                               max_entry_bytes=args.sendfile_kb * 1024)
+    if args.access_log:
+        stream = sys.stderr if args.access_log == '-' else open(args.access_log, 'a', encoding='utf-8')
+        SPAServer.access_log = AccessLog(stream, args.access_log_format, args.access_log_sample,
+                                         args.access_log_buffer)
+    if args.records_api or args.records_upstream:
+        broadcaster = EventBroadcaster(args.sse_queue, args.sse_heartbeat, args.sse_replay)
+        if args.records_upstream:
+            SPAServer.records_proxy = RecordsProxy(args.records_upstream, broadcaster)
+        else:
+            SPAServer.records_api = RecordsAPI(broadcaster)
+    else:
+        broadcaster = None
+    if args.max_connections or args.rate_limit or args.max_expensive:
+        SPAServer.admission = AdmissionControl(args.max_connections, args.rate_limit, args.rate_burst,
+                                               args.max_expensive)
+    if args.metrics_path:
+        SPAServer.metrics = Metrics(SPAServer.asset_cache, SPAServer.access_log, broadcaster,
+                                    SPAServer.records_proxy, SPAServer.admission)
+        SPAServer.metrics_path = args.metrics_path
+
+def serve(args, reuse_port=False, banner=None):
+    configure(args)
+    try:
+        with make_server(args.port, args.engine, args.threads, reuse_port, args.backlog) as httpd:
+            if banner:
+                print(banner)
+                print("Press Ctrl+C to stop the server")
+            def drain(signum, frame):
+                # shutdown() blocks until serve_forever() returns, so not on this thread
+                threading.Thread(target=httpd.shutdown, daemon=True).start()
+            signal.signal(signal.SIGTERM, drain)
             httpd.serve_forever()
-        except KeyboardInterrupt:
-            print("\nServer stopped")
+    finally:
+        for records in (SPAServer.records_api, SPAServer.records_proxy):
+            if records is not None:
+                records.broadcaster.close()
+        if SPAServer.access_log is not None:
+            SPAServer.access_log.close()
+
+def sample_rate(value):
+    rate = float(value)
+    if not 0.0 <= rate <= 1.0:
+        raise argparse.ArgumentTypeError('must be between 0 and 1')
+    return rate
+
+def upstream_url(value):
+    url = urlparse(value)
+    if url.scheme not in ('http', 'https') or not url.hostname:
+        raise argparse.ArgumentTypeError('must be an http:// or https:// URL')
+    return value
+
+def check_port(port):
+    """Fail fast if `port` cannot be shared with SO_REUSEPORT."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        probe.bind(('', port))
+
+def worker_count(value):
+    if value == 'auto':
+        return os.cpu_count() or 1
+    count = int(value)
+    if count < 1:
+        raise argparse.ArgumentTypeError('must be at least 1')
+    return count
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the SPA with index.html fallback routing.')
+    parser.add_argument('port', nargs='?', type=int, default=DEFAULT_PORT,
+                        help=f'port to listen on (default: {DEFAULT_PORT})')
+    parser.add_argument('--engine', choices=ENGINES, default='threads',
+                        help='connection handling engine (default: threads)')
+    parser.add_argument('--directory', '-d', default=os.getcwd(),
+                        help='directory to serve (default: current directory)')
+    parser.add_argument('--pack', metavar='FILE',
+                        help='serve the assets from a pack written by `build_assets.py pack` instead of '
+                             '--directory (no watching or cache needed)')
+    parser.add_argument('--html-max-age', type=int, default=DEFAULT_HTML_MAX_AGE,
+                        help='seconds browsers may cache HTML without revalidating; fingerprinted assets '
+                             f'are always immutable (default: {DEFAULT_HTML_MAX_AGE})')
+    parser.add_argument('--no-preload', dest='preload', action='store_false',
+                        help='do not send Link preload headers for the boot chain with index.html')
+    parser.add_argument('--early-hints', action='store_true',
+                        help='also send the preload links as a 103 Early Hints response')
+    parser.add_argument('--workers', type=worker_count, default=1,
+                        help="worker processes sharing the port, or 'auto' for one per CPU (default: 1)")
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS,
+                        help=f'worker threads for the threads engine (default: {DEFAULT_THREADS})')
+    parser.add_argument('--cache-mb', type=int, default=DEFAULT_CACHE_MB,
+                        help=f'memory budget for the asset cache, 0 disables it (default: {DEFAULT_CACHE_MB})')
+    parser.add_argument('--keepalive-timeout', type=float, default=DEFAULT_KEEPALIVE_TIMEOUT,
+                        help=f'idle seconds before a persistent connection is closed (default: {DEFAULT_KEEPALIVE_TIMEOUT})')
+    parser.add_argument('--max-requests', type=int, default=DEFAULT_MAX_REQUESTS,
+                        help=f'requests served per connection before closing it (default: {DEFAULT_MAX_REQUESTS})')
+    parser.add_argument('--backlog', type=int, default=LISTEN_BACKLOG,
+                        help=f'connections the kernel queues before refusing more (default: {LISTEN_BACKLOG})')
+    parser.add_argument('--max-connections', type=int, default=DEFAULT_MAX_CONNECTIONS,
+                        help='open connections per process (threads engine: queued or active) before new ones '
+                             'get an immediate 503, 0 for no limit (default: 0)')
+    parser.add_argument('--max-expensive', type=int, default=DEFAULT_MAX_EXPENSIVE,
+                        help='concurrent downloads per process of files too large for the asset cache before '
+                             'more get 503, 0 for no limit (default: 0)')
+    parser.add_argument('--rate-limit', type=float, default=DEFAULT_RATE_LIMIT,
+                        help='requests per second allowed per client address before 429, 0 for no limit '
+                             '(default: 0)')
+    parser.add_argument('--rate-burst', type=int, default=DEFAULT_RATE_BURST,
+                        help='requests a client may send in a burst before --rate-limit applies '
+                             f'(default: {DEFAULT_RATE_BURST})')
+    parser.add_argument('--watch-interval', type=float, default=DEFAULT_WATCH_INTERVAL,
+                        help='seconds between rescans of the served tree, 0 disables watching '
+                             f'(default: {DEFAULT_WATCH_INTERVAL})')
+    parser.add_argument('--sendfile-kb', type=int, default=DEFAULT_SENDFILE_KB,
+                        help='files larger than this bypass the cache and are sent with sendfile() '
+                             f'(default: {DEFAULT_SENDFILE_KB})')
+    parser.add_argument('--metrics-path', default=DEFAULT_METRICS_PATH,
+                        help=f"path serving Prometheus metrics, '' disables them (default: {DEFAULT_METRICS_PATH})")
+    parser.add_argument('--access-log', default='-',
+                        help="access log file, '-' for stderr, '' disables access logging (default: -)")
+    parser.add_argument('--access-log-format', choices=ACCESS_LOG_FORMATS, default='text',
+                        help='access log line format (default: text)')
+    parser.add_argument('--access-log-sample', type=sample_rate, default=1.0,
+                        help='fraction of successful requests to log; errors are always logged (default: 1.0)')
+    parser.add_argument('--access-log-buffer', type=int, default=DEFAULT_ACCESS_LOG_BUFFER,
+                        help='log entries buffered before new ones are dropped '
+                             f'(default: {DEFAULT_ACCESS_LOG_BUFFER})')
+    records = parser.add_mutually_exclusive_group()
+    records.add_argument('--records-api', action='store_true',
+                         help=f'serve an in-memory stand-in for the TrailBase records API under {RECORDS_API_PREFIX}')
+    records.add_argument('--records-upstream', metavar='URL', type=upstream_url,
+                         help=f'proxy the records event streams under {RECORDS_API_PREFIX} to the TrailBase '
+                              'server at URL, sharing one upstream subscription per topic')
+    parser.add_argument('--sse-queue', type=int, default=DEFAULT_SSE_QUEUE,
+                        help='events queued per event-stream client before it is evicted '
+                             f'(default: {DEFAULT_SSE_QUEUE})')
+    parser.add_argument('--sse-heartbeat', type=float, default=DEFAULT_SSE_HEARTBEAT,
+                        help=f'seconds between heartbeats on idle event streams (default: {DEFAULT_SSE_HEARTBEAT})')
+    parser.add_argument('--sse-replay', type=int, default=DEFAULT_SSE_REPLAY,
+                        help='recent events kept per stream for late joiners and Last-Event-ID resume '
+                             f'(default: {DEFAULT_SSE_REPLAY})')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    port = args.port
+    if args.pack:
+        try:
+            AssetPack(args.pack)
+        except (OSError, ValueError) as error:
+            sys.exit(f"Cannot serve --pack {args.pack}: {error}")
+
+    if args.workers > 1:
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            sys.exit("--workers needs SO_REUSEPORT, which this platform does not support")
+        if args.records_api:
+            sys.exit("--records-api keeps its records in memory per process; use it with --workers 1")
+        check_port(port)
+        print(f"Serving at http://localhost:{port} ({args.engine} engine, {args.workers} workers)")
+        print("Press Ctrl+C to stop the server")
+        Supervisor(args.workers, lambda: serve(args, reuse_port=True)).run()
+        print("\nServer stopped")
+        return
+
+    try:
+        serve(args, banner=f"Serving at http://localhost:{port} ({args.engine} engine)")
+    except KeyboardInterrupt:
+        print("\nServer stopped")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,226 @@
+"""
+Tests for the build steps in build_assets.py, run on temporary trees.
+
+Run with `python -m unittest` from the repository root.
+"""
+
+import contextlib
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+import build_assets
+import prerender
+
+def write(path, body):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(body)
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+INDEX_HTML = '''<!doctype html>
+<link rel="stylesheet" href="./dist/styles.css">
+<script type="module" src="https://pyscript.net/releases/2025.2.2/core.js"></script>
+<script type="mpy" src="./hello_world.py" config="./pyscript.json"></script>
+'''
+APP_SOURCE = 'import pkg\nfrom pkg import util\nprint(util.NAME)\n'
+WHEEL = 'pkg-0.1-py3-none-any.whl'
+
+def make_app(root):
+    """Write a small PyScript app that uses a local wheel into `root`."""
+    write(os.path.join(root, 'index.html'), INDEX_HTML.encode('utf-8'))
+    write(os.path.join(root, 'hello_world.py'), APP_SOURCE.encode('utf-8'))
+    write(os.path.join(root, 'dist', 'styles.css'), b'body { margin: 0; }\n')
+    config = {'packages': ['./' + WHEEL, 'numpy'], 'files': {'./data.txt': './data.txt'}}
+    write(os.path.join(root, 'pyscript.json'), json.dumps(config).encode('utf-8'))
+    write(os.path.join(root, 'data.txt'), b'data\n')
+    with zipfile.ZipFile(os.path.join(root, WHEEL), 'w') as wheel:
+        wheel.writestr('pkg/__init__.py', 'from . import util\n')
+        wheel.writestr('pkg/util.py', "NAME = 'util'\n")
+        wheel.writestr('pkg/unused.py', "NAME = 'unused'\n")
+        wheel.writestr('pkg-0.1.dist-info/METADATA', 'Name: pkg\n')
+
+class BuildTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        # The steps print what they write
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+
+    def path(self, *parts):
+        return os.path.join(self.tmp, *parts)
+
+class CompressTests(BuildTestCase):
+    def test_variants(self):
+        script = b'console.log("app");\n' * 100
+        write(self.path('dist', 'app.js'), script)
+        write(self.path('dist', 'small.js'), b'1;\n')
+        write(self.path('dist', 'logo.png'), b'\x89PNG' + b'\0' * 1000)
+        written = build_assets.compress_assets([self.path('dist')])
+        self.assertEqual(gzip.decompress(read(self.path('dist', 'app.js.gz'))), script)
+        self.assertEqual(written, len(list(build_assets.compressors())))
+        # Too small to bother, or not a compressible type
+        self.assertFalse(os.path.exists(self.path('dist', 'small.js.gz')))
+        self.assertFalse(os.path.exists(self.path('dist', 'logo.png.gz')))
+
+    def test_variant_not_smaller_is_skipped(self):
+        noise = os.urandom(4096)
+        write(self.path('dist', 'noise.js'), noise)
+        # Left over from an earlier build of different content
+        write(self.path('dist', 'noise.js.gz'), gzip.compress(b'stale'))
+        self.assertEqual(build_assets.compress_assets([self.path('dist')]), 0)
+        self.assertEqual(os.listdir(self.path('dist')), ['noise.js'])
+
+    def test_variants_are_not_compressed_again(self):
+        write(self.path('app.js'), b'console.log("app");\n' * 100)
+        build_assets.compress_assets([self.tmp])
+        before = sorted(os.listdir(self.tmp))
+        build_assets.compress_assets([self.tmp])
+        self.assertEqual(sorted(os.listdir(self.tmp)), before)
+
+class FingerprintTests(BuildTestCase):
+    def setUp(self):
+        super().setUp()
+        make_app(self.path('app'))
+
+    def fingerprint(self, **kwargs):
+        mapping = build_assets.fingerprint_app(self.path('app'), self.path('build'), **kwargs)
+        return mapping, json.loads(read(self.path('build', mapping['pyscript.json'])))
+
+    def test_references_are_rewritten(self):
+        mapping, config = self.fingerprint()
+        self.assertEqual(sorted(mapping), ['data.txt', 'dist/styles.css', 'hello_world.py', 'pkg-0.1-py3-none-any.whl',
+                                           'pyscript.json'])
+        self.assertRegex(mapping['dist/styles.css'], r'^dist/styles\.[0-9a-f]{12}\.css$')
+        # Wheels keep their name, which installers parse
+        self.assertRegex(mapping[WHEEL], r'^[0-9a-f]{12}/' + re.escape(WHEEL) + '$')
+        for renamed in mapping.values():
+            self.assertTrue(os.path.isfile(self.path('build', renamed)), renamed)
+        self.assertEqual(config['packages'], ['./' + mapping[WHEEL], 'numpy'])
+        self.assertEqual(config['files'], {'./' + mapping['data.txt']: './data.txt'})
+        self.assertNotIn('records_api', config)
+        html = read(self.path('build', 'index.html')).decode('utf-8')
+        for original in ('dist/styles.css', 'hello_world.py', 'pyscript.json'):
+            self.assertIn(f'"./{mapping[original]}"', html)
+        self.assertIn('"https://pyscript.net/releases/2025.2.2/core.js"', html)
+        self.assertEqual(json.loads(read(self.path('build', build_assets.ASSET_MANIFEST))), mapping)
+
+    def test_hashes_cover_referenced_files(self):
+        mapping = self.fingerprint()[0]
+        write(self.path('app', 'data.txt'), b'changed\n')
+        changed = self.fingerprint()[0]
+        self.assertNotEqual(changed['data.txt'], mapping['data.txt'])
+        self.assertNotEqual(changed['pyscript.json'], mapping['pyscript.json'])
+        self.assertEqual(changed['dist/styles.css'], mapping['dist/styles.css'])
+        # The output directory is replaced, not added to
+        self.assertFalse(os.path.exists(self.path('build', mapping['data.txt'])))
+
+    def test_records_api(self):
+        self.assertEqual(self.fingerprint(records_api='')[1]['records_api'], '')
+        self.assertEqual(self.fingerprint(records_api='http://localhost:4000')[1]['records_api'],
+                         'http://localhost:4000')
+
+    def test_output_must_not_contain_the_source(self):
+        with self.assertRaises(ValueError):
+            build_assets.fingerprint_app(self.path('app'), self.tmp)
+
+PRERENDER_SHELL = '''<!doctype html>
+<body>
+    <div id="app"><div class="spinner"></div></div>
+    <script type="mpy" src="./hello_world.py" config="./pyscript.json"></script>
+</body>
+'''
+
+class PrerenderTests(BuildTestCase):
+    def setUp(self):
+        super().setUp()
+        write(self.path('index.html'), PRERENDER_SHELL.encode('utf-8'))
+        shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hello_world.py'), self.tmp)
+
+    def prerender(self):
+        try:
+            return prerender.prerender_app(self.tmp)
+        except ImportError as e:
+            self.skipTest(f'cannot import hello_world.py: {e}')
+
+    def test_templates_after_the_mount_point(self):
+        routes = self.prerender()
+        self.assertIn('/', routes)
+        html = read(self.path('index.html')).decode('utf-8')
+        templates = re.findall(r'<template data-prerender-route="([^"]+)">(<[^>]*>)', html)
+        self.assertEqual([route for route, _ in templates], routes)
+        for route, root_tag in templates:
+            self.assertIn('data-prerendered=""', root_tag, route)
+        # The mount point keeps its spinner for browsers without the swap script
+        self.assertLess(html.index('<div class="spinner"></div></div>'), html.index('<template'))
+        self.assertLess(html.index('</template>'), html.index('<script type="mpy"'))
+
+    def test_prerendering_again_replaces_the_templates(self):
+        self.prerender()
+        once = read(self.path('index.html'))
+        self.prerender()
+        self.assertEqual(read(self.path('index.html')), once)
+
+class BundleTests(BuildTestCase):
+    def setUp(self):
+        super().setUp()
+        make_app(self.path('app'))
+
+    def bundle(self, precompile=True):
+        """Fingerprint the app into build/ and bundle it; return the bundle's members."""
+        build_assets.fingerprint_app(self.path('app'), self.path('build'))
+        bundle, sizes = build_assets.bundle_app(self.path('build'), precompile=precompile)
+        with zipfile.ZipFile(self.path('build', bundle)) as archive:
+            members = {member: archive.read(member) for member in archive.namelist()}
+        self.assertEqual({member: len(data) for member, data in members.items()}, sizes)
+        return bundle, members
+
+    def test_source_bundle(self):
+        bundle, members = self.bundle(precompile=False)
+        self.assertRegex(bundle, r'^app\.[0-9a-f]{12}\.zip$')
+        # Only the wheel modules the app imports
+        self.assertEqual(sorted(members), ['hello_world.py', 'pkg/__init__.py', 'pkg/util.py'])
+        self.assertEqual(members['hello_world.py'].decode('utf-8'), APP_SOURCE)
+
+        manifest = json.loads(read(self.path('build', build_assets.ASSET_MANIFEST)))
+        self.assertEqual(sorted(manifest), ['app.zip', 'data.txt', 'dist/styles.css', 'pyscript.json'])
+        self.assertEqual(manifest['app.zip'], bundle)
+        config = json.loads(read(self.path('build', manifest['pyscript.json'])))
+        self.assertEqual(config['packages'], ['numpy'])
+        self.assertEqual(config['files'], {'./' + manifest['data.txt']: './data.txt', './' + bundle: './*'})
+        html = read(self.path('build', 'index.html')).decode('utf-8')
+        self.assertIn(f'<script type="mpy" config="./{manifest["pyscript.json"]}">import hello_world</script>', html)
+        # The replaced script, config and wheel are gone
+        self.assertEqual(sorted(os.listdir(self.path('build'))),
+                         sorted([build_assets.ASSET_MANIFEST, bundle, manifest['data.txt'], 'dist', 'index.html',
+                                 manifest['pyscript.json']]))
+
+    def test_same_sources_same_bundle(self):
+        first = self.bundle(precompile=False)
+        self.assertEqual(self.bundle(precompile=False), first)
+
+    @unittest.skipIf(build_assets.mpy_cross is None, 'needs mpy-cross')
+    def test_precompiled_bundle(self):
+        members = self.bundle()[1]
+        self.assertEqual(sorted(members), ['hello_world.mpy', 'pkg/__init__.mpy', 'pkg/util.mpy'])
+        for member, data in members.items():
+            # The .mpy header: "M", then the format version
+            self.assertEqual(data[:2], b'M\x06', member)
+
+    def test_pyodide_script_bundles_sources(self):
+        html = read(self.path('app', 'index.html')).replace(b'type="mpy"', b'type="py"')
+        write(self.path('app', 'index.html'), html)
+        self.assertEqual(sorted(self.bundle()[1]), ['hello_world.py', 'pkg/__init__.py', 'pkg/util.py'])
+
+if __name__ == '__main__':
+    unittest.main()
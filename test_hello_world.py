@@ -0,0 +1,371 @@
+"""
+Tests for the browser-independent logic of hello_world.py.
+
+The app is imported under CPython with the stand-ins prerender.py uses, so
+these need puepy installed. Run with `python -m unittest` from the
+repository root.
+"""
+
+import json
+import os
+import types
+import unittest
+from unittest import mock
+
+hw = None
+
+def setUpModule():
+    global hw
+    try:
+        import prerender
+        hw = prerender.load_module(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hello_world.py'))
+    except ImportError as e:
+        raise unittest.SkipTest(f'cannot import hello_world.py: {e}')
+
+class Row:
+    """Stands in for a StreamRecord in viewport tests."""
+
+    def __init__(self, seq):
+        self.seq = seq
+
+class MeasuredRow:
+    """Stands in for a rendered stream row element."""
+
+    def __init__(self, seq, top, height):
+        self.seq = seq
+        self.offsetTop = top
+        self.offsetHeight = height
+
+    def getAttribute(self, name):
+        return str(self.seq)
+
+class NodeList:
+    def __init__(self, items):
+        self.items = items
+        self.length = len(items)
+
+    def item(self, index):
+        return self.items[index]
+
+class FakeOPFS:
+    """Keeps the files the app writes through window.__opfs__."""
+
+    def __init__(self):
+        self.state = ''
+        self.journal = ''
+
+    def appendJournal(self, lines):
+        self.journal += lines
+
+    def compactState(self, text):
+        self.state = text
+        self.journal = ''
+
+    def load(self, defaults):
+        """Hydrate like HelloWorldPage.initial(): the snapshot, then the journal."""
+        state = dict(defaults)
+        state.update(json.loads(self.state) if self.state else {})
+        hw.replay_journal(state, self.journal, state.get('journal_seq', 0))
+        state.pop('journal_seq', None)
+        return state
+
+def rows(count):
+    # Newest first, like the stream list
+    return [Row(seq) for seq in range(count, 0, -1)]
+
+class StreamRingTests(unittest.TestCase):
+    def test_append_below_capacity(self):
+        ring = hw.StreamRing(3)
+        self.assertFalse(ring)
+        self.assertEqual(ring.first_seq(), 1)
+        ring.append('a', 10)
+        ring.append('b', 20)
+        self.assertEqual(len(ring), 2)
+        self.assertEqual([record.text for record in ring], ['a', 'b'])
+        self.assertEqual([record.text for record in ring.newest()], ['b', 'a'])
+        self.assertEqual(ring.delta, (1, 0))
+        self.assertEqual(ring.first_seq(), 1)
+
+    def test_eviction_at_capacity(self):
+        ring = hw.StreamRing(3)
+        for i in range(5):
+            ring.append(str(i), i)
+        self.assertEqual(len(ring), 3)
+        self.assertEqual([record.seq for record in ring], [3, 4, 5])
+        self.assertEqual([record.text for record in ring.newest()], ['4', '3', '2'])
+        self.assertEqual(ring.delta, (1, 1))
+        self.assertEqual(ring.first_seq(), 3)
+
+    def test_extend(self):
+        ring = hw.StreamRing(3)
+        ring.extend([('a', 1), ('b', 2)])
+        self.assertEqual(ring.delta, (2, 0))
+        ring.extend([('c', 3), ('d', 4), ('e', 5)])
+        self.assertEqual(ring.delta, (3, 2))
+        self.assertEqual([record.text for record in ring], ['c', 'd', 'e'])
+
+    def test_clear(self):
+        ring = hw.StreamRing(3)
+        ring.extend([('a', 1), ('b', 2)])
+        ring.clear()
+        self.assertEqual(len(ring), 0)
+        self.assertEqual(list(ring.newest()), [])
+        self.assertEqual(ring.delta, (0, 2))
+        # Sequence numbers keep counting up
+        self.assertEqual(ring.first_seq(), 3)
+        self.assertEqual(ring.append('c', 3).seq, 3)
+
+    def test_newest_first_is_cached_until_a_change(self):
+        ring = hw.StreamRing(3)
+        self.assertEqual(ring.newest_first(), [])
+        ring.extend([('a', 1), ('b', 2)])
+        records = ring.newest_first()
+        self.assertEqual([record.text for record in records], ['b', 'a'])
+        self.assertIs(ring.newest_first(), records)
+        ring.append('c', 3)
+        ring.append('d', 4)
+        self.assertEqual([record.text for record in ring.newest_first()], ['d', 'c', 'b'])
+        ring.clear()
+        self.assertEqual(ring.newest_first(), [])
+
+    def test_record_data(self):
+        ring = hw.StreamRing(2)
+        record = ring.append('{"Update": {"id": 2}}', 1234)
+        self.assertEqual(record.data, {'Update': {'id': 2}, 'timestamp': 1234})
+        self.assertIsNone(ring.append('not json', 1235).data)
+
+class StreamIngestTests(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+        self.ingest = hw.StreamIngest(lambda items, skipped: self.batches.append((items, skipped)), limit=3)
+
+    def test_one_batch_per_flush(self):
+        with mock.patch.object(hw.window, 'setTimeout', create=True) as set_timeout:
+            self.ingest.push('a')
+            self.ingest.push('b')
+        set_timeout.assert_called_once()
+        self.ingest.run()
+        self.assertEqual([[text for text, _ in items] for items, _ in self.batches], [['a', 'b']])
+        self.assertEqual(self.batches[0][1], 0)
+        # Nothing queued, nothing flushed
+        self.ingest.run()
+        self.assertEqual(len(self.batches), 1)
+
+    def test_oldest_are_dropped_beyond_the_limit(self):
+        with mock.patch.object(hw.window, 'setTimeout', create=True):
+            for text in 'abcde':
+                self.ingest.push(text)
+        self.ingest.run()
+        items, skipped = self.batches[0]
+        self.assertEqual(([text for text, _ in items], skipped), (['c', 'd', 'e'], 2))
+        with mock.patch.object(hw.window, 'setTimeout', create=True):
+            self.ingest.push('f')
+        self.ingest.run()
+        self.assertEqual(([text for text, _ in self.batches[1][0]], self.batches[1][1]), (['f'], 0))
+
+class StreamViewportTests(unittest.TestCase):
+    def setUp(self):
+        self.viewport = hw.StreamViewport(height=100, estimate=50, overscan=1)
+
+    def test_top(self):
+        self.assertEqual(self.viewport.window(rows(10)), (0, 3))
+
+    def test_bottom(self):
+        self.viewport.scroll_top = 400
+        self.assertEqual(self.viewport.window(rows(10)), (7, 10))
+
+    def test_overscan(self):
+        self.viewport.scroll_top = 200
+        self.assertEqual(self.viewport.window(rows(10)), (3, 7))
+        self.viewport.overscan = 0
+        self.assertEqual(self.viewport.window(rows(10)), (4, 6))
+
+    def test_empty(self):
+        self.assertEqual(self.viewport.window([]), (0, 0))
+        self.assertEqual(self.viewport.slice([]), (0, [], 0))
+
+    def test_fewer_rows_than_viewport(self):
+        self.assertEqual(self.viewport.window(rows(1)), (0, 1))
+
+    def test_measured_heights(self):
+        records = rows(10)
+        # The newest row is 200px tall, so it fills the viewport on its own
+        self.viewport.heights[10] = 200
+        self.assertEqual(self.viewport.window(records), (0, 2))
+        self.viewport.scroll_top = 200
+        self.assertEqual(self.viewport.window(records), (0, 4))
+
+    def test_measure_includes_margins(self):
+        # Three 40px cards with 12px bottom margins
+        cards = [MeasuredRow(seq, top=10 + 52 * i, height=40) for i, seq in enumerate((9, 8, 7))]
+        style = types.SimpleNamespace(marginBottom='12px')
+        with mock.patch.object(hw.window, 'getComputedStyle', lambda element: style, create=True):
+            self.viewport.measure(types.SimpleNamespace(querySelectorAll=lambda selector: NodeList(cards)))
+        self.assertEqual(self.viewport.heights, {9: 52, 8: 52, 7: 52})
+
+    def test_slice_spacers(self):
+        records = rows(10)
+        self.viewport.scroll_top = 200
+        top, visible, bottom = self.viewport.slice(records)
+        self.assertEqual([record.seq for record in visible], [7, 6, 5, 4])
+        self.assertEqual((top, bottom), (150, 150))
+        self.assertEqual(top + len(visible) * 50 + bottom, 500)
+
+class RenderMemoTests(unittest.TestCase):
+    def test_hit_while_content_matches(self):
+        memo = hw.RenderMemo(4)
+        self.assertIsNone(memo.get('record-1', 'v1'))
+        memo.put('record-1', 'v1', 1, 'tag-v1')
+        self.assertEqual(memo.get('record-1', 'v1'), 'tag-v1')
+        self.assertEqual(memo.get('record-1', 'v1'), 'tag-v1')
+
+    def test_miss_on_new_version(self):
+        memo = hw.RenderMemo(4)
+        memo.put('record-1', 'v1', 1, 'tag-v1')
+        self.assertIsNone(memo.get('record-1', 'v2'))
+        # The stale entry is gone, not kept for the old version
+        self.assertIsNone(memo.get('record-1', 'v1'))
+        memo.put('record-1', 'v2', 1, 'tag-v2')
+        self.assertEqual(memo.get('record-1', 'v2'), 'tag-v2')
+        self.assertEqual(len(memo.entries), 1)
+
+    def test_least_recently_used_go_first(self):
+        memo = hw.RenderMemo(2)
+        memo.put('a', 'a', 1, 'tag-a')
+        memo.put('b', 'b', 2, 'tag-b')
+        memo.get('a', 'a')
+        memo.put('c', 'c', 3, 'tag-c')
+        self.assertEqual(list(memo.entries), ['a', 'c'])
+        self.assertIsNone(memo.get('b', 'b'))
+
+    def test_discard_before(self):
+        memo = hw.RenderMemo(4)
+        for seq in (1, 2, 3):
+            memo.put(f'record-{seq}', str(seq), seq, seq)
+        memo.discard_before(3)
+        self.assertEqual(list(memo.entries), ['record-3'])
+
+class StateJournalTests(unittest.TestCase):
+    defaults = {'count': 0, 'todos': []}
+
+    def setUp(self):
+        self.opfs = FakeOPFS()
+        for name, value in (('__opfs__', self.opfs), ('clearTimeout', lambda timer: None)):
+            patcher = mock.patch.object(hw.window, name, value, create=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_state_ops(self):
+        old = {'count': 1, 'todos': ['a', 'b', 'c']}
+        self.assertEqual(hw.state_ops(old, {'count': 2, 'todos': ['a', 'b', 'c', 'd']}),
+                         [['set', 'count', 2], ['append', 'todos', 'd']])
+        self.assertEqual(hw.state_ops(old, {'count': 1, 'todos': ['a', 'c']}), [['remove', 'todos', 1]])
+        self.assertEqual(hw.state_ops(old, {'count': 1, 'todos': ['c']}), [['set', 'todos', ['c']]])
+        self.assertEqual(hw.state_ops(old, dict(old)), [])
+
+    def test_replay(self):
+        journal = hw.StateJournal(dict(self.defaults), compact_every=100)
+        journal.record({'count': 1, 'todos': []})
+        journal.record({'count': 1, 'todos': ['a']})
+        journal.flush()
+        journal.record({'count': 2, 'todos': ['a', 'b']})
+        journal.record({'count': 2, 'todos': ['b']})
+        journal.flush()
+        self.assertEqual(self.opfs.state, '')
+        self.assertEqual(self.opfs.load(self.defaults), {'count': 2, 'todos': ['b']})
+
+    def test_pending_set_replaces_earlier_ones(self):
+        journal = hw.StateJournal(dict(self.defaults), compact_every=100)
+        for count in range(1, 6):
+            journal.record({'count': count, 'todos': []})
+        journal.flush()
+        self.assertEqual(self.opfs.journal.count('\n'), 1)
+        self.assertEqual(self.opfs.load(self.defaults)['count'], 5)
+
+    def test_replay_after_compaction(self):
+        journal = hw.StateJournal(dict(self.defaults), compact_every=3)
+        state = dict(self.defaults)
+        for i in range(10):
+            state = {'count': i + 1, 'todos': state['todos'] + [f'todo {i}']}
+            journal.record(state)
+            journal.flush()
+            self.assertEqual(self.opfs.load(self.defaults), state)
+        self.assertNotEqual(self.opfs.state, '')
+        self.assertEqual(json.loads(self.opfs.state)['journal_seq'], journal.seq)
+
+    def test_entries_in_the_snapshot_are_skipped(self):
+        journal = hw.StateJournal(dict(self.defaults), compact_every=3)
+        journal.record({'count': 1, 'todos': ['a']})
+        journal.flush()
+        stale = self.opfs.journal
+        journal.record({'count': 2, 'todos': []})
+        journal.flush()
+        # The snapshot was written but the journal it replaces was not cleared
+        self.opfs.journal = stale
+        self.assertEqual(self.opfs.load(self.defaults), {'count': 2, 'todos': []})
+
+    def test_flush_when_hidden(self):
+        journal = hw.StateJournal(dict(self.defaults), compact_every=100)
+        journal.record({'count': 1, 'todos': []})
+        with mock.patch.object(hw.window, 'document', types.SimpleNamespace(visibilityState='visible'), create=True):
+            journal.flush_if_hidden()
+            self.assertEqual(self.opfs.journal, '')
+            hw.window.document.visibilityState = 'hidden'
+            journal.flush_if_hidden()
+        self.assertEqual(self.opfs.load(self.defaults)['count'], 1)
+
+    def test_truncated_last_line(self):
+        journal = hw.StateJournal(dict(self.defaults), compact_every=100)
+        journal.record({'count': 1, 'todos': ['a']})
+        journal.flush()
+        journal.record({'count': 2, 'todos': ['a', 'b']})
+        journal.flush()
+        lines = self.opfs.journal.splitlines(keepends=True)
+        # The last append was cut off halfway through its second entry
+        torn = ''.join(lines[:3]) + lines[3][:len(lines[3]) // 2]
+        state = dict(self.defaults)
+        self.assertEqual(hw.replay_journal(state, torn), (3, 3))
+        self.assertEqual(state, {'count': 2, 'todos': ['a']})
+        # Appending after the torn line still replays up to it
+        state = dict(self.defaults)
+        self.assertEqual(hw.replay_journal(state, torn + '\n' + lines[3]), (3, 3))
+
+class Shell:
+    """Stands in for the prerendered shell in the mount point."""
+
+    def hasAttribute(self, name):
+        return name == 'data-prerendered'
+
+class HydrationTests(unittest.TestCase):
+    def test_off_by_default(self):
+        self.assertFalse(hw.hydrate_enabled())
+        location = types.SimpleNamespace(search='?hydrate=1', hash='')
+        with mock.patch.object(hw.window, 'location', location, create=True):
+            self.assertTrue(hw.hydrate_enabled())
+        with mock.patch.object(hw.pyscript, 'config', {'hydrate': True}, create=True):
+            self.assertTrue(hw.hydrate_enabled())
+
+    def mount(self, hydrate):
+        page = hw.HelloWorldPage(matched_route=None, application=hw.app)
+        element = types.SimpleNamespace(firstElementChild=Shell())
+        with mock.patch.object(hw, 'HYDRATE', hydrate), \
+                mock.patch.object(hw.Page, 'mount') as replace, \
+                mock.patch.object(hw, 'patch_dom_element') as patch:
+            for name in ('update_title', 'generate_children', 'render', 'recursive_call', 'add_python_css_classes',
+                         '_adopt_listeners'):
+                setattr(page, name, mock.Mock())
+            page.mount(element)
+        return replace, patch
+
+    def test_shell_is_replaced_by_default(self):
+        replace, patch = self.mount(hydrate=False)
+        replace.assert_called_once()
+        patch.assert_not_called()
+
+    def test_shell_is_patched_when_enabled(self):
+        replace, patch = self.mount(hydrate=True)
+        replace.assert_not_called()
+        patch.assert_called_once()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,945 @@
+"""
+Tests for the request helpers and serving paths of spa_server.py.
+
+Run with `python -m unittest` from the repository root.
+"""
+
+import gzip
+import io
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import spa_server
+from build_assets import pack_assets
+from spa_server import (RANGE_NOT_SATISFIABLE, SHED_RETRY_AFTER, AccessLog, AdmissionControl, AssetCache, AssetPack,
+                        AsyncioServer, EventBroadcaster, Metrics, RecordsAPI, RecordsProxy, RouteManifest, SPAServer,
+                        ThreadPoolServer, etag_matches, parse_accept_encoding, parse_range, preload_links)
+
+INDEX_HTML = b'<!doctype html><title>app</title>'
+APP_JS = b'console.log("app");\n' * 40
+
+def write(path, body):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(body)
+
+def make_tree(root):
+    write(os.path.join(root, 'index.html'), INDEX_HTML)
+    write(os.path.join(root, 'app.js'), APP_JS)
+    write(os.path.join(root, 'dist', 'styles.css'), b'body { margin: 0; }\n')
+    write(os.path.join(root, '.env'), b'SECRET=1\n')
+    write(os.path.join(root, '.git', 'config'), b'[core]\n')
+    write(os.path.join(root, 'node_modules', 'dep.js'), b'module.exports = 1;\n')
+
+def read_response(f):
+    """Read one HTTP/1.1 response with a Content-Length body from `f`."""
+    status = f.readline().decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = f.readline().decode('latin-1').strip()
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return int(status[1]), headers, f.read(int(headers.get('content-length', 0)))
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+def listening(address):
+    try:
+        socket.create_connection(address, timeout=5).close()
+        return True
+    except OSError:
+        return False
+
+class ServerTestCase(unittest.TestCase):
+    """Serves a small tree from a temporary directory on loopback ports."""
+
+    engine = 'threads'
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.root = os.path.join(tmp.name, 'site')
+        make_tree(self.root)
+
+    def serve(self, root=None, **attrs):
+        """Serve `root` (default: the tree) with `self.engine`; return the address."""
+        root = root or self.root
+        # A handler class of its own, so SPAServer's shared state is untouched
+        handler = type('Handler', (SPAServer,), dict(attrs, root=root, route_manifest=RouteManifest(root)))
+        self.handler = handler
+        if self.engine == 'asyncio':
+            httpd = AsyncioServer(('127.0.0.1', 0), handler)
+        else:
+            httpd = ThreadPoolServer(('127.0.0.1', 0), handler, max_workers=4)
+        thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(httpd.server_close)
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(httpd.shutdown)
+        address = httpd.socket.getsockname()
+        # The asyncio engine only stops once its loop has started
+        sock, f = self.connect(address)
+        self.request(sock, f, '/')
+        return address
+
+    def spawn(self, *args):
+        """Run Python with `args` in a child process from the repository root."""
+        proc = subprocess.Popen([sys.executable, *args], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.addCleanup(proc.wait, 5)
+        self.addCleanup(proc.kill)
+        return proc
+
+    def serve_process(self, *args):
+        """Serve the tree with spa_server.py `args` in a child process."""
+        self.address = ('127.0.0.1', free_port())
+        proc = self.spawn('spa_server.py', str(self.address[1]), '--directory', self.root, *args)
+        self.wait_for(lambda: listening(self.address))
+        return proc
+
+    def wait_for(self, ready, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not ready():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.05)
+
+    def connect(self, address=None):
+        sock = socket.create_connection(address or self.address, timeout=5)
+        self.addCleanup(sock.close)
+        return sock, sock.makefile('rb')
+
+    def request(self, sock, f, url_path, method='GET', headers=b''):
+        sock.sendall(f'{method} {url_path} HTTP/1.1\r\nHost: test\r\n'.encode('ascii') + headers + b'\r\n')
+        return read_response(f)
+
+class ThreadPoolEngineTests(ServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.address = self.serve()
+
+    def test_files_and_fallback(self):
+        sock, f = self.connect()
+        self.assertEqual(self.request(sock, f, '/app.js')[::2], (200, APP_JS))
+        for url_path in ('/', '/people/2', '/.env'):
+            status, headers, body = self.request(sock, f, url_path)
+            self.assertEqual((status, body), (200, INDEX_HTML), url_path)
+            self.assertIn('text/html', headers['content-type'])
+
+    def test_keep_alive(self):
+        sock, f = self.connect()
+        for _ in range(3):
+            status, headers, body = self.request(sock, f, '/app.js')
+            self.assertEqual(status, 200)
+            self.assertNotEqual(headers.get('connection'), 'close')
+        self.assertEqual(self.request(sock, f, '/app.js', headers=b'Connection: close\r\n')[0], 200)
+        self.assertEqual(f.read(), b'')
+
+    def test_pipelining(self):
+        sock, f = self.connect()
+        sock.sendall(b'GET /app.js HTTP/1.1\r\nHost: test\r\n\r\n'
+                     b'GET /people/2 HTTP/1.1\r\nHost: test\r\n\r\n')
+        self.assertEqual(read_response(f)[::2], (200, APP_JS))
+        status, headers, body = read_response(f)
+        self.assertEqual((status, body), (200, INDEX_HTML))
+        self.assertIn('text/html', headers['content-type'])
+        # Still open for a third request
+        self.assertEqual(self.request(sock, f, '/app.js')[::2], (200, APP_JS))
+
+    def test_slow_client_does_not_hold_up_others(self):
+        slow, _ = self.connect()
+        # Part of a request line, never finished
+        slow.sendall(b'GE')
+        sock, f = self.connect()
+        start = time.monotonic()
+        self.assertEqual(self.request(sock, f, '/')[0], 200)
+        self.assertLess(time.monotonic() - start, 1)
+
+class AsyncioEngineTests(ThreadPoolEngineTests):
+    engine = 'asyncio'
+
+class EtagMatchesTests(unittest.TestCase):
+    def test_strong(self):
+        self.assertTrue(etag_matches('"abc"', '"xyz", "abc"'))
+        self.assertFalse(etag_matches('"abc"', '"xyz"'))
+
+    def test_weak(self):
+        self.assertTrue(etag_matches('"abc"', 'W/"abc"'))
+        self.assertFalse(etag_matches('"abc"', 'W/"xyz"'))
+
+    def test_any(self):
+        self.assertTrue(etag_matches('"abc"', '*'))
+
+class AssetCacheTests(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.paths = []
+        for name in ('a.js', 'b.js'):
+            path = os.path.join(tmp.name, name)
+            # 1000 bytes that gzip well
+            write(path, (name.encode('ascii') + b' = 1;\n') * 100)
+            self.paths.append(path)
+
+    def test_gzip_copies_are_counted(self):
+        cache = AssetCache(max_bytes=10000, max_entry_bytes=2000)
+        path = self.paths[0]
+        entry = cache.get(path, 'application/javascript')
+        self.assertEqual(cache.size, 1000)
+        variant = cache.gzipped(path, entry)
+        self.assertIs(cache.gzipped(path, entry), variant)
+        self.assertLess(len(variant.body), 1000)
+        self.assertEqual(cache.size, 1000 + len(variant.body))
+        self.assertEqual(entry.footprint, cache.size)
+        cache.invalidate(path)
+        self.assertEqual(cache.size, 0)
+
+    def test_gzip_copies_count_towards_eviction(self):
+        cache = AssetCache(max_bytes=2010, max_entry_bytes=1000)
+        first = cache.get(self.paths[0], 'application/javascript')
+        second = cache.get(self.paths[1], 'application/javascript')
+        self.assertEqual(cache.size, 2000)
+        # The copy pushes the cache over its limit, so the oldest entry goes
+        variant = cache.gzipped(self.paths[1], second)
+        self.assertEqual(cache.size, 1000 + len(variant.body))
+        self.assertIsNot(cache.get(self.paths[0], 'application/javascript'), first)
+
+    def test_gzip_copy_of_evicted_entry(self):
+        cache = AssetCache(max_bytes=1000, max_entry_bytes=1000)
+        stale = cache.get(self.paths[0], 'application/javascript')
+        cache.get(self.paths[1], 'application/javascript')
+        self.assertEqual(cache.size, 1000)
+        cache.gzipped(self.paths[0], stale)
+        self.assertEqual(cache.size, 1000)
+        cache.invalidate(self.paths[1])
+        self.assertEqual(cache.size, 0)
+
+class CachedServingTests(ServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.address = self.serve(asset_cache=AssetCache())
+
+    def test_not_modified(self):
+        sock, f = self.connect()
+        status, headers, body = self.request(sock, f, '/app.js')
+        self.assertEqual((status, body), (200, APP_JS))
+        etag = headers['etag']
+        for header in (etag, 'W/' + etag, '"other", ' + etag, '*'):
+            status, headers, body = self.request(sock, f, '/app.js', headers=f'If-None-Match: {header}\r\n'.encode())
+            self.assertEqual((status, body), (304, b''), header)
+            self.assertEqual(headers['etag'], etag)
+        status, headers, body = self.request(sock, f, '/app.js', headers=b'If-None-Match: "other"\r\n')
+        self.assertEqual((status, body), (200, APP_JS))
+
+    def test_changed_file_is_reloaded(self):
+        sock, f = self.connect()
+        etag = self.request(sock, f, '/app.js')[1]['etag']
+        path = os.path.join(self.root, 'app.js')
+        write(path, b'console.log("v2");\n')
+        # A different mtime, even on filesystems with coarse timestamps
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+        self.assertTrue(self.handler.route_manifest.refresh())
+        status, headers, body = self.request(sock, f, '/app.js', headers=f'If-None-Match: {etag}\r\n'.encode())
+        self.assertEqual((status, body), (200, b'console.log("v2");\n'))
+        self.assertNotEqual(headers['etag'], etag)
+
+class ParseAcceptEncodingTests(unittest.TestCase):
+    def test_ranked_by_quality(self):
+        self.assertEqual(parse_accept_encoding('gzip, zstd;q=0.5'), ['gzip', 'zstd'])
+
+    def test_zero_quality_is_refused(self):
+        self.assertEqual(parse_accept_encoding('gzip;q=0, zstd'), ['zstd'])
+        self.assertEqual(parse_accept_encoding('gzip;q=0'), [])
+
+    def test_wildcard(self):
+        self.assertEqual(parse_accept_encoding('*'), ['zstd', 'gzip'])
+        self.assertEqual(parse_accept_encoding('gzip;q=0, *'), ['zstd'])
+        self.assertEqual(parse_accept_encoding('*;q=0'), [])
+
+    def test_unknown_codings(self):
+        self.assertEqual(parse_accept_encoding('br, identity'), [])
+
+class PrecompressedServingTests(ServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.gzipped = gzip.compress(APP_JS, mtime=0)
+        write(os.path.join(self.root, 'app.js.gz'), self.gzipped)
+        self.address = self.serve(asset_cache=AssetCache())
+
+    def test_variant_by_accept_encoding(self):
+        sock, f = self.connect()
+        status, headers, body = self.request(sock, f, '/app.js', headers=b'Accept-Encoding: br, gzip\r\n')
+        self.assertEqual((status, headers.get('content-encoding'), body), (200, 'gzip', self.gzipped))
+        self.assertEqual(headers['vary'], 'Accept-Encoding')
+        self.assertEqual(headers['content-type'], 'text/javascript')
+        for accept in (b'', b'Accept-Encoding: gzip;q=0\r\n', b'Accept-Encoding: identity\r\n'):
+            status, headers, body = self.request(sock, f, '/app.js', headers=accept)
+            self.assertEqual((status, headers.get('content-encoding'), body), (200, None, APP_JS), accept)
+
+    def test_compressed_on_the_fly_without_variant(self):
+        os.remove(os.path.join(self.root, 'app.js.gz'))
+        self.handler.route_manifest.refresh()
+        sock, f = self.connect()
+        status, headers, body = self.request(sock, f, '/app.js', headers=b'Accept-Encoding: gzip\r\n')
+        self.assertEqual((status, headers.get('content-encoding')), (200, 'gzip'))
+        self.assertEqual(gzip.decompress(body), APP_JS)
+
+class ParseRangeTests(unittest.TestCase):
+    def test_bounded(self):
+        self.assertEqual(parse_range('bytes=0-99', 1000), (0, 100))
+
+    def test_end_past_size_is_clamped(self):
+        self.assertEqual(parse_range('bytes=900-2000', 1000), (900, 100))
+
+    def test_open_ended(self):
+        self.assertEqual(parse_range('bytes=400-', 1000), (400, 600))
+
+    def test_suffix(self):
+        self.assertEqual(parse_range('bytes=-100', 1000), (900, 100))
+
+    def test_suffix_longer_than_entity(self):
+        self.assertEqual(parse_range('bytes=-5000', 1000), (0, 1000))
+
+    def test_unsatisfiable(self):
+        self.assertIs(parse_range('bytes=1000-', 1000), RANGE_NOT_SATISFIABLE)
+        self.assertIs(parse_range('bytes=-0', 1000), RANGE_NOT_SATISFIABLE)
+
+    def test_ignored(self):
+        for header in ('items=0-1', 'bytes=0-1,5-6', 'bytes=5-1', 'bytes=a-b', 'bytes=5'):
+            self.assertIsNone(parse_range(header, 1000), header)
+
+class RangeServingTests(ServerTestCase):
+    def check_ranges(self, address):
+        sock, f = self.connect(address)
+        status, headers, body = self.request(sock, f, '/app.js', headers=b'Range: bytes=20-39\r\n')
+        self.assertEqual((status, body), (206, APP_JS[20:40]))
+        self.assertEqual(headers['content-range'], f'bytes 20-39/{len(APP_JS)}')
+        status, headers, body = self.request(sock, f, '/app.js', headers=b'Range: bytes=-20\r\n')
+        self.assertEqual((status, body), (206, APP_JS[-20:]))
+        status, headers, body = self.request(sock, f, '/app.js', headers=b'Range: bytes=100000-\r\n')
+        self.assertEqual((status, body), (416, b''))
+        self.assertEqual(headers['content-range'], f'bytes */{len(APP_JS)}')
+        # Multiple ranges are answered with the whole file
+        status, headers, body = self.request(sock, f, '/app.js', headers=b'Range: bytes=0-1,5-6\r\n')
+        self.assertEqual((status, body), (200, APP_JS))
+        self.assertEqual(headers['accept-ranges'], 'bytes')
+
+    def test_from_disk(self):
+        # Nothing cached, so bodies go out with sendfile()
+        self.check_ranges(self.serve())
+
+    def test_from_cache(self):
+        self.check_ranges(self.serve(asset_cache=AssetCache()))
+
+class RouteManifestTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = os.path.join(self.tmp.name, 'site')
+        make_tree(self.root)
+        write(os.path.join(self.tmp.name, 'outside.txt'), b'not servable\n')
+        self.manifest = RouteManifest(self.root)
+
+    def assertFallback(self, url_path):
+        entry, is_fallback = self.manifest.resolve(url_path)
+        self.assertTrue(is_fallback, url_path)
+        self.assertEqual(entry.path, os.path.join(self.manifest.root, 'index.html'))
+
+    def test_allowed_files(self):
+        for url_path in ('/', '/index.html', '/app.js', '/dist/styles.css', '/dist%2Fstyles.css'):
+            entry, is_fallback = self.manifest.resolve(url_path)
+            self.assertFalse(is_fallback, url_path)
+        self.assertIs(self.manifest.resolve('/')[0], self.manifest.resolve('/index.html')[0])
+
+    def test_unknown_paths_fall_back(self):
+        self.assertFallback('/people/2')
+        self.assertFallback('/dist/')
+
+    def test_dotfiles_and_excluded_names(self):
+        self.assertFallback('/.env')
+        self.assertFallback('/.git/config')
+        self.assertFallback('/node_modules/dep.js')
+
+    def test_traversal(self):
+        self.assertFallback('/../outside.txt')
+        self.assertFallback('/%2e%2e/outside.txt')
+        self.assertFallback('/dist/../../outside.txt')
+
+    @unittest.skipUnless(hasattr(os, 'symlink'), 'needs symlinks')
+    def test_symlinks(self):
+        os.symlink(os.path.join(self.tmp.name, 'outside.txt'), os.path.join(self.root, 'escape.txt'))
+        os.symlink(os.path.join(self.root, 'app.js'), os.path.join(self.root, 'alias.js'))
+        self.manifest.refresh()
+        self.assertFallback('/escape.txt')
+        self.assertFalse(self.manifest.resolve('/alias.js')[1])
+
+    def test_refresh(self):
+        self.assertFalse(self.manifest.refresh())
+        write(os.path.join(self.root, 'new.js'), b'1;\n')
+        self.assertTrue(self.manifest.refresh())
+        self.assertFalse(self.manifest.resolve('/new.js')[1])
+
+    def test_precompressed_variants(self):
+        write(os.path.join(self.root, 'app.js.gz'), b'not really gzip')
+        self.manifest.refresh()
+        entry = self.manifest.resolve('/app.js')[0]
+        self.assertEqual(entry.variants['gzip'].path, os.path.join(self.manifest.root, 'app.js.gz'))
+
+class ManifestServingTests(ServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.address = self.serve()
+
+    def test_stale_hashed_url_is_not_found(self):
+        sock, f = self.connect()
+        # Answering with the HTML shell would poison an immutable cache entry
+        self.assertEqual(self.request(sock, f, '/app.0123456789ab.js')[0], 404)
+        sock, f = self.connect()
+        self.assertEqual(self.request(sock, f, '/app.js')[0], 200)
+
+    def test_new_files_after_refresh(self):
+        write(os.path.join(self.root, 'late.js'), b'1;\n')
+        sock, f = self.connect()
+        self.assertEqual(self.request(sock, f, '/late.js')[2], INDEX_HTML)
+        self.handler.route_manifest.refresh()
+        self.assertEqual(self.request(sock, f, '/late.js')[2], b'1;\n')
+
+# Run by SupervisorTests in a child process: the first two workers crash
+CRASHING_WORKER = '''
+import os, sys, time
+import spa_server
+
+def target():
+    with open(sys.argv[1], 'a') as f:
+        f.write(f'{os.getpid()}\\n')
+    with open(sys.argv[1]) as f:
+        if len(f.readlines()) < 3:
+            raise RuntimeError('crashed')
+    time.sleep(60)
+
+spa_server.RESPAWN_BACKOFF = 0.1
+spa_server.Supervisor(1, target).run()
+'''
+
+class SupervisorTests(ServerTestCase):
+    def test_crashed_worker_is_restarted(self):
+        started = os.path.join(self.tmp, 'started')
+        proc = self.spawn('-c', CRASHING_WORKER, started)
+
+        def pids():
+            try:
+                with open(started) as f:
+                    return f.read().split()
+            except FileNotFoundError:
+                return []
+        self.wait_for(lambda: len(pids()) == 3)
+        self.assertEqual(len(set(pids())), 3)
+        proc.send_signal(signal.SIGTERM)
+        self.assertEqual(proc.wait(5), 0)
+
+    def test_sigterm_drains_workers(self):
+        proc = self.serve_process('--workers', '2')
+        sock, f = self.connect()
+        self.assertEqual(self.request(sock, f, '/app.js')[0], 200)
+        proc.send_signal(signal.SIGTERM)
+        # New connections are refused, but the open one is still answered
+        self.wait_for(lambda: not listening(self.address))
+        self.assertEqual(self.request(sock, f, '/app.js', headers=b'Connection: close\r\n')[::2], (200, APP_JS))
+        self.assertEqual(proc.wait(5), 0)
+
+def samples(text):
+    """Map each sample line of Prometheus text output to its value."""
+    return dict(line.rsplit(' ', 1) for line in text.splitlines() if line and not line.startswith('#'))
+
+class MetricsTests(unittest.TestCase):
+    def test_shards_are_summed(self):
+        metrics = Metrics()
+
+        def serve_some():
+            metrics.connection_opened()
+            for _ in range(10):
+                metrics.record('static', 200, 0.002, 100)
+            metrics.record('fallback', 200, 0.3, 50)
+            metrics.connection_closed()
+        threads = [threading.Thread(target=serve_some) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        metrics.connection_opened()
+        self.assertEqual(len(metrics._shards), 5)
+        values = samples(metrics.render())
+        self.assertEqual(values['spa_requests_total{route="static"}'], '40')
+        self.assertEqual(values['spa_requests_total{route="fallback"}'], '4')
+        self.assertEqual(values['spa_responses_total{code="200"}'], '44')
+        self.assertEqual(values['spa_response_bytes_total'], '4200')
+        self.assertEqual(values['spa_connections_total'], '5')
+        self.assertEqual(values['spa_connections_in_flight'], '1')
+        # Buckets are cumulative
+        self.assertEqual(values['spa_request_duration_seconds_bucket{route="static",le="0.001"}'], '0')
+        self.assertEqual(values['spa_request_duration_seconds_bucket{route="static",le="0.0025"}'], '40')
+        self.assertEqual(values['spa_request_duration_seconds_bucket{route="fallback",le="0.25"}'], '0')
+        self.assertEqual(values['spa_request_duration_seconds_bucket{route="fallback",le="+Inf"}'], '4')
+        self.assertEqual(values['spa_request_duration_seconds_count{route="static"}'], '40')
+        self.assertEqual(values['spa_request_duration_seconds_sum{route="fallback"}'], '1.200000')
+
+class MetricsServingTests(ServerTestCase):
+    def test_requests_are_counted(self):
+        self.address = self.serve(metrics=Metrics())
+        sock, f = self.connect()
+        self.request(sock, f, '/app.js')
+        self.request(sock, f, '/people/2')
+        status, headers, body = self.request(sock, f, '/metrics')
+        self.assertEqual(status, 200)
+        values = samples(body.decode('utf-8'))
+        # Including the warm-up request for / from serve()
+        self.assertEqual(values['spa_requests_total{route="static"}'], '2')
+        self.assertEqual(values['spa_requests_total{route="fallback"}'], '1')
+        self.assertEqual(values['spa_connections_total'], '2')
+
+class BlockedStream(io.StringIO):
+    """Log stream whose writes wait until `release` is set."""
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def write(self, text):
+        self.release.wait(5)
+        return super().write(text)
+
+class AccessLogTests(ServerTestCase):
+    def test_close_writes_what_is_buffered(self):
+        stream = BlockedStream()
+        log = AccessLog(stream)
+        for i in range(10):
+            log.log('127.0.0.1', f'GET /{i} HTTP/1.1', 200, 10, 0.001)
+        threading.Timer(0.1, stream.release.set).start()
+        log.close()
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 10)
+        self.assertTrue(lines[9].endswith('"GET /9 HTTP/1.1" 200 10 1.000ms'), lines[9])
+
+    def test_entries_beyond_the_buffer_are_dropped(self):
+        stream = BlockedStream()
+        log = AccessLog(stream, capacity=2)
+        log.log('127.0.0.1', 'GET / HTTP/1.1', 200, 10, 0.001)
+        # The writer holds the first entry until the stream is released
+        self.wait_for(log._queue.empty)
+        for _ in range(5):
+            log.log('127.0.0.1', 'GET / HTTP/1.1', 200, 10, 0.001)
+        self.assertEqual(log.dropped, 3)
+        stream.release.set()
+        log.close()
+        self.assertEqual(len(stream.getvalue().splitlines()), 3)
+
+    def test_errors_are_not_sampled_out(self):
+        stream = io.StringIO()
+        log = AccessLog(stream, fmt='json', sample=0.0)
+        log.log('127.0.0.1', 'GET / HTTP/1.1', 200, 10, 0.001)
+        log.log('127.0.0.1', 'GET /missing.js HTTP/1.1', 404, 0, 0.0005)
+        log.close()
+        record = json.loads(stream.getvalue())
+        self.assertEqual((record['request'], record['status'], record['duration_ms']),
+                         ('GET /missing.js HTTP/1.1', 404, 0.5))
+
+    def test_lines_are_written_on_shutdown(self):
+        path = os.path.join(self.tmp, 'access.log')
+        proc = self.serve_process('--access-log', path)
+        sock, f = self.connect()
+        for url_path in ('/app.js', '/people/2'):
+            self.assertEqual(self.request(sock, f, url_path)[0], 200)
+        proc.send_signal(signal.SIGTERM)
+        sock.close()
+        f.close()
+        self.assertEqual(proc.wait(5), 0)
+        with open(path) as log:
+            requests = [line.split('"')[1] for line in log]
+        self.assertEqual(requests[-2:], ['GET /app.js HTTP/1.1', 'GET /people/2 HTTP/1.1'])
+
+BOOT_HTML = b'''<!doctype html>
+<link rel="stylesheet" href="./dist/styles.css">
+<link rel="stylesheet" href="https://pyscript.net/releases/2025.2.2/core.css">
+<link rel="stylesheet" href="./missing.css">
+<script type="module" src="https://pyscript.net/releases/2025.2.2/core.js"></script>
+<script type="module">
+    import { boot } from './boot.js';
+    const late = await import("/lazy.js");
+</script>
+<script type="mpy" src="./app.py" config="./pyscript.json"></script>
+'''
+
+class PreloadLinksTests(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+        write(os.path.join(self.root, 'index.html'), BOOT_HTML)
+        config = {'packages': ['./pkg.whl', 'numpy'], 'files': {'./data.txt': './data.txt'}}
+        write(os.path.join(self.root, 'pyscript.json'), json.dumps(config).encode('utf-8'))
+        for name in ('dist/styles.css', 'boot.js', 'lazy.js', 'app.py', 'pkg.whl', 'data.txt'):
+            write(os.path.join(self.root, name), b'\n')
+
+    def test_boot_chain(self):
+        self.assertEqual(preload_links(self.root).split(', '), [
+            '</dist/styles.css>; rel=preload; as=style',
+            '<https://pyscript.net/releases/2025.2.2/core.css>; rel=preload; as=style',
+            '<https://pyscript.net/releases/2025.2.2/core.js>; rel=modulepreload',
+            '</boot.js>; rel=modulepreload',
+            '</lazy.js>; rel=modulepreload',
+            '</app.py>; rel=preload; as=fetch; crossorigin',
+            '</pyscript.json>; rel=preload; as=fetch; crossorigin',
+            '</pkg.whl>; rel=preload; as=fetch; crossorigin',
+            '</data.txt>; rel=preload; as=fetch; crossorigin',
+        ])
+
+    def test_no_entry(self):
+        self.assertIsNone(preload_links(self.root, 'missing.html'))
+
+class EarlyHintsTests(ServerTestCase):
+    links = '</app.js>; rel=modulepreload'
+
+    def test_early_hints_before_html(self):
+        self.address = self.serve(preload_links=self.links, early_hints=True)
+        sock, f = self.connect()
+        for url_path in ('/', '/people/2'):
+            sock.sendall(f'GET {url_path} HTTP/1.1\r\nHost: test\r\n\r\n'.encode('ascii'))
+            status, headers, body = read_response(f)
+            self.assertEqual((status, headers, body), (103, {'link': self.links}, b''))
+            status, headers, body = read_response(f)
+            self.assertEqual((status, body), (200, INDEX_HTML))
+            self.assertEqual(headers['link'], self.links)
+        status, headers, body = self.request(sock, f, '/app.js')
+        self.assertEqual(status, 200)
+        self.assertNotIn('link', headers)
+
+    def test_no_early_hints_for_http_1_0(self):
+        self.address = self.serve(preload_links=self.links, early_hints=True)
+        sock, f = self.connect()
+        sock.sendall(b'GET / HTTP/1.0\r\n\r\n')
+        self.assertEqual(f.readline().split()[1], b'200')
+
+    def test_preload_links_through_symlinked_root(self):
+        link = os.path.join(self.tmp, 'current')
+        os.symlink(self.root, link)
+        self.address = self.serve(link, preload_links=self.links)
+        sock, f = self.connect()
+        for url_path in ('/', '/index.html', '/people/2', '/app.js'):
+            status, headers, body = self.request(sock, f, url_path)
+            self.assertEqual(status, 200)
+            if url_path == '/app.js':
+                self.assertNotIn('link', headers)
+            else:
+                self.assertEqual(headers.get('link'), self.links, url_path)
+
+class AsyncioEarlyHintsTests(EarlyHintsTests):
+    engine = 'asyncio'
+
+class RecordsAPITests(ServerTestCase):
+    def setUp(self):
+        super().setUp()
+        broadcaster = EventBroadcaster()
+        self.addCleanup(broadcaster.close)
+        self.address = self.serve(records_api=RecordsAPI(broadcaster))
+
+    def subscribe(self, url_path):
+        """Open the event stream at `url_path`; return its reader once subscribed."""
+        stream, events = self.connect()
+        stream.sendall(f'GET {url_path} HTTP/1.1\r\nHost: test\r\n\r\n'.encode('ascii'))
+        self.assertIn(b' 200 ', events.readline())
+        while events.readline().strip():
+            pass
+        self.assertEqual(events.readline(), b': subscribed\n')
+        return events
+
+    def next_event(self, events):
+        """Return the data of the next event on `events`, and its id."""
+        event_id = None
+        while True:
+            line = events.readline()
+            self.assertTrue(line, 'event stream closed')
+            if line.startswith(b'id:'):
+                event_id = line[len(b'id:'):].strip().decode('ascii')
+            elif line.startswith(b'data:'):
+                return json.loads(line[len(b'data:'):]), event_id
+
+    def patch(self, sock, f, record_id, values):
+        body = json.dumps(values).encode('utf-8')
+        sock.sendall(f'PATCH /api/records/v1/people/{record_id} HTTP/1.1\r\nHost: test\r\n'.encode('ascii')
+                     + b'Content-Type: application/json\r\n'
+                     + f'Content-Length: {len(body)}\r\n\r\n'.encode('ascii') + body)
+        return read_response(f)
+
+    def test_patch_is_broadcast(self):
+        events = self.subscribe('/api/records/v1/people/subscribe/*')
+        sock, f = self.connect()
+        status, headers, body = self.patch(sock, f, 2, {'age': 31})
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)['age'], 31)
+        data = self.next_event(events)[0]
+        self.assertEqual((data['Update']['id'], data['Update']['age']), (2, 31))
+
+class AsyncioRecordsAPITests(RecordsAPITests):
+    engine = 'asyncio'
+
+class StalledUpstreamTests(ServerTestCase):
+    def setUp(self):
+        super().setUp()
+        # Accepts connections (into its backlog) but never answers them
+        self.upstream = socket.create_server(('127.0.0.1', 0))
+        broadcaster = EventBroadcaster()
+        self.addCleanup(broadcaster.close)
+        url = 'http://127.0.0.1:%d' % self.upstream.getsockname()[1]
+        self.address = self.serve(records_proxy=RecordsProxy(url, broadcaster))
+        # Closed first, so requests waiting on it fail instead of timing out
+        self.addCleanup(self.upstream.close)
+
+    def test_forwarded_request_does_not_hold_up_others(self):
+        stalled, stalled_f = self.connect()
+        stalled.sendall(b'DELETE /api/records/v1/people/2 HTTP/1.1\r\nHost: test\r\n\r\n')
+        time.sleep(0.2)
+        sock, f = self.connect()
+        start = time.monotonic()
+        self.assertEqual(self.request(sock, f, '/')[0], 200)
+        self.assertLess(time.monotonic() - start, 1)
+        # Resets the connections waiting in its backlog
+        self.upstream.close()
+        self.assertEqual(read_response(stalled_f)[0], 502)
+
+    def test_malformed_chunked_body(self):
+        sock, f = self.connect()
+        sock.sendall(b'PATCH /api/records/v1/people/2 HTTP/1.1\r\nHost: test\r\n'
+                     b'Transfer-Encoding: chunked\r\n\r\nnot-a-size\r\n')
+        if self.engine == 'asyncio':
+            # The chunk framing is read before the handler runs
+            self.assertEqual(f.read(), b'')
+            return
+        status, headers, body = read_response(f)
+        self.assertEqual((status, json.loads(body)), (400, {'error': 'malformed request body'}))
+
+class AsyncioStalledUpstreamTests(StalledUpstreamTests):
+    engine = 'asyncio'
+
+class Relay:
+    """TCP relay to `target` whose open connections can be cut."""
+
+    def __init__(self, target):
+        self.target = target
+        self.listener = socket.create_server(('127.0.0.1', 0))
+        self.address = self.listener.getsockname()
+        self.sockets = []
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def cut(self):
+        sockets, self.sockets = self.sockets, []
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def close(self):
+        self.cut()
+        # Wakes the accept() below
+        self.listener.shutdown(socket.SHUT_RDWR)
+        self.listener.close()
+
+    def _accept(self):
+        while True:
+            try:
+                client = self.listener.accept()[0]
+                server = socket.create_connection(self.target)
+            except OSError:
+                return
+            self.sockets += [client, server]
+            for source, sink in ((client, server), (server, client)):
+                threading.Thread(target=self._pump, args=(source, sink), daemon=True).start()
+
+    def _pump(self, source, sink):
+        try:
+            while data := source.recv(65536):
+                sink.sendall(data)
+        except OSError:
+            pass
+        finally:
+            source.close()
+
+class RecordsProxyTests(RecordsAPITests):
+    def setUp(self):
+        super().setUp()
+        self.upstream = self.handler.records_api
+        self.relay = Relay(self.address)
+        self.addCleanup(self.relay.close)
+        self.proxy = RecordsProxy('http://%s:%d' % self.relay.address, EventBroadcaster())
+        self.addCleanup(self.proxy.broadcaster.close)
+        self.upstream_address, self.address = self.address, self.serve(records_proxy=self.proxy)
+
+    def test_forward(self):
+        sock, f = self.connect()
+        status, headers, body = self.patch(sock, f, 2, {'age': 31})
+        self.assertEqual((status, json.loads(body)['age']), (200, 31))
+        self.assertEqual(self.upstream.read('people', 2)['age'], 31)
+        status, headers, body = self.request(sock, f, '/api/records/v1/people/2')
+        self.assertEqual((status, json.loads(body)['age']), (200, 31))
+        self.assertEqual(headers['cache-control'], 'no-store')
+        # Upstream errors are passed on as they are
+        self.assertEqual(self.request(sock, f, '/api/records/v1/people/999')[0], 404)
+
+    def test_one_upstream_stream_per_topic(self):
+        first = self.subscribe('/api/records/v1/people/subscribe/*')
+        second = self.subscribe('/api/records/v1/people/subscribe/*')
+        self.wait_for(lambda: self.upstream.broadcaster.topics)
+        sock, f = self.connect(self.upstream_address)
+        self.patch(sock, f, 2, {'age': 31})
+        for events in (first, second):
+            self.assertEqual(self.next_event(events)[0]['Update']['age'], 31)
+        self.assertEqual(self.proxy.connects, 1)
+        self.assertEqual(sum(self.upstream.broadcaster.topics.values()), 1)
+
+    def test_reconnect_resumes_after_last_event(self):
+        events = self.subscribe('/api/records/v1/people/subscribe/*')
+        self.wait_for(lambda: self.upstream.broadcaster.topics)
+        sock, f = self.connect(self.upstream_address)
+        self.patch(sock, f, 2, {'age': 31})
+        self.assertEqual(self.next_event(events)[0]['Update']['age'], 31)
+
+        self.relay.cut()
+        self.wait_for(lambda: not self.upstream.broadcaster.topics)
+        # Missed while the proxy is away, then replayed after its Last-Event-ID
+        self.patch(sock, f, 2, {'age': 32})
+        self.patch(sock, f, 2, {'age': 33})
+        self.assertEqual([self.next_event(events)[0]['Update']['age'] for _ in range(2)], [32, 33])
+        self.assertEqual(self.proxy.connects, 2)
+        self.assertGreaterEqual(self.proxy.reconnects, 1)
+
+class AdmissionControlTests(unittest.TestCase):
+    def test_token_bucket_refill(self):
+        admission = AdmissionControl(max_connections=0, rate=2, burst=3, max_expensive=0)
+        now = [100.0]
+        with mock.patch.object(spa_server.time, 'monotonic', lambda: now[0]):
+            self.assertEqual([admission.throttle('a') for _ in range(3)], [0, 0, 0])
+            self.assertAlmostEqual(admission.throttle('a'), 0.5)
+            # Other clients have their own bucket
+            self.assertEqual(admission.throttle('b'), 0)
+            now[0] += 0.5
+            self.assertEqual(admission.throttle('a'), 0)
+            self.assertGreater(admission.throttle('a'), 0)
+            # Refills stop at `burst`
+            now[0] += 60
+            self.assertEqual([admission.throttle('a') for _ in range(3)], [0, 0, 0])
+            self.assertGreater(admission.throttle('a'), 0)
+        self.assertEqual(admission.shed['rate'], 3)
+
+    def test_no_rate_limit(self):
+        admission = AdmissionControl(max_connections=0, rate=0, burst=0, max_expensive=0)
+        self.assertEqual([admission.throttle('a') for _ in range(100)], [0] * 100)
+
+    def test_connections_and_expensive(self):
+        admission = AdmissionControl(max_connections=1, rate=0, burst=0, max_expensive=1)
+        self.assertTrue(admission.open_connection())
+        self.assertFalse(admission.open_connection())
+        admission.close_connection()
+        self.assertTrue(admission.open_connection())
+        self.assertTrue(admission.acquire_expensive())
+        self.assertFalse(admission.acquire_expensive())
+        admission.release_expensive()
+        self.assertTrue(admission.acquire_expensive())
+        self.assertEqual(admission.shed, {'connections': 1, 'rate': 0, 'expensive': 1})
+
+
+class AdmissionServingTests(ServerTestCase):
+    def test_connections_over_the_limit_are_shed(self):
+        # serve() keeps its warm-up connection open
+        self.address = self.serve(admission=AdmissionControl(max_connections=2, rate=0, burst=0, max_expensive=0))
+        sock, f = self.connect()
+        self.assertEqual(self.request(sock, f, '/')[0], 200)
+        shed, shed_f = self.connect()
+        status, headers, body = read_response(shed_f)
+        self.assertEqual((status, headers['retry-after']), (503, str(SHED_RETRY_AFTER)))
+        self.assertEqual(shed_f.read(), b'')
+        self.assertEqual(self.request(sock, f, '/app.js')[0], 200)
+
+    def test_rate_limit(self):
+        # One token goes to the warm-up request
+        self.address = self.serve(admission=AdmissionControl(max_connections=0, rate=1, burst=2, max_expensive=0))
+        sock, f = self.connect()
+        self.assertEqual(self.request(sock, f, '/')[0], 200)
+        status, headers, body = self.request(sock, f, '/')
+        self.assertEqual((status, headers['retry-after']), (429, '1'))
+        # The connection stays usable
+        self.assertNotEqual(headers.get('connection'), 'close')
+
+class AsyncioAdmissionServingTests(AdmissionServingTests):
+    engine = 'asyncio'
+
+class AssetPackTests(unittest.TestCase):
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = os.path.join(tmp, 'site')
+            make_tree(root)
+            write(os.path.join(root, 'app.js.gz'), b'not really gzip')
+            out = os.path.join(tmp, 'app.pack')
+            self.assertEqual(pack_assets(root, out), 4)
+            pack = AssetPack(out)
+            manifest = RouteManifest(root)
+            for url_path, entry in manifest.routes.items():
+                asset, is_fallback = pack.resolve(url_path)
+                self.assertFalse(is_fallback, url_path)
+                with open(entry.path, 'rb') as f:
+                    self.assertEqual(bytes(asset.body), f.read(), url_path)
+                self.assertEqual(asset.content_type, entry.content_type)
+            self.assertIs(pack.resolve('/')[0], pack.resolve('/index.html')[0])
+            self.assertIs(pack.resolve('/people/2')[0], pack.resolve('/')[0])
+            self.assertTrue(pack.resolve('/.env')[1])
+            variant = pack.resolve('/app.js')[0].variants['gzip']
+            self.assertEqual(bytes(variant.body), b'not really gzip')
+            self.assertEqual(variant.content_type, pack.resolve('/app.js')[0].content_type)
+
+    def test_rejects_other_files(self):
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(b'not a pack at all')
+            f.flush()
+            with self.assertRaises(ValueError):
+                AssetPack(f.name)
+
+
+class PackedServingTests(ServerTestCase):
+    def setUp(self):
+        super().setUp()
+        write(os.path.join(self.root, 'app.js.gz'), gzip.compress(APP_JS))
+        out = os.path.join(self.tmp, 'app.pack')
+        pack_assets(self.root, out)
+        self.pack = AssetPack(out)
+        # Served from the pack alone, not from the tree
+        self.address = self.serve(os.path.join(self.tmp, 'missing'), asset_pack=self.pack)
+
+    def test_files_and_fallback(self):
+        sock, f = self.connect()
+        status, headers, body = self.request(sock, f, '/app.js')
+        self.assertEqual((status, body), (200, APP_JS))
+        etag = headers['etag']
+        self.assertEqual(etag, self.pack.resolve('/app.js')[0].etag)
+        self.assertEqual(self.request(sock, f, '/people/2')[::2], (200, INDEX_HTML))
+        status, headers, body = self.request(sock, f, '/app.js', headers=b'Accept-Encoding: gzip\r\n')
+        self.assertEqual((headers['content-encoding'], gzip.decompress(body)), ('gzip', APP_JS))
+        self.assertEqual(self.request(sock, f, '/app.js', headers=f'If-None-Match: {etag}\r\n'.encode('ascii'))[0], 304)
+
+class AsyncioPackedServingTests(PackedServingTests):
+    engine = 'asyncio'
+
+if __name__ == '__main__':
+    unittest.main()